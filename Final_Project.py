@@ -51,26 +51,55 @@ We also hope to analyze the most 5 or 10 years instead of just the last
 
 '''
 
-import matplotlib.pyplot as plt
+import os
+import sys
+
 import pandas as pd  # useful library to handle dataframe
 import numpy as np  # useful library to handle array and computation
 
+import instrument  # named timing/memory spans, off unless enabled
+from instrument import span, traced
+from loader import load_csv  # column-projected csv parsing
+from periods import is_calendar_q4, last_quarters  # integer quarter keys
+from prices import DATE_FORMAT, align_prices  # date-keyed price lookup
+from ratios import RATIOS, compute_ratios  # vectorized ratio engine
+from regression import fit_line, fit_panel  # lines of best fit and corr
+from robust import CORR_FUNCTIONS  # rank-based and outlier-proof measures
+from scan import scan_correlations  # every column vs. price in one pass
+
 APPLE_FILE = "apple_ds.csv"
 APPLE_PRICE_FILE = "AAPL_Project.csv"
 GOOGLE_FILE = "googl_ds.csv"
 GOOGLE_PRICE_FILE = "GOOGL_Project.csv"
 
-def read_csv(infile):
+def get_pyplot():
+    '''
+    Function will import matplotlib's pyplot the first time a graph is drawn
+    
+    Function will take nothing
+    
+    Function will return the pyplot module
+    '''
+    # Importing pyplot takes longer than everything else here put together,
+    # so runs that only want numbers never pay for it
+    import matplotlib.pyplot as plt
+    
+    return plt
+
+@traced()
+def read_csv(infile, ratios=None, columns=None, cache=False):
     '''
     Function will read in our csv file 
     
-    Function will take a infile
+    Function will take a infile, optionally the ratios we are going to
+    compute and any extra columns we need (only those columns are parsed),
+    and whether to load through the binary columnar cache
 
     Function will return a dataframe
     '''
     
     # Creates a dataframe with the data from the file
-    df = pd.read_csv(infile)
+    df = load_csv(infile, ratios, columns, cache)
         
     return df
 
@@ -83,9 +112,9 @@ def df_slice(df, periods):
     Function will return a new df
     '''
     # for example, 40 quarters = 10 years
-    # so we must slice up to 84-40 or 44
-    slice_int = 84 - periods
-    df2 = df.drop(df.index[:slice_int])
+    # so with our 84 quarters we keep the last 40 calendar quarters
+    # (rolling.rolling_scan slides a window like this over all of history)
+    df2 = df[last_quarters(df, periods)]
     # Fixing indexing after slicing
     df2 = df2.reset_index()
     
@@ -101,15 +130,8 @@ def get_colors(df):
     Function will return nothing but update data to contain a color based on
     the report
     '''
-    # Creates a new element in the header and sets all values to NaN
-    df["clean_color"] = np.nan
-    
-    # If it's the 4th quarter, red will be appended to the corresponding row.
-    for i in range(0, df.shape[0]):
-        if 'Q4' in df.loc[i, 'datacqtr']:
-            df.loc[i, 'clean_color'] = 'red'
-        else:
-            df.loc[i, 'clean_color'] = 'blue'
+    # If it's the 4th quarter red goes on the row, otherwise blue
+    df["clean_color"] = np.where(is_calendar_q4(df), 'red', 'blue')
             
         
 def get_stats(desired_stat, df):
@@ -129,23 +151,25 @@ def get_stats(desired_stat, df):
         
     return stat_list
 
-def get_stock_price(df, price_df):
+@traced()
+def get_stock_price(df, price_df, mode="on_or_before", date_col="datadate"):
     '''
     Function will get the stock price at the end of each quarter 
     and add it to a column in the dataframe
     
-    Function will take our main dataframe and the dataframe containing our
-    price information
+    Function will take our main dataframe, the dataframe containing our
+    price information, how to match dates ("on_or_before" for the last price
+    on or before the quarter end, "after" for the first price after a filing
+    date, "on_or_after") and the date column of the main dataframe
 
     Function will return nothing, just add a column to the main dataframe
     '''
     
-    # Creates a new column in the main dataframe and sets all the values to NaN
-    df["stock_price"] = np.nan
-    for i in range(0, df.shape[0]):
-        # Appends every Adj Price to its corresponding row in the main dataframe
-        df.loc[i, "stock_price"] = price_df.loc[i, "Adj Close"]  
+    # Joins every row to its price by date (and ticker when the price file
+    # has several) instead of by row position
+    df["stock_price"] = align_prices(df, price_df, date_col, mode)
         
+@traced()
 def calc_cur_ratio(df):
     '''
     Function will calculate the current ratio (Current assets/current
@@ -155,19 +179,18 @@ def calc_cur_ratio(df):
     
     Function will return northing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['cur_ratio'] = np.nan
-    
-    # Calculates the current ratio and sets it to its corresponding location
-    # in the dataframe
-    for i in range(0, df.shape[0]):
-        df.loc[i, 'cur_ratio'] = df.loc[i, 'actq'] / df.loc[i, 'lctq']
+    # Calculates the current ratio for every row at once and adds it to the
+    # dataframe
+    compute_ratios(df, ['cur_ratio'])
 
-def calc_corr(df1, df2):
+@traced()
+def calc_corr(df1, df2, method="pearson"):
     '''
     Function will calculate the correlation between two columns in a dataframe
 
-    Function will take in a dataframe
+    Function will take in two columns and the measure ("pearson", or
+    "spearman", "kendall", "biweight", "winsorized" from robust.py, which
+    outliers don't dominate)
 
     Function will return a float that represents the correlation between -1.0
     and 1.0
@@ -175,10 +198,42 @@ def calc_corr(df1, df2):
     '''
     
     # Calculates correlation
-    correlation = df1.corr(df2)
+    if method == "pearson":
+        correlation = df1.corr(df2)
+    else:
+        r, _ = CORR_FUNCTIONS[method](
+            df1.to_numpy(dtype=float, na_value=np.nan)[:, None],
+            df2.to_numpy(dtype=float, na_value=np.nan)[:, None],
+            min_periods=1)
+        correlation = float(r[0, 0])
     
     return correlation
 
+# The ratios the graph functions draw, plus r&d expense
+GRAPHED_COLUMNS = ['cur_ratio', 'roa_ratio', 'roe_ratio', 'profit_margin',
+                   'inventory_turnover', 'debt_to_equity', 'cf_capex', 'xrdq']
+
+@traced()
+def calc_results(df, columns=GRAPHED_COLUMNS):
+    '''
+    Function will calculate the ratios and their fit against the stock price
+    without drawing anything
+    
+    Function will take in a dataframe with one or many companies (and a
+    stock_price column) and the ratios or columns we want
+    
+    Function will return a dataframe with the slope, intercept, correlation,
+    r2, standard errors and number of quarters for every (ticker, column)
+    '''
+    # Computes any of the ratios that aren't in the dataframe yet
+    ratios = [name for name in columns
+              if name not in df.columns and name in RATIOS]
+    if ratios:
+        compute_ratios(df, ratios)
+    
+    return fit_panel(df, columns)
+
+@traced()
 def graph_cur_ratio_to_stock(df, company):
     '''
     Function will graph the stock price against the current ratio
@@ -187,6 +242,7 @@ def graph_cur_ratio_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -194,15 +250,16 @@ def graph_cur_ratio_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['cur_ratio'])
     
-    # Calculaates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['cur_ratio'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['cur_ratio'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    cur_ratio_to_stock_corr = calc_corr(df['stock_price'], df['cur_ratio'])
+    # Correlation of these two points, from the same fit
+    cur_ratio_to_stock_corr = fit['corr']
     
     # Important graphing functions
     fig_title = company + " Share Price vs. Current Ratio"
@@ -215,11 +272,13 @@ def graph_cur_ratio_to_stock(df, company):
     
     # different fig name based on the company
     fig_name = company + "_SharePrice_to_CurrentRatio.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("Current Ratio Correlation: ",cur_ratio_to_stock_corr)
 
+@traced()
 def calc_roa_ratio(df):
     '''
     Function will calculate the return on assets (net income / average total
@@ -229,19 +288,13 @@ def calc_roa_ratio(df):
     
     Function will return nothing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['roa_ratio'] = np.nan
-    
-    # Calculates the roa and sets it to its corresponding location in the
-    # dataframe
+    # Calculates the roa for every row at once and adds it to the dataframe
     
     # Our denominator is usually an average with the previous quarter
     # So for the first quarter we are not taking an average
-    df.loc[0, 'roa_ratio'] = df.loc[0, 'niq'] / df.loc[0, 'atq']
-    for i in range(1, df.shape[0]):
-        average_atq = (df.loc[i, 'atq'] + df.loc[i-1, 'atq']) / 2
-        df.loc[i, 'roa_ratio'] = df.loc[i, 'niq'] / average_atq
+    compute_ratios(df, ['roa_ratio'])
 
+@traced()
 def graph_roa_ratio_to_stock(df, company):
     '''
     Function will graph the stock price against the roa ratio
@@ -250,6 +303,7 @@ def graph_roa_ratio_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -257,15 +311,16 @@ def graph_roa_ratio_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['roa_ratio'])
     
-    # Calculates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['roa_ratio'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['roa_ratio'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    roa_ratio_to_stock_corr = calc_corr(df['stock_price'], df['roa_ratio'])
+    # Correlation of these two points, from the same fit
+    roa_ratio_to_stock_corr = fit['corr']
 
     fig_title = company + " Share Price vs. Return on Assets"
     plt.title(fig_title)
@@ -277,11 +332,13 @@ def graph_roa_ratio_to_stock(df, company):
     
     # different fig name based on the company
     fig_name = company + "_SharePrice_to_ReturnOnAssets.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("ROA Correlation: ",roa_ratio_to_stock_corr)
 
+@traced()
 def calc_roe_ratio(df):
     '''
     Function will calculate the return on equity (net income / average
@@ -291,19 +348,13 @@ def calc_roe_ratio(df):
     
     Function will return nothing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['roe_ratio'] = np.nan
-    
-    # Calculates the roe and sets it to its corresponding location in the
-    # dataframe
+    # Calculates the roe for every row at once and adds it to the dataframe
     
     # Our denominator is usually an average with the previous quarter
     # So for the first quarter we are not taking an average
-    df.loc[0, 'roe_ratio'] = df.loc[0, 'niq'] / df.loc[0, 'seqq']
-    for i in range(1, df.shape[0]):
-        average_seqq = (df.loc[i, 'seqq'] + df.loc[i-1, 'seqq']) / 2
-        df.loc[i, 'roe_ratio'] = df.loc[i, 'niq'] / average_seqq
+    compute_ratios(df, ['roe_ratio'])
 
+@traced()
 def graph_roe_ratio_to_stock(df, company):
     '''
     Function will graph the stock price against the roe ratio
@@ -312,6 +363,7 @@ def graph_roe_ratio_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -319,15 +371,16 @@ def graph_roe_ratio_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['roe_ratio'])
     
-    # Calculates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['roe_ratio'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['roe_ratio'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    roe_ratio_to_stock_corr = calc_corr(df['stock_price'], df['roe_ratio'])
+    # Correlation of these two points, from the same fit
+    roe_ratio_to_stock_corr = fit['corr']
     
     fig_title = company + " Share Price vs. Return on Equity"
     plt.title(fig_title)
@@ -338,11 +391,13 @@ def graph_roe_ratio_to_stock(df, company):
     plt.legend()
     
     fig_name = company + "_SharePrice_to_ReturnOnEquity.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("ROE Correlation: ",roe_ratio_to_stock_corr)      
 
+@traced()
 def calc_profit_margin(df):
     '''
     Function will calculate the net profit margin (net income / net sales
@@ -352,15 +407,11 @@ def calc_profit_margin(df):
     
     Function will return nothing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['profit_margin'] = np.nan
-    
-    # Calculates the net profit margin and sets it to its corresponding
-    # location in the dataframe
-    
-    for i in range(0, df.shape[0]):
-        df.loc[i, 'profit_margin'] = df.loc[i, 'niq'] / df.loc[i, 'saleq']
+    # Calculates the net profit margin for every row at once and adds it to
+    # the dataframe
+    compute_ratios(df, ['profit_margin'])
     
+@traced()
 def graph_profit_margin_to_stock(df, company):
     '''
     Function will graph the stock price against the net profit margin
@@ -369,6 +420,7 @@ def graph_profit_margin_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -376,16 +428,16 @@ def graph_profit_margin_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['profit_margin'])
     
-    # Calculates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['profit_margin'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['profit_margin'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    profit_margin_to_stock_corr = calc_corr(df['stock_price'],
-                                            df['profit_margin'])
+    # Correlation of these two points, from the same fit
+    profit_margin_to_stock_corr = fit['corr']
 
     fig_title = company + " Share Price vs. Net Profit Margin"
     plt.title(fig_title)
@@ -396,11 +448,13 @@ def graph_profit_margin_to_stock(df, company):
     plt.legend()
     
     fig_name = company + "_SharePrice_to_NetProfitMargin.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("Profit Margin Stock Correlation: ",profit_margin_to_stock_corr)
 
+@traced()
 def calc_inventory_turnover(df):
     '''
     Function will calculate the inventory turnover (cost of goods sold / 
@@ -410,19 +464,14 @@ def calc_inventory_turnover(df):
     
     Function will return nothing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['inventory_turnover'] = np.nan
-    
-    # Calculates the inventory turnover and sets it to its corresponding
-    # location in the dataframe
+    # Calculates the inventory turnover for every row at once and adds it to
+    # the dataframe
     
     # Our denominator is usually an average with the previous quarter
     # So for the first quarter we are not taking an average
-    df.loc[0, 'inventory_turnover'] = df.loc[0, 'cogsq'] / df.loc[0, 'invtq']
-    for i in range(1, df.shape[0]):
-        average_atq = (df.loc[i, 'invtq'] + df.loc[i-1, 'invtq']) / 2
-        df.loc[i, 'inventory_turnover'] = df.loc[i, 'cogsq'] / average_atq
+    compute_ratios(df, ['inventory_turnover'])
         
+@traced()
 def graph_inventory_turnover_to_stock(df, company):
     '''
     Function will graph the stock price against inventory turnover
@@ -431,6 +480,7 @@ def graph_inventory_turnover_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -438,16 +488,16 @@ def graph_inventory_turnover_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['inventory_turnover'])
     
-    # Calculates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['inventory_turnover'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['inventory_turnover'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    inventory_turnover_to_stock_corr = calc_corr(df['stock_price'],
-                                                 df['inventory_turnover'])
+    # Correlation of these two points, from the same fit
+    inventory_turnover_to_stock_corr = fit['corr']
 
     fig_title = company + " Share Price vs. Inventory Turnover Ratio"
     plt.title(fig_title)
@@ -458,7 +508,8 @@ def graph_inventory_turnover_to_stock(df, company):
     plt.legend()
     
     fig_name = company + "_SharePrice_to_InventoryTurnover.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("Inventory Turnover Stock Correlation: ",
@@ -466,6 +517,7 @@ def graph_inventory_turnover_to_stock(df, company):
 
 
 
+@traced()
 def calc_debt_to_equity(df):
     '''
     Function will calculate the debt to equity ratio (total liabilities /
@@ -475,14 +527,11 @@ def calc_debt_to_equity(df):
     
     Function will return northing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['debt_to_equity'] = np.nan
-    
-    # Calculates the debt to equity ratio and sets it to its corresponding
-    # location in the dataframe
-    for i in range(0, df.shape[0]):
-        df.loc[i, 'debt_to_equity'] = df.loc[i, 'ltq'] / df.loc[i, 'seqq']
+    # Calculates the debt to equity ratio for every row at once and adds it
+    # to the dataframe
+    compute_ratios(df, ['debt_to_equity'])
 
+@traced()
 def graph_debt_to_equity_to_stock(df, company):
     '''
     Function will graph the stock price against the debt to equity ratio
@@ -491,6 +540,7 @@ def graph_debt_to_equity_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -498,16 +548,16 @@ def graph_debt_to_equity_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['debt_to_equity'])
     
-    # Calculaates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['debt_to_equity'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['debt_to_equity'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    debt_to_equity_to_stock_corr = calc_corr(df['stock_price'],
-                                             df['debt_to_equity'])
+    # Correlation of these two points, from the same fit
+    debt_to_equity_to_stock_corr = fit['corr']
     
     fig_title = company + " Share Price vs. Debt to Equity Ratio"
     plt.title(fig_title)
@@ -518,11 +568,13 @@ def graph_debt_to_equity_to_stock(df, company):
     plt.legend()
     
     fig_name = company + "_SharePrice_to_DebtToEquity.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("Debt to Equity Stock Correlation: ",debt_to_equity_to_stock_corr)
     
+@traced()
 def calc_cf_capex(df):
     '''
     Function will calculate the cash flow to capital expenditure ratio
@@ -532,16 +584,11 @@ def calc_cf_capex(df):
     
     Function will return northing and just add a column to the dataframe
     '''
-    # Creats a new column in the dataframe
-    df['cf_capex'] = np.nan
-    
-    # Calculates the debt to equity ratio and sets it to its corresponding
-    # location in the dataframe
-    for i in range(0, df.shape[0]):
-        cashflow_total = df.loc[i, 'oancfy'] + df.loc[i, 'ivncfy'] + \
-            df.loc[i, 'fincfy']
-        df.loc[i, 'cf_capex'] = cashflow_total / df.loc[i, 'capxy']
+    # Calculates the cf/capex ratio for every row at once and adds it to the
+    # dataframe (cash flow is oancfy + ivncfy + fincfy)
+    compute_ratios(df, ['cf_capex'])
         
+@traced()
 def graph_cf_capex_to_stock(df, company):
     '''
     Function will graph the stock price against the cf to capex ratio
@@ -550,6 +597,7 @@ def graph_cf_capex_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -557,15 +605,16 @@ def graph_cf_capex_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['cf_capex'])
     
-    # Calculaates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['cf_capex'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['cf_capex'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    cf_capex_to_stock_corr = calc_corr(df['stock_price'], df['cf_capex'])
+    # Correlation of these two points, from the same fit
+    cf_capex_to_stock_corr = fit['corr']
 
     fig_title = company + " Share Price vs. Cash Flow to Capital Expenditures"
     plt.title(fig_title)
@@ -576,11 +625,13 @@ def graph_cf_capex_to_stock(df, company):
     plt.legend()
     
     fig_name = company + "_SharePrice_to_CFCapEX.png"
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("CF to CapEX Stock Correlation: ",cf_capex_to_stock_corr)
     
+@traced()
 def graph_rnd_to_stock(df, company):
     '''
     Function will graph the stock price against the rnd expense
@@ -589,6 +640,7 @@ def graph_rnd_to_stock(df, company):
     
     Function will return nothing, just creates a plot
     '''
+    plt = get_pyplot()
     
     # Makes the plot bigger
     plt.figure(figsize= (16,12))
@@ -596,15 +648,16 @@ def graph_rnd_to_stock(df, company):
     # Plots the points as a scatter plot
     plt.scatter(df['stock_price'], df['xrdq'])
     
-    # Calculaates the slope and y-intercept of the line of best fit
-    m, b = np.polyfit(df['stock_price'], df['xrdq'], 1)
+    # Calculates the slope, y-intercept and correlation in one pass
+    fit = fit_line(df['stock_price'], df['xrdq'])
+    m, b = fit['slope'], fit['intercept']
     
     # Plots the line of best fit
     plt.plot(df['stock_price'], m*df['stock_price'] + b, "--", color = "Red",
              label = "Line-of-Best-Fit")
     
-    # Calculates the correlation of these two points
-    r_and_d_to_stock_corr = calc_corr(df['stock_price'], df['xrdq'])
+    # Correlation of these two points, from the same fit
+    r_and_d_to_stock_corr = fit['corr']
 
     fig_title = company + " Share Price vs. Research and Development Expense"
     plt.title(fig_title)
@@ -616,13 +669,35 @@ def graph_rnd_to_stock(df, company):
     
     fig_name = company + "_SharePrice_to_RND.png"
     
-    plt.savefig(fig_name)
+    with span("savefig", file=fig_name):
+        plt.savefig(fig_name)
     
     plt.show()
     print("R&D Stock Correlation: ",r_and_d_to_stock_corr)
     
 if __name__ == "__main__":
     
+    # FINANCE_TRACE=trace.json records a timing/memory span for every stage
+    trace_file = os.environ.get(instrument.TRACE_ENV)
+    if trace_file:
+        instrument.enable()
+    
+    # python Final_Project.py --compute-only prints the numbers behind every
+    # graph without importing matplotlib
+    if "--compute-only" in sys.argv:
+        aapl = read_csv(APPLE_FILE)
+        googl = read_csv(GOOGLE_FILE)
+        aapl['datadate'] = pd.to_datetime(aapl['datadate'],
+                                          format=DATE_FORMAT)
+        googl['datadate'] = pd.to_datetime(googl['datadate'],
+                                           format=DATE_FORMAT)
+        get_stock_price(aapl, read_csv(APPLE_PRICE_FILE))
+        get_stock_price(googl, read_csv(GOOGLE_PRICE_FILE),
+                        mode="on_or_after")
+        panel = pd.concat([aapl, googl], ignore_index=True)
+        print(calc_results(panel).to_string(index=False))
+        sys.exit(0)
+    
     # Creates our main dataframe
     aapl = read_csv(APPLE_FILE)
     googl = read_csv(GOOGLE_FILE)
@@ -633,8 +708,12 @@ if __name__ == "__main__":
     
     
     # Converts the date and time from string to date types for Pandas to read
-    aapl['datadate'] = pd.to_datetime(aapl['datadate'])
-    googl['datadate'] = pd.to_datetime(googl['datadate'])
+    with span("to_datetime", rows=len(aapl)):
+        aapl['datadate'] = pd.to_datetime(aapl['datadate'],
+                                          format=DATE_FORMAT)
+    with span("to_datetime", rows=len(googl)):
+        googl['datadate'] = pd.to_datetime(googl['datadate'],
+                                           format=DATE_FORMAT)
     # df for the last x quarters
     aapl_20 = df_slice(aapl, 20)
     googl_20 = df_slice(googl, 20)
@@ -646,8 +725,10 @@ if __name__ == "__main__":
     
     # Gets the stock price at the end of each quarter and adds it to the
     # company specific dataframe
+    # Google's monthly prices are dated the first trading day of the next
+    # month, so we take the first price on or after the quarter end
     get_stock_price(aapl, aapl_price_df)
-    get_stock_price(googl, googl_price_df)
+    get_stock_price(googl, googl_price_df, mode="on_or_after")
     # Calculates the current ratio and adds it to the respective dataframe
     calc_cur_ratio(aapl)
     calc_cur_ratio(googl)
@@ -725,4 +806,14 @@ if __name__ == "__main__":
     # Graphs the r&d expense against the stock price and its line of best fit
     # Also prints the correlation between the data points
     graph_rnd_to_stock(aapl, "Apple")
-    graph_rnd_to_stock(googl, "Google")
\ No newline at end of file
+    graph_rnd_to_stock(googl, "Google")
+    
+    # Correlates every numeric column and ratio against the stock price for
+    # both companies at once and prints the strongest ones
+    panel = pd.concat([aapl, googl], ignore_index=True)
+    print(scan_correlations(panel, top_k=10))
+    
+    # Saves the spans for chrome://tracing or ui.perfetto.dev
+    if trace_file:
+        instrument.write_trace(trace_file)
+        print(instrument.summary())
\ No newline at end of file
@@ -0,0 +1,424 @@
+'''
+Benchmark suite with a synthetic Compustat-shaped data generator
+
+We only have two firms x 84 quarters, far too little to tell whether a
+ change made get_stock_price, get_colors, calc_*, calc_corr or graph_* faster
+ or slower. This module generates panels that look like apple_ds.csv (same
+ column names, each column's share of missing values and typical size taken
+ from the template, zeros injected like Google's invtq) along with matching
+ price files. It then times every pipeline stage at several scales and
+ writes the results as JSON so two runs can be compared.
+
+Run it as a script:
+    python bench.py --scales 10x84 100x84 1000x84 --out bench.json
+    python bench.py --compare old.json bench.json
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")  # charts are timed, never shown
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+import Final_Project
+from loader import KEY_COLUMNS
+from ratios import RATIOS, ratio_columns
+from scan import scan_correlations
+
+# Found next to this file, so the bench runs from any directory
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "apple_ds.csv")
+
+# (firms, quarters) pairs timed when no scales are given
+SCALES = ((10, 84), (100, 84), (1000, 84))
+
+# Share of firms whose inventory is reported as 0, like Google
+ZERO_SHARE = 0.1
+# Extra share of values blanked out on top of the template's own gaps
+NAN_SHARE = 0.02
+
+# Charts are slow, so graph_* is only timed for this many firms
+GRAPH_FIRMS = 2
+
+# The Final_Project function behind each ratio column
+CALC_FUNCTIONS = {
+    "cur_ratio": "calc_cur_ratio",
+    "roa_ratio": "calc_roa_ratio",
+    "roe_ratio": "calc_roe_ratio",
+    "profit_margin": "calc_profit_margin",
+    "inventory_turnover": "calc_inventory_turnover",
+    "debt_to_equity": "calc_debt_to_equity",
+    "cf_capex": "calc_cf_capex",
+}
+
+GRAPH_FUNCTIONS = {
+    "cur_ratio": "graph_cur_ratio_to_stock",
+    "roa_ratio": "graph_roa_ratio_to_stock",
+    "roe_ratio": "graph_roe_ratio_to_stock",
+    "profit_margin": "graph_profit_margin_to_stock",
+    "inventory_turnover": "graph_inventory_turnover_to_stock",
+    "debt_to_equity": "graph_debt_to_equity_to_stock",
+    "cf_capex": "graph_cf_capex_to_stock",
+}
+
+
+def template_profile(template=TEMPLATE_FILE):
+    '''
+    Function will describe every column of a real Compustat export
+
+    Function will take the template csv file
+
+    Function will return a dict with the column order, the constant values
+    of the other columns (indfmt, curcdq, exchg, ...), and for each float
+    column its share of missing values, typical
+    size and share of negative values
+    '''
+    df = pd.read_csv(template)
+    numeric = {}
+    for name in df.columns:
+        if name in KEY_COLUMNS or \
+                not pd.api.types.is_float_dtype(df[name]):
+            continue
+        values = df[name].to_numpy(dtype=float)
+        finite = values[np.isfinite(values)]
+        numeric[name] = {
+            "missing": float(1 - len(finite) / len(values)),
+            "scale": float(np.median(np.abs(finite))) if len(finite) else 1.0,
+            "negative": float(np.mean(finite < 0)) if len(finite) else 0.0,
+        }
+
+    text = {name: df[name].iloc[0] for name in df.columns
+            if name not in numeric and name not in KEY_COLUMNS}
+
+    return {"columns": list(df.columns), "numeric": numeric, "text": text}
+
+
+def quarter_ends(n_quarters, last="2020-12-31"):
+    '''
+    Function will list consecutive calendar quarter ends
+
+    Function will take the number of quarters and the last quarter end
+
+    Function will return a DatetimeIndex, oldest first
+    '''
+    return pd.date_range(end=last, periods=n_quarters, freq="QE")
+
+
+def synthetic_panel(n_firms, n_quarters, n_columns=None, zero_share=ZERO_SHARE,
+                    nan_share=NAN_SHARE, seed=0, profile=None):
+    '''
+    Function will generate a Compustat-like panel
+
+    Function will take the number of firms and quarters, how many numeric
+    columns to keep (all of the template's if None; ratio inputs are always
+    kept), the share of firms with zero inventory, the extra share of missing
+    values, a random seed and a template_profile (read from TEMPLATE_FILE if
+    None)
+
+    Function will return a dataframe sorted by firm and date, with datadate
+    as MM/DD/YYYY text like the real export
+    '''
+    if profile is None:
+        profile = template_profile()
+    rng = np.random.default_rng(seed)
+
+    numeric = list(profile["numeric"])
+    needed = set(ratio_columns())
+    if n_columns is not None and n_columns < len(numeric):
+        extra = [name for name in numeric if name not in needed]
+        keep = set(needed) | set(extra[:max(n_columns - len(needed), 0)])
+        numeric = [name for name in numeric if name in keep]
+
+    rows = n_firms * n_quarters
+    dates = quarter_ends(n_quarters)
+    firm = np.repeat(np.arange(n_firms), n_quarters)
+    quarter_of = np.tile(np.arange(n_quarters), n_firms)
+    date = dates[quarter_of]
+
+    # Calendar fiscal years keep fyearq/fqtr simple and consistent
+    columns = {
+        "gvkey": 100000 + firm,
+        "datadate": date.strftime("%m/%d/%Y"),
+        "fyearq": date.year,
+        "fqtr": date.quarter,
+        "fyr": np.full(rows, 12),
+        "tic": np.char.add("F", np.char.zfill(firm.astype(str), 4)),
+        "cusip": 10000000 + firm,
+        "conm": np.char.add("FIRM ", np.char.zfill(firm.astype(str), 4)),
+        "datacqtr": np.char.add(np.char.add(date.year.astype(str), "Q"),
+                                date.quarter.astype(str)),
+    }
+    columns["datafqtr"] = columns["datacqtr"]
+
+    # Every firm grows along its own random walk, every field follows it
+    growth = rng.normal(0.01, 0.05, size=(n_firms, n_quarters))
+    size = np.exp(np.cumsum(growth, axis=1)).ravel()
+    for name in numeric:
+        info = profile["numeric"][name]
+        values = info["scale"] * size * rng.lognormal(0, 0.2, size=rows)
+        values[rng.random(rows) < info["negative"]] *= -1
+        values[rng.random(rows) < info["missing"] + nan_share] = np.nan
+        columns[name] = values
+
+    # Some firms report no inventory at all, so inventory turnover divides
+    # by zero the way it does for Google
+    if "invtq" in columns:
+        no_inventory = rng.random(n_firms) < zero_share
+        columns["invtq"][no_inventory[firm]] = 0.0
+
+    for name, value in profile["text"].items():
+        if name not in columns:
+            columns[name] = np.full(rows, value)
+
+    order = [name for name in profile["columns"] if name in columns]
+    order += [name for name in columns if name not in order]
+
+    return pd.DataFrame(columns)[order]
+
+
+def synthetic_prices(panel, seed=0):
+    '''
+    Function will generate quarter-end share prices for a synthetic panel
+
+    Function will take the panel from synthetic_panel and a random seed
+
+    Function will return a dataframe laid out like AAPL_Project.csv with a
+    tic column added, dates as M/D/YY text
+    '''
+    rng = np.random.default_rng(seed)
+    # Prices loosely follow net income so correlations aren't pure noise
+    income = panel["niq"].to_numpy(dtype=float)
+    income = np.where(np.isfinite(income), income, 0.0)
+    close = 50 * np.exp(rng.normal(0, 0.1, len(panel))) + \
+        np.abs(income) / (1 + np.nanmedian(np.abs(income))) * 10
+
+    dates = pd.to_datetime(panel["datadate"], format="%m/%d/%Y")
+    prices = pd.DataFrame({
+        "tic": panel["tic"].to_numpy(),
+        "Date": (dates.dt.month.astype(str) + "/" + dates.dt.day.astype(str) +
+                 "/" + dates.dt.strftime("%y")).to_numpy(),
+        "Open": close * 0.98,
+        "High": close * 1.05,
+        "Low": close * 0.95,
+        "Close": close,
+        "Adj Close": close,
+        "Volume": rng.integers(10 ** 6, 10 ** 9, size=len(panel)),
+    })
+
+    return prices
+
+
+def write_dataset(outdir, n_firms, n_quarters, n_columns=None, seed=0,
+                  profile=None):
+    '''
+    Function will write a synthetic fundamentals file and price file
+
+    Function will take the output directory, the number of firms, quarters
+    and numeric columns, a random seed and a template_profile
+
+    Function will return the paths of the fundamentals and price files
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    panel = synthetic_panel(n_firms, n_quarters, n_columns, seed=seed,
+                            profile=profile)
+    prices = synthetic_prices(panel, seed)
+
+    name = str(n_firms) + "x" + str(n_quarters)
+    panel_file = os.path.join(outdir, "panel_" + name + ".csv")
+    price_file = os.path.join(outdir, "prices_" + name + ".csv")
+    panel.to_csv(panel_file, index=False)
+    prices.to_csv(price_file, index=False)
+
+    return panel_file, price_file
+
+
+def _timed(func, repeat):
+    '''
+    Function will time a function, keeping the fastest of several runs
+
+    Function will take a function with no arguments and the number of runs
+
+    Function will return the fastest time in seconds and the last result
+    '''
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def bench_scale(n_firms, n_quarters, n_columns=None, repeat=3, workdir=None,
+                graph_firms=GRAPH_FIRMS, seed=0, profile=None):
+    '''
+    Function will time every pipeline stage on one synthetic dataset
+
+    Function will take the number of firms, quarters and numeric columns,
+    how many runs to keep the fastest of, a scratch directory (a temporary
+    one if None), how many firms to chart, a random seed and a
+    template_profile
+
+    Function will return a list of dicts, one per stage
+    '''
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        panel_file, price_file = write_dataset(workdir, n_firms, n_quarters,
+                                               n_columns, seed, profile)
+        base = {"firms": n_firms, "quarters": n_quarters,
+                "rows": n_firms * n_quarters}
+        results = []
+
+        def record(stage, func, runs=repeat):
+            seconds, result = _timed(func, runs)
+            results.append(dict(base, stage=stage, seconds=seconds))
+            return result
+
+        base["columns"] = len(pd.read_csv(panel_file, nrows=0).columns)
+        df = record("read_csv", lambda: Final_Project.read_csv(panel_file))
+        price_df = record("read_csv_prices",
+                          lambda: Final_Project.read_csv(price_file))
+
+        df["datadate"] = record("to_datetime",
+                                lambda: pd.to_datetime(df["datadate"]))
+        record("get_stock_price",
+               lambda: Final_Project.get_stock_price(df, price_df))
+        record("get_colors", lambda: Final_Project.get_colors(df))
+
+        for ratio, name in CALC_FUNCTIONS.items():
+            func = getattr(Final_Project, name)
+            record(name, lambda: func(df))
+
+        firms = [firm for _, firm in df.groupby("tic", sort=False)]
+        record("calc_corr", lambda: [
+            Final_Project.calc_corr(firm["stock_price"], firm[ratio])
+            for firm in firms for ratio in CALC_FUNCTIONS])
+        record("scan_correlations",
+               lambda: scan_correlations(df, columns=list(RATIOS)))
+
+        # graph_* saves into the working directory and prints the correlation
+        charts = [firm.reset_index(drop=True)
+                  for firm in firms[:graph_firms]]
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for ratio, name in GRAPH_FUNCTIONS.items():
+                    func = getattr(Final_Project, name)
+                    record(name, lambda: [func(firm, firm["tic"].iloc[0])
+                                          for firm in charts], runs=1)
+                    Final_Project.get_pyplot().close("all")
+        finally:
+            os.chdir(cwd)
+
+        for row in results:
+            if row["stage"].startswith("graph_"):
+                row["charts"] = len(charts)
+
+    return results
+
+
+def run_benchmarks(scales=SCALES, n_columns=None, repeat=3, outfile=None,
+                   graph_firms=GRAPH_FIRMS, seed=0):
+    '''
+    Function will time every pipeline stage at several scales
+
+    Function will take a list of (firms, quarters) pairs, how many numeric
+    columns to generate, how many runs to keep the fastest of, the JSON file
+    to save to (nothing is saved if None), how many firms to chart and a
+    random seed
+
+    Function will return a dict with the environment and a list of results
+    '''
+    profile = template_profile()
+    results = []
+    for n_firms, n_quarters in scales:
+        results.extend(bench_scale(n_firms, n_quarters, n_columns, repeat,
+                                   graph_firms=graph_firms, seed=seed,
+                                   profile=profile))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if outfile is not None:
+        with open(outfile, "w") as f:
+            json.dump(report, f, indent=1)
+
+    return report
+
+
+def compare(old, new, threshold=0.1):
+    '''
+    Function will compare two benchmark runs stage by stage
+
+    Function will take two reports (dicts or JSON file names) and the
+    relative slowdown that counts as a regression
+
+    Function will return a dataframe with both timings, the ratio new / old
+    and a regression flag
+    '''
+    tables = []
+    for report in (old, new):
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        tables.append(pd.DataFrame(report["results"]))
+
+    keys = ["stage", "firms", "quarters"]
+    table = tables[0][keys + ["seconds"]].merge(
+        tables[1][keys + ["seconds"]], on=keys, suffixes=("_old", "_new"))
+    table["ratio"] = table["seconds_new"] / table["seconds_old"]
+    table["regression"] = table["ratio"] > 1 + threshold
+
+    return table
+
+
+def _scale(text):
+    '''
+    Function will parse a scale like 100x84
+
+    Function will take the text
+
+    Function will return a (firms, quarters) pair
+    '''
+    firms, quarters = text.lower().split("x")
+
+    return int(firms), int(quarters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the pipeline stages")
+    parser.add_argument("--scales", nargs="+", type=_scale,
+                        default=list(SCALES), help="firms x quarters")
+    parser.add_argument("--columns", type=int, default=None,
+                        help="numeric columns per panel")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--graph-firms", type=int, default=GRAPH_FIRMS)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two saved runs instead of timing")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare(*args.compare).to_string(index=False))
+    else:
+        report = run_benchmarks(args.scales, args.columns, args.repeat,
+                                args.out, args.graph_firms)
+        print(pd.DataFrame(report["results"]).to_string(index=False))
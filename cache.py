@@ -0,0 +1,458 @@
+'''
+Persistent binary columnar cache for parsed csv files
+
+The first time a csv is loaded it is parsed once and every column is written
+ to its own .npy file; later loads memory-map only the columns that are asked
+ for, so start-up does no parsing and no copying.
+Entries are keyed by the file's path, size, mtime and a content hash: a
+ changed size or mtime triggers a re-hash, and the entry is rebuilt only if
+ the content really changed. The cache directory is kept under a size cap by
+ evicting the least recently used entries.
+Several processes may share a cache: entries are built in their own temp
+ dir and renamed into place (a process that loses the race uses the winner's
+ entry), and a manifest is only rewritten when it changed or its last use is
+ over TOUCH_SECONDS old.
+Results computed from csv files (e.g. pricestore's quarterly prices) can be
+ cached the same way with save_derived/load_derived, keyed by a name and the
+ size and mtime of the files they came from.
+We use plain NumPy files instead of Parquet/Feather so the cache works with
+ nothing but numpy installed and each column can be mapped on its own.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+CACHE_DIR = os.environ.get("FINANCE_CACHE_DIR", ".finance_cache")
+
+# Least recently used entries are dropped once the cache grows past this
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+MANIFEST = "manifest.json"
+
+# Bump when the on-disk layout changes so old entries get rebuilt
+FORMAT_VERSION = 1
+
+# An unchanged manifest is rewritten to record its use at most this often
+TOUCH_SECONDS = 3600
+
+# Build dirs older than this were left behind by a crashed process
+STALE_BUILD_SECONDS = 3600
+BUILD_PREFIX = ".build-"
+
+
+def file_hash(path, block_size=1024 * 1024):
+    '''
+    Function will hash the content of a file
+
+    Function will take a path and how many bytes to read at a time
+
+    Function will return the sha1 hex digest of the file
+    '''
+    digest = hashlib.sha1()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def entry_dir(path, cache_dir=CACHE_DIR):
+    '''
+    Function will find where a file's cache entry lives
+
+    Function will take the source path and the cache directory
+
+    Function will return the entry's directory path
+    '''
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+
+    return os.path.join(cache_dir, key[:20])
+
+
+def _read_manifest(entry):
+    '''
+    Function will read an entry's manifest
+
+    Function will take the entry directory
+
+    Function will return the manifest as a dict, or None if it is missing or
+    unreadable
+    '''
+    try:
+        with open(os.path.join(entry, MANIFEST)) as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != FORMAT_VERSION:
+        return None
+
+    return manifest
+
+
+def _write_manifest(entry, manifest):
+    '''
+    Function will write an entry's manifest atomically
+
+    Function will take the entry directory and the manifest dict
+
+    Function will return nothing
+    '''
+    # A temp file of its own, so concurrent writers never share one
+    handle, tmp = tempfile.mkstemp(dir=entry, prefix=MANIFEST + ".",
+                                   suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as outfile:
+            json.dump(manifest, outfile)
+        os.replace(tmp, os.path.join(entry, MANIFEST))
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _touch(entry, manifest, changed=False):
+    '''
+    Function will record that an entry was used
+
+    Function will take the entry directory, its manifest and whether the
+    manifest changed since it was read
+
+    Function will return nothing; an unchanged manifest is only rewritten
+    once its last use is TOUCH_SECONDS old, and a failed write is ignored
+    since another process may be replacing the entry
+    '''
+    now = time.time()
+    if not changed and now - manifest.get("last_used", 0) < TOUCH_SECONDS:
+        return
+
+    manifest["last_used"] = now
+    try:
+        _write_manifest(entry, manifest)
+    except OSError:
+        pass
+
+
+def _publish(tmp, entry, manifest):
+    '''
+    Function will move a finished build dir into place
+
+    Function will take the build dir, the entry directory and the build's
+    manifest
+
+    Function will return the manifest of the entry now in place: ours, or
+    the one another process published first
+    '''
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # Another process published between rmtree and replace (ENOTEMPTY)
+        shutil.rmtree(tmp, ignore_errors=True)
+        existing = _read_manifest(entry)
+        if existing is None:
+            raise
+        return existing
+
+    return manifest
+
+
+def _column_array(series):
+    '''
+    Function will turn a parsed column into an array np.save can map
+
+    Function will take a pandas series
+
+    Function will return a numpy array and its kind ("num" or "text")
+    '''
+    if pd.api.types.is_numeric_dtype(series) or \
+            pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(), "num"
+
+    # Text is stored as fixed width unicode, missing values as ""
+    text = series.astype(object).where(series.notna(), "")
+
+    return np.asarray(text.astype(str).to_numpy(), dtype=str), "text"
+
+
+def _write_columns(entry, df):
+    '''
+    Function will write every column of a dataframe to its own .npy file
+
+    Function will take the entry directory and the dataframe
+
+    Function will return the manifest's column list and the bytes written
+    '''
+    columns = []
+    total = 0
+    for i, name in enumerate(df.columns):
+        values, kind = _column_array(df[name])
+        file_name = "c%05d.npy" % i
+        np.save(os.path.join(entry, file_name), values, allow_pickle=False)
+        total += os.path.getsize(os.path.join(entry, file_name))
+        columns.append({"name": name, "file": file_name, "kind": kind})
+
+    return columns, total
+
+
+def _read_columns(entry, manifest, columns=None):
+    '''
+    Function will memory-map the columns of an entry
+
+    Function will take the entry directory, its manifest and the columns to
+    load (all if None, any that are missing are skipped)
+
+    Function will return a dataframe (copy-on-write maps, so edits never touch
+    the cache)
+    '''
+    wanted = None if columns is None else set(columns)
+    data = {}
+    for column in manifest["columns"]:
+        if wanted is not None and column["name"] not in wanted:
+            continue
+        values = np.load(os.path.join(entry, column["file"]), mmap_mode="c",
+                         allow_pickle=False)
+        if column["kind"] == "text":
+            text = values.astype(object)
+            text[values == ""] = np.nan
+            values = text
+        data[column["name"]] = values
+
+    return pd.DataFrame(data, copy=False)
+
+
+def build_entry(path, cache_dir=CACHE_DIR, content_hash=None):
+    '''
+    Function will parse a csv once and write every column to the cache
+
+    Function will take the source path, the cache directory and the content
+    hash if it is already known
+
+    Function will return the new entry's manifest
+    '''
+    stat = os.stat(path)
+    if content_hash is None:
+        content_hash = file_hash(path)
+
+    df = pd.read_csv(path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Builds into a temp dir and renames it so readers never see half an entry
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix=BUILD_PREFIX)
+    try:
+        columns, total = _write_columns(tmp, df)
+        manifest = {
+            "version": FORMAT_VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": content_hash,
+            "rows": df.shape[0],
+            "bytes": total,
+            "columns": columns,
+            "last_used": time.time(),
+        }
+        _write_manifest(tmp, manifest)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    return _publish(tmp, entry_dir(path, cache_dir), manifest)
+
+
+def _valid_manifest(path, entry):
+    '''
+    Function will check an entry still matches its source file
+
+    Function will take the source path and the entry directory
+
+    Function will return the manifest if the entry can be used (else None)
+    and whether it changed and needs writing back
+    '''
+    manifest = _read_manifest(entry)
+    if manifest is None:
+        return None, False
+
+    stat = os.stat(path)
+    if stat.st_size == manifest["size"] and \
+            stat.st_mtime_ns == manifest["mtime_ns"]:
+        return manifest, False
+
+    # Size or mtime moved, so only the content hash can tell if it changed
+    content_hash = file_hash(path)
+    if content_hash != manifest["hash"]:
+        return build_entry(path, os.path.dirname(entry), content_hash), False
+
+    manifest["size"] = stat.st_size
+    manifest["mtime_ns"] = stat.st_mtime_ns
+
+    return manifest, True
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None):
+    '''
+    Function will drop least recently used entries until the cache fits,
+    along with build dirs that crashed processes left behind
+
+    Function will take the cache directory, the size cap in bytes and an
+    entry directory that must not be dropped
+
+    Function will return a list of the entry directories that were removed
+    '''
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    removed = []
+    stale = time.time() - STALE_BUILD_SECONDS
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith(BUILD_PREFIX):
+            try:
+                if os.path.getmtime(entry) < stale:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    removed.append(entry)
+            except OSError:
+                # Published or removed by its owner meanwhile
+                pass
+            continue
+        manifest = _read_manifest(entry)
+        if manifest is not None:
+            entries.append((manifest["last_used"], manifest["bytes"], entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed.append(entry)
+
+    return removed
+
+
+def load_cached(path, columns=None, cache_dir=CACHE_DIR,
+                max_bytes=MAX_CACHE_BYTES):
+    '''
+    Function will load a csv through the columnar cache
+
+    Function will take the source path, the columns to load (all if None, any
+    that are missing are skipped), the cache directory and its size cap
+
+    Function will return a dataframe whose numeric columns are memory-mapped
+    from the cache (copy-on-write, so edits never touch the cache)
+    '''
+    entry = entry_dir(path, cache_dir)
+    manifest, changed = _valid_manifest(path, entry)
+    if manifest is None:
+        manifest = build_entry(path, cache_dir)
+
+    df = _read_columns(entry, manifest, columns)
+
+    _touch(entry, manifest, changed)
+    evict(cache_dir, max_bytes, keep=entry)
+
+    return df
+
+
+def source_signature(paths):
+    '''
+    Function will describe the files a derived result was built from
+
+    Function will take a list of paths
+
+    Function will return a list of [absolute path, size, mtime] entries
+    '''
+    signature = []
+    for path in sorted(os.path.abspath(path) for path in paths):
+        stat = os.stat(path)
+        signature.append([path, stat.st_size, stat.st_mtime_ns])
+
+    return signature
+
+
+def derived_entry_dir(key, cache_dir=CACHE_DIR):
+    '''
+    Function will find where a derived result's cache entry lives
+
+    Function will take the result's key (any string naming the inputs and
+    settings) and the cache directory
+
+    Function will return the entry's directory path
+    '''
+    digest = hashlib.sha1(("derived:" + key).encode("utf-8")).hexdigest()
+
+    return os.path.join(cache_dir, digest[:20])
+
+
+def save_derived(key, df, sources, cache_dir=CACHE_DIR,
+                 max_bytes=MAX_CACHE_BYTES):
+    '''
+    Function will cache a dataframe computed from some source files
+
+    Function will take the result's key, the dataframe, the source paths and
+    the cache directory and its size cap
+
+    Function will return the entry's manifest
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix=BUILD_PREFIX)
+    try:
+        columns, total = _write_columns(tmp, df)
+        manifest = {
+            "version": FORMAT_VERSION,
+            "key": key,
+            "sources": source_signature(sources),
+            "rows": df.shape[0],
+            "bytes": total,
+            "columns": columns,
+            "last_used": time.time(),
+        }
+        _write_manifest(tmp, manifest)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    entry = derived_entry_dir(key, cache_dir)
+    manifest = _publish(tmp, entry, manifest)
+    evict(cache_dir, max_bytes, keep=entry)
+
+    return manifest
+
+
+def load_derived(key, sources, columns=None, cache_dir=CACHE_DIR):
+    '''
+    Function will load a cached derived dataframe if its sources are
+    unchanged
+
+    Function will take the result's key, the source paths, the columns to
+    load (all if None) and the cache directory
+
+    Function will return the dataframe, or None if there is no entry or a
+    source file changed size or mtime
+    '''
+    entry = derived_entry_dir(key, cache_dir)
+    manifest = _read_manifest(entry)
+    if manifest is None or manifest.get("key") != key:
+        return None
+    try:
+        if manifest["sources"] != source_signature(sources):
+            return None
+    except OSError:
+        return None
+
+    df = _read_columns(entry, manifest, columns)
+    _touch(entry, manifest)
+
+    return df
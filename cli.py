@@ -0,0 +1,223 @@
+'''
+Multi-company command-line runner
+
+Final_Project.py walks through Apple and then Google one ratio at a time. This
+ runner reads a manifest of companies instead, runs each company's pipeline
+ (load -> date parse -> price join -> ratios -> fits [-> charts]) in its own
+ worker process, and writes one table with a row per (ticker, ratio).
+
+The manifest is a csv (or json list) with one row per company:
+    ticker,fundamentals,prices,mode,name
+    AAPL,apple_ds.csv,AAPL_Project.csv,on_or_before,Apple
+    GOOGL,googl_ds.csv,GOOGL_Project.csv,on_or_after,Google
+mode (see prices.MODES) and name are optional. Relative paths are relative
+ to the manifest.
+
+    python cli.py manifest.csv --workers 8 --out results.csv --charts charts
+    python cli.py manifest.csv --db results.sqlite
+'''
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd  # useful library to handle dataframe
+
+from loader import load_csv
+from prices import DATE_FORMAT, align_prices
+from ratios import compute_ratios
+from regression import simple_fits
+from resultstore import connect, insert_results, start_run
+
+# The ratios Final_Project.py graphs
+DEFAULT_RATIOS = ("cur_ratio", "roa_ratio", "roe_ratio", "profit_margin",
+                  "inventory_turnover", "debt_to_equity", "cf_capex")
+
+MANIFEST_COLUMNS = ("ticker", "fundamentals", "prices")
+
+RESULT_COLUMNS = ["ticker", "name", "ratio", "corr", "slope", "intercept",
+                  "r2", "slope_se", "n", "chart", "error"]
+
+
+def load_manifest(path):
+    '''
+    Function will read the list of companies to run
+
+    Function will take a csv or json manifest file
+
+    Function will return a list of dicts with ticker, fundamentals, prices,
+    mode and name, file paths made absolute
+    '''
+    if path.endswith(".json"):
+        with open(path) as f:
+            entries = pd.DataFrame(json.load(f))
+    else:
+        entries = pd.read_csv(path, dtype=str)
+
+    missing = [col for col in MANIFEST_COLUMNS if col not in entries.columns]
+    if missing:
+        raise ValueError(path + " is missing columns: " + ", ".join(missing))
+
+    base = os.path.dirname(os.path.abspath(path))
+    manifest = []
+    for entry in entries.to_dict("records"):
+        entry = {key: value for key, value in entry.items()
+                 if isinstance(value, str) and value.strip()}
+        for key in ("fundamentals", "prices"):
+            entry[key] = os.path.join(base, entry[key])
+        entry.setdefault("mode", "on_or_before")
+        entry.setdefault("name", entry["ticker"])
+        manifest.append(entry)
+
+    return manifest
+
+
+def run_company(entry, ratios=DEFAULT_RATIOS, chart_dir=None, cache=False):
+    '''
+    Function will run the whole pipeline for one company
+
+    Function will take a manifest entry, the ratio names, the directory to
+    save charts in (no charts if None) and whether to load through the
+    columnar cache
+
+    Function will return a list of result dicts, one per ratio (a single row
+    with the error if the company could not be processed)
+    '''
+    ratios = list(ratios)
+    try:
+        df = load_csv(entry["fundamentals"], ratios=ratios, cache=cache)
+        price_df = load_csv(entry["prices"], cache=cache)
+        df["datadate"] = pd.to_datetime(df["datadate"], format=DATE_FORMAT)
+        df["stock_price"] = align_prices(df, price_df, mode=entry["mode"])
+        compute_ratios(df, ratios)
+    except (OSError, ValueError, KeyError) as error:
+        return [{"ticker": entry["ticker"], "name": entry["name"],
+                 "error": type(error).__name__ + ": " + str(error)}]
+
+    price = df["stock_price"].to_numpy(dtype=float)
+    # Every ratio's line of best fit from one batched pass
+    fits = simple_fits(price[:, None], df[ratios].to_numpy(dtype=float))
+
+    rows = []
+    for i, ratio in enumerate(ratios):
+        row = {"ticker": entry["ticker"], "name": entry["name"],
+               "ratio": ratio}
+        for key in ("corr", "slope", "intercept", "r2", "slope_se"):
+            row[key] = float(fits[key][0, i])
+        row["n"] = int(fits["n"][0, i])
+
+        if chart_dir is not None and row["n"] >= 2:
+            # Only chart runs pay for importing matplotlib
+            from render import render_chart
+            job = (entry["ticker"], entry["name"], ratio, price,
+                   df[ratio].to_numpy(dtype=float),
+                   (row["slope"], row["intercept"]), row["corr"], chart_dir)
+            row["chart"] = render_chart(job)[2]
+        rows.append(row)
+
+    return rows
+
+
+def _run_entry(args):
+    '''
+    Function will unpack the arguments of run_company for a worker
+
+    Function will take a tuple of run_company arguments
+
+    Function will return what run_company returns
+    '''
+    return run_company(*args)
+
+
+def run(manifest, ratios=DEFAULT_RATIOS, workers=None, outfile=None,
+        chart_dir=None, cache=False, db=None):
+    '''
+    Function will run every company of a manifest in a process pool
+
+    Function will take a manifest (file name or list of entries), the ratio
+    names, the number of worker processes (all cores if None, 1 runs in this
+    process), the csv file to write the table to (nothing is written if
+    None), the chart directory (no charts if None), whether to use the
+    columnar cache and the SQLite results store to add the run to (see
+    resultstore.py, nothing is stored if None)
+
+    Function will return the consolidated results dataframe
+    '''
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chart_dir is not None:
+        os.makedirs(chart_dir, exist_ok=True)
+
+    jobs = [(entry, tuple(ratios), chart_dir, cache) for entry in manifest]
+    if workers == 1 or len(jobs) <= 1:
+        results = map(_run_entry, jobs)
+    else:
+        # Small chunks keep every worker busy when firms differ in size
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(jobs)))
+        with pool:
+            results = list(pool.map(_run_entry, jobs,
+                                    chunksize=max(1, len(jobs) //
+                                                  (4 * workers))))
+
+    rows = [row for company in results for row in company]
+    table = pd.DataFrame(rows).reindex(columns=RESULT_COLUMNS)
+    table["n"] = table["n"].astype("Int64")
+
+    if outfile is not None:
+        table.to_csv(outfile, index=False)
+    if db is not None:
+        conn = connect(db)
+        run_id = start_run(conn, "cli", {"manifest": [entry["ticker"]
+                                                      for entry in manifest],
+                                         "ratios": list(ratios)})
+        insert_results(conn, run_id, table.dropna(subset=["ratio"]),
+                       ticker_col="ticker")
+        conn.close()
+
+    return table
+
+
+def main(argv=None):
+    '''
+    Function will parse the command line and run the manifest
+
+    Function will take the argument list (sys.argv if None)
+
+    Function will return the exit status, 1 if any company failed
+    '''
+    parser = argparse.ArgumentParser(
+        description="Correlate financial ratios with share prices for every "
+                    "company in a manifest")
+    parser.add_argument("manifest", help="csv or json list of companies")
+    parser.add_argument("--ratios", nargs="+", default=list(DEFAULT_RATIOS),
+                        help="registered ratio names")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="results.csv",
+                        help="consolidated results table")
+    parser.add_argument("--charts", default=None,
+                        help="directory to save charts in")
+    parser.add_argument("--cache", action="store_true",
+                        help="load through the columnar cache")
+    parser.add_argument("--db", default=None,
+                        help="SQLite results store to add this run to")
+    args = parser.parse_args(argv)
+
+    table = run(args.manifest, args.ratios, args.workers, args.out,
+                args.charts, args.cache, args.db)
+    print(table.drop(columns=["chart", "error"]).dropna(subset=["ratio"])
+          .to_string(index=False))
+
+    failed = table[table["error"].notna()]
+    for row in failed.itertuples():
+        print(row.ticker + ": " + row.error, file=sys.stderr)
+
+    return 1 if len(failed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
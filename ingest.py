@@ -0,0 +1,151 @@
+'''
+Chunked, bounded-memory ingest of full-universe Compustat exports
+
+A Compustat quarterly extract has every firm in one file, one firm's quarters
+ after another. Instead of loading it whole we walk it in chunks, cut each
+ chunk where the firm changes and yield one firm's sorted quarterly panel at
+ a time, so peak memory is the largest firm plus one chunk, not the file.
+The generator stages below join prices, compute ratios and scan correlations
+ one firm at a time.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from loader import column_dtypes, required_columns
+from prices import DATE_FORMAT, align_prices
+from ratios import compute_ratios
+from scan import scan_correlations
+
+CHUNKSIZE = 50000
+
+
+def _finish_firm(pieces, date_col):
+    '''
+    Function will glue a firm's rows together and sort them by date
+
+    Function will take the list of dataframe pieces for one firm and the date
+    column
+
+    Function will return one dataframe indexed 0..n-1
+    '''
+    firm = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 \
+        else pieces[0].reset_index(drop=True)
+    if date_col in firm.columns:
+        firm[date_col] = pd.to_datetime(firm[date_col], format=DATE_FORMAT)
+        firm = firm.sort_values(date_col, kind="stable").reset_index(drop=True)
+
+    return firm
+
+
+def iter_firms(infile, ratios=None, columns=None, firm_col="gvkey",
+               date_col="datadate", chunksize=CHUNKSIZE):
+    '''
+    Function will read a multi-firm csv in chunks and yield one firm at a time
+
+    Function will take a infile whose rows are grouped by firm, the ratios
+    and extra columns we need (all columns if both are None), the firm
+    column, the date column and how many rows to parse per chunk
+
+    Function will return a generator of one dataframe per firm, sorted by date
+    '''
+    if ratios is None and columns is None:
+        reader = pd.read_csv(infile, chunksize=chunksize)
+    else:
+        wanted = set(required_columns(ratios, columns))
+        reader = pd.read_csv(infile, chunksize=chunksize,
+                             usecols=lambda name: name in wanted,
+                             dtype=column_dtypes(wanted))
+
+    seen = set()
+    pieces = []
+    current = None
+    with reader:
+        for chunk in reader:
+            keys = chunk[firm_col].to_numpy()
+            # Rows where a new firm starts inside this chunk
+            starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            bounds = [0] + starts.tolist() + [len(keys)]
+
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                key = keys[lo]
+                if key != current:
+                    if pieces:
+                        yield _finish_firm(pieces, date_col)
+                    if key in seen:
+                        raise ValueError(str(infile) + " is not grouped by " +
+                                         firm_col + " (" + str(key) +
+                                         " appears twice)")
+                    seen.add(key)
+                    current = key
+                    pieces = []
+                pieces.append(chunk.iloc[lo:hi])
+
+    if pieces:
+        yield _finish_firm(pieces, date_col)
+
+
+def with_prices(firms, price_df, mode="on_or_before", date_col="datadate"):
+    '''
+    Function will add the stock price to every firm coming through a pipeline
+
+    Function will take a generator of firm dataframes, a price dataframe with
+    a 'tic' column (or one firm's prices), the date matching mode and the
+    date column
+
+    Function will return a generator of firm dataframes with stock_price
+    '''
+    for firm in firms:
+        firm["stock_price"] = align_prices(firm, price_df, date_col, mode)
+        yield firm
+
+
+def with_ratios(firms, ratios=None):
+    '''
+    Function will compute registered ratios for every firm coming through a
+    pipeline
+
+    Function will take a generator of firm dataframes and the ratio names
+    (all registered ratios if None)
+
+    Function will return a generator of firm dataframes with ratio columns
+    '''
+    for firm in firms:
+        compute_ratios(firm, ratios)
+        yield firm
+
+
+def with_scan(firms, columns=None, firm_col="tic", top_k=20):
+    '''
+    Function will scan correlations for every firm coming through a pipeline
+
+    Function will take a generator of firm dataframes (with stock_price), the
+    columns to scan, the firm column and how many variables to keep
+
+    Function will return a generator of one ranked correlation table per firm
+    '''
+    for firm in firms:
+        yield scan_correlations(firm, columns, firm_col=firm_col, top_k=top_k)
+
+
+def stream_scan(infile, price_df, ratios=None, columns=None, top_k=20,
+                mode="on_or_before", chunksize=CHUNKSIZE):
+    '''
+    Function will run load -> price -> ratio -> scan over a multi-firm file
+    one firm at a time
+
+    Function will take a infile grouped by firm, a price dataframe with a
+    'tic' column, the ratios and extra columns (every column if both are
+    None), how many variables to keep per firm, the date matching mode and
+    the chunk size
+
+    Function will return one correlation table for every firm in the file
+    '''
+    firms = iter_firms(infile, ratios, columns, chunksize=chunksize)
+    firms = with_prices(firms, price_df, mode)
+    firms = with_ratios(firms, ratios)
+    tables = list(with_scan(firms, top_k=top_k))
+    if not tables:
+        return pd.DataFrame()
+
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,288 @@
+'''
+Per-stage timing and memory instrumentation
+
+Named spans around the pipeline stages (file reads, pd.to_datetime,
+ get_stock_price, calc_*, graph_*, savefig) record wall time, CPU time, peak
+ memory allocated inside the span (tracemalloc) and rows processed.
+The spans are written as Chrome trace-event JSON, which chrome://tracing or
+ https://ui.perfetto.dev open as a timeline with nested stages.
+Nothing is recorded until enable() is called. While disabled span() hands back
+ one shared do-nothing context manager and traced() functions call straight
+ through, so the cost is one global lookup per call.
+tracemalloc's peak is process-wide, so peak memory is only recorded for spans
+ on the thread that called enable(); spans on other threads still get wall
+ and CPU time but never reset the peak under the main thread's spans.
+
+    FINANCE_TRACE=trace.json python Final_Project.py
+'''
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd  # useful library to handle dataframe
+
+# Set to a file name to trace Final_Project.py's __main__
+TRACE_ENV = "FINANCE_TRACE"
+
+_NULL_SPAN = contextlib.nullcontext()
+
+# The active Tracer, None while instrumentation is off
+_TRACER = None
+
+
+class Tracer:
+    '''
+    Collects finished spans as trace events
+    '''
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        # Only this thread's spans may reset tracemalloc's global peak
+        self.thread = threading.get_ident()
+        # Set by enable() when it was the one to start tracemalloc
+        self.started_tracemalloc = False
+        self.events = []
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def stack(self):
+        '''
+        Function will get the open spans of the calling thread
+
+        Function will take nothing
+
+        Function will return a list, innermost span last
+        '''
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, rows=None, **args):
+        '''
+        Function will time and measure the code inside a with block
+
+        Function will take the span name, the rows processed (can also be set
+        later through the yielded dict's "rows" key) and any extra values to
+        show in the trace viewer
+
+        Function will return a context manager that yields the span's args
+        '''
+        args = dict(args)
+        if rows is not None:
+            args["rows"] = int(rows)
+        # peak is the highest absolute memory seen by spans nested in this one
+        frame = {"peak": 0, "base": 0}
+        stack = self.stack()
+        measure = self.memory and tracemalloc.is_tracing() and \
+            threading.get_ident() == self.thread
+        if measure:
+            current, peak = tracemalloc.get_traced_memory()
+            # The parent's peak so far is saved before this span resets it
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            frame["base"] = current
+            tracemalloc.reset_peak()
+        stack.append(frame)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield args
+        finally:
+            cpu = time.process_time() - cpu
+            end = time.perf_counter()
+            stack.pop()
+
+            if measure and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], frame["peak"])
+                args["peak_bytes"] = max(peak - frame["base"], 0)
+                # A nested span reset the peak, so its parent keeps it here
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            args["cpu_ms"] = cpu * 1000
+
+            event = {
+                "name": name, "cat": "pipeline", "ph": "X",
+                "ts": (wall - self.origin) * 1e6, "dur": (end - wall) * 1e6,
+                "pid": os.getpid(), "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self.lock:
+                self.events.append(event)
+
+
+def enable(memory=True):
+    '''
+    Function will start recording spans
+
+    Function will take whether to track peak memory (tracemalloc makes every
+    allocation slower while it runs)
+
+    Function will return the new Tracer
+    '''
+    global _TRACER
+    tracer = Tracer(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        tracer.started_tracemalloc = True
+    _TRACER = tracer
+
+    return _TRACER
+
+
+def disable():
+    '''
+    Function will stop recording spans
+
+    Function will take nothing
+
+    Function will return the Tracer that was recording (None if none was);
+    tracemalloc is only stopped if enable() started it
+    '''
+    global _TRACER
+    tracer = _TRACER
+    _TRACER = None
+    if tracer is not None and tracer.started_tracemalloc and \
+            tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    return tracer
+
+
+def enabled():
+    '''
+    Function will check if spans are being recorded
+
+    Function will take nothing
+
+    Function will return a bool
+    '''
+    return _TRACER is not None
+
+
+def span(name, rows=None, **args):
+    '''
+    Function will open a named span if instrumentation is on
+
+    Function will take the span name, the rows processed and extra values
+    for the trace viewer
+
+    Function will return a context manager (a shared no-op one when off)
+    '''
+    if _TRACER is None:
+        return _NULL_SPAN
+
+    return _TRACER.span(name, rows, **args)
+
+
+def _rows(value):
+    '''
+    Function will count the rows of a dataframe or series
+
+    Function will take any value
+
+    Function will return the number of rows, or None for anything else
+    '''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    return None
+
+
+def traced(name=None):
+    '''
+    Function will wrap a function in a span named after it
+
+    Function will take the span name (the function's name if None)
+
+    Function will return a decorator. Rows are taken from the returned
+    dataframe, or else from the first dataframe argument
+    '''
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return func(*args, **kwargs)
+
+            with _TRACER.span(label) as info:
+                result = func(*args, **kwargs)
+                rows = _rows(result)
+                for arg in args:
+                    if rows is None:
+                        rows = _rows(arg)
+                if rows is not None:
+                    info["rows"] = rows
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def trace_events(tracer=None):
+    '''
+    Function will get the recorded spans as trace events
+
+    Function will take a Tracer (the active one if None)
+
+    Function will return a list of dicts
+    '''
+    tracer = tracer or _TRACER
+    if tracer is None:
+        return []
+
+    with tracer.lock:
+        return sorted(tracer.events, key=lambda event: event["ts"])
+
+
+def write_trace(path, tracer=None):
+    '''
+    Function will save the recorded spans for a trace viewer
+
+    Function will take the output file and a Tracer (the active one if None)
+
+    Function will return the number of spans written
+    '''
+    events = trace_events(tracer)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    return len(events)
+
+
+def summary(tracer=None):
+    '''
+    Function will total the recorded spans by name
+
+    Function will take a Tracer (the active one if None)
+
+    Function will return a dataframe with the calls, wall and CPU
+    milliseconds, largest peak memory and rows of each span name, slowest
+    first
+    '''
+    rows = [{"name": event["name"], "wall_ms": event["dur"] / 1000,
+             "cpu_ms": event["args"].get("cpu_ms"),
+             "peak_bytes": event["args"].get("peak_bytes"),
+             "rows": event["args"].get("rows")}
+            for event in trace_events(tracer)]
+    if not rows:
+        return pd.DataFrame(columns=["calls", "wall_ms", "cpu_ms",
+                                     "peak_bytes", "rows"])
+
+    table = pd.DataFrame(rows).groupby("name").agg(
+        calls=("wall_ms", "size"), wall_ms=("wall_ms", "sum"),
+        cpu_ms=("cpu_ms", "sum"), peak_bytes=("peak_bytes", "max"),
+        rows=("rows", "sum"))
+
+    return table.sort_values("wall_ms", ascending=False)
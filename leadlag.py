@@ -0,0 +1,131 @@
+'''
+Lead/lag cross-correlation between fundamentals and share price
+
+calc_corr only pairs a variable with the price of the same quarter. Here we
+ find out whether a variable (xrdq, roa_ratio, ...) leads the price by some
+ number of quarters: for every lag k we correlate x at quarter t with the
+ price at quarter t + k.
+All lags come out of one FFT per series: the six pairwise moment sums (count,
+ sum x, sum y, sum x^2, sum y^2, sum xy) are cross-correlations of the values
+ and their missing-value masks, so every lag, variable and ticker is handled
+ at once and missing quarters are left out exactly.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from scan import MIN_PERIODS, corr_from_moments, standardized_parts
+from scan import firm_positions, numeric_columns, to_tensor
+
+MAX_LAG = 8
+
+
+def _xcorr(a_hat, b_hat, length, lags):
+    '''
+    Function will turn two spectra into sums of a[t] * b[t + k] for each lag
+
+    Function will take the rfft of a (..., L/2+1, p) and of b
+    (..., L/2+1, q), the padded length L and the lags we want
+
+    Function will return an array shaped (..., len(lags), p, q)
+    '''
+    spectrum = np.conj(a_hat)[..., :, :, None] * b_hat[..., :, None, :]
+    full = np.fft.irfft(spectrum, n=length, axis=-3)
+
+    # Negative lags wrap around to the end of the padded series
+    return full[..., np.asarray(lags) % length, :, :]
+
+
+def cross_corr(x, y, lags, min_periods=MIN_PERIODS):
+    '''
+    Function will correlate x at quarter t with y at quarter t + k for every
+    lag k in one FFT-based pass
+
+    Function will take arrays shaped (..., n, p) and (..., n, q) (NaN or inf
+    marks a missing value), the lags in quarters (positive means x leads y)
+    and the minimum overlapping quarters
+
+    Function will return the correlations (..., len(lags), p, q) and the
+    number of quarters each one used
+    '''
+    x0, x_mask = standardized_parts(np.asarray(x, dtype=float))
+    y0, y_mask = standardized_parts(np.asarray(y, dtype=float))
+
+    n = x0.shape[-2]
+    # Zero padding to at least 2n keeps the circular FFT from wrapping lags
+    length = 1
+    while length < 2 * n:
+        length *= 2
+
+    x_hat = np.fft.rfft(x0, n=length, axis=-2)
+    xm_hat = np.fft.rfft(x_mask, n=length, axis=-2)
+    xx_hat = np.fft.rfft(x0 ** 2, n=length, axis=-2)
+    y_hat = np.fft.rfft(y0, n=length, axis=-2)
+    ym_hat = np.fft.rfft(y_mask, n=length, axis=-2)
+    yy_hat = np.fft.rfft(y0 ** 2, n=length, axis=-2)
+
+    moments = {
+        "n": np.rint(_xcorr(xm_hat, ym_hat, length, lags)),
+        "sx": _xcorr(x_hat, ym_hat, length, lags),
+        "sy": _xcorr(xm_hat, y_hat, length, lags),
+        "sxx": _xcorr(xx_hat, ym_hat, length, lags),
+        "syy": _xcorr(xm_hat, yy_hat, length, lags),
+        "sxy": _xcorr(x_hat, y_hat, length, lags),
+    }
+
+    return corr_from_moments(moments, min_periods), moments["n"]
+
+
+def lead_lag_scan(df, columns=None, target="stock_price", firm_col="tic",
+                  max_lag=MAX_LAG, min_lag=0, min_periods=MIN_PERIODS):
+    '''
+    Function will find, for every column and ticker, the lag at which the
+    column is most correlated with the stock price
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the columns (every numeric column if None), the target column,
+    the firm column, the largest and smallest lag in quarters (positive means
+    the column leads the price) and the minimum overlapping quarters
+
+    Function will return a dataframe with one row per (ticker, variable): the
+    best lag, its correlation and quarters used, and the same-quarter
+    correlation for comparison
+    '''
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    if columns is None:
+        columns = numeric_columns(df, target)
+    columns = list(columns)
+    lags = np.arange(min_lag, max_lag + 1)
+
+    firms, codes, position = firm_positions(df, firm_col)
+    x = to_tensor(df[columns].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+    y = to_tensor(df[[target]].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+
+    r, n = cross_corr(x, y, lags, min_periods)
+    r = r[..., 0]
+    n = n[..., 0]
+
+    # Lags where no correlation exists never win
+    strength = np.where(np.isnan(r), -1.0, np.abs(r))
+    best = np.argmax(strength, axis=1)
+    pick = (np.arange(len(firms))[:, None], best,
+            np.arange(len(columns))[None, :])
+
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), len(firms)),
+        "best_lag": lags[best].ravel(),
+        "best_corr": r[pick].ravel(),
+        "n": n[pick].ravel().astype(int),
+    })
+    if 0 in lags:
+        table["corr_lag0"] = r[:, list(lags).index(0), :].ravel()
+    table = table.dropna(subset=["best_corr"])
+    table["abs_corr"] = table["best_corr"].abs()
+    table = table.sort_values([firm_col, "abs_corr"],
+                              ascending=[True, False], kind="stable")
+
+    return table.drop(columns="abs_corr").reset_index(drop=True)
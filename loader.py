@@ -0,0 +1,130 @@
+'''
+Column-projected loading of Compustat exports
+
+A Compustat export has 600+ columns but the ratios only need a handful.
+The loader works out which columns the requested ratios use, adds the columns
+ that identify a firm and a quarter, and hands pandas an explicit usecols and
+ dtype so every other column is skipped by the parser.
+'''
+
+import time
+
+import pandas as pd  # useful library to handle dataframe
+
+from cache import load_cached
+from panel import compact_panel
+from ratios import ratio_columns
+
+# Columns that identify a firm and a quarter, loaded whenever they exist
+KEY_COLUMNS = ("gvkey", "datadate", "fyearq", "fqtr", "fyr", "tic", "conm",
+               "datacqtr", "datafqtr")
+
+# Key columns that are text, every other loaded column is a float
+TEXT_COLUMNS = ("datadate", "tic", "conm", "datacqtr", "datafqtr")
+
+
+def required_columns(ratios=None, columns=None):
+    '''
+    Function will work out which columns a set of ratios needs
+
+    Function will take a list of ratio names and a list of extra raw columns
+    (for example 'xrdq', which is graphed directly)
+
+    Function will return a list of column names, key columns first
+    '''
+    fields = set(ratio_columns(ratios)) if ratios is not None else set()
+    if columns is not None:
+        fields.update(columns)
+
+    return list(KEY_COLUMNS) + sorted(fields - set(KEY_COLUMNS))
+
+
+def column_dtypes(names):
+    '''
+    Function will pick a parser dtype for every loaded column
+
+    Function will take a list of column names
+
+    Function will return a dict of column name to dtype
+    '''
+    dtypes = {}
+    for name in names:
+        if name in TEXT_COLUMNS:
+            dtypes[name] = str
+        elif name not in KEY_COLUMNS:
+            dtypes[name] = "float64"
+
+    return dtypes
+
+
+def load_csv(infile, ratios=None, columns=None, cache=False, compact=False):
+    '''
+    Function will read a csv file, parsing only the columns we need
+
+    Function will take a infile, the ratios that will be computed, any extra
+    raw columns, whether to go through the columnar cache and whether to
+    return a compact panel (see panel.compact_panel). If ratios and columns
+    are both None every column is read
+
+    Function will return a dataframe
+    '''
+    if ratios is None and columns is None:
+        if cache:
+            df = load_cached(infile)
+        else:
+            df = pd.read_csv(infile)
+        return compact_panel(df) if compact else df
+
+    wanted = required_columns(ratios, columns)
+    wanted_set = set(wanted)
+
+    if cache:
+        # Maps just the wanted columns out of the cache, nothing is parsed
+        df = load_cached(infile, wanted)
+    else:
+        # A callable lets key columns be optional without reading the header
+        # first
+        df = pd.read_csv(infile, usecols=lambda name: name in wanted_set,
+                         dtype=column_dtypes(wanted))
+
+    missing = [name for name in wanted
+               if name not in KEY_COLUMNS and name not in df.columns]
+    if missing:
+        raise ValueError(str(infile) + " is missing columns: " +
+                         ", ".join(missing))
+
+    return compact_panel(df) if compact else df
+
+
+def projection_report(infile, ratios=None, columns=None):
+    '''
+    Function will measure what column projection saves on a file
+
+    Function will take a infile, the ratios that will be computed and any
+    extra raw columns
+
+    Function will return a dict with the parse seconds and in-memory bytes of
+    a full and a projected load and how much the projection saved
+    '''
+    start = time.perf_counter()
+    full = load_csv(infile)
+    full_seconds = time.perf_counter() - start
+    full_bytes = int(full.memory_usage(deep=True).sum())
+    del full
+
+    start = time.perf_counter()
+    projected = load_csv(infile, ratios=ratios, columns=columns)
+    projected_seconds = time.perf_counter() - start
+    projected_bytes = int(projected.memory_usage(deep=True).sum())
+
+    report = {
+        "file": str(infile),
+        "columns": projected.shape[1],
+        "full_seconds": full_seconds,
+        "projected_seconds": projected_seconds,
+        "full_bytes": full_bytes,
+        "projected_bytes": projected_bytes,
+        "saved_bytes": full_bytes - projected_bytes,
+    }
+
+    return report
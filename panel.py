@@ -0,0 +1,117 @@
+'''
+Compact in-memory panels
+
+A default read of a Compustat export keeps every number as float64 and every
+ repeated identifier (tic, conm, indfmt, datafmt, curcdq, ...) as one Python
+ string per row. compact_panel keeps the same dataframe but stores financial
+ fields as float32 wherever the values survive the round trip, integer keys
+ in the smallest integer type, repeated text as categoricals and quarters as
+ int32 period keys.
+Everything downstream (compute_ratios, scan_correlations, the rolling and
+ significance scans) reads columns with to_numpy(dtype=float), so it works on
+ a compact panel unchanged and still does its arithmetic in float64.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from periods import add_period_index
+
+# Largest relative error a float32 copy of a column may have
+FLOAT32_RTOL = 1e-6
+
+# Text columns with at most this share of distinct values become categoricals
+CATEGORY_SHARE = 0.5
+
+
+def fits_float32(values, rtol=FLOAT32_RTOL):
+    '''
+    Function will check if a float column can be stored as float32
+
+    Function will take a numpy array and the largest relative error allowed
+
+    Function will return a bool
+    '''
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    with np.errstate(over="ignore", invalid="ignore"):
+        narrow = values.astype(np.float32).astype(float)
+
+    # inf and NaN must stay where they were, finite values stay close
+    if not np.array_equal(np.isfinite(narrow), finite):
+        return False
+
+    return bool(np.all(np.abs(narrow[finite] - values[finite]) <=
+                       rtol * np.abs(values[finite])))
+
+
+def compact_panel(df, float32=True, rtol=FLOAT32_RTOL,
+                  category_share=CATEGORY_SHARE, periods=True):
+    '''
+    Function will make a smaller copy of a panel
+
+    Function will take a dataframe, whether float columns may be stored as
+    float32 (False keeps float64 everywhere), the largest relative error a
+    float32 column may have, the largest share of distinct values a text
+    column may have to become a categorical and whether to add the int32
+    cal_period/fisc_period keys
+
+    Function will return a new dataframe
+    '''
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column) or \
+                isinstance(column.dtype, pd.CategoricalDtype):
+            columns[name] = column
+        elif pd.api.types.is_integer_dtype(column):
+            columns[name] = pd.to_numeric(column, downcast="integer")
+        elif pd.api.types.is_float_dtype(column):
+            if float32 and fits_float32(column.to_numpy(), rtol):
+                columns[name] = column.astype(np.float32)
+            else:
+                columns[name] = column.astype(float)
+        elif pd.api.types.is_datetime64_any_dtype(column):
+            columns[name] = column
+        elif column.nunique() <= category_share * max(len(column), 1):
+            # Repeated identifiers are stored once, rows keep a small code
+            columns[name] = column.astype("category")
+        else:
+            columns[name] = column
+
+    compact = pd.DataFrame(columns, index=df.index)
+    if periods:
+        add_period_index(compact)
+
+    return compact
+
+
+def memory_report(df, compact=None):
+    '''
+    Function will show where a panel's memory goes
+
+    Function will take a dataframe and optionally its compact version
+
+    Function will return a dataframe with the columns and bytes for each
+    dtype, plus the compact bytes and the share saved if compact was given
+    '''
+    def by_dtype(frame):
+        usage = frame.memory_usage(deep=True, index=False)
+        dtypes = frame.dtypes.astype(str)
+        return pd.DataFrame({"columns": dtypes.value_counts(),
+                             "bytes": usage.groupby(dtypes).sum()})
+
+    report = by_dtype(df)
+    report.loc["total"] = report.sum()
+    if compact is None:
+        return report
+
+    other = by_dtype(compact)
+    other.loc["total"] = other.sum()
+    report = report.join(other, how="outer", rsuffix="_compact")
+    report = report.fillna(0).astype(np.int64)
+    report["saved"] = 1 - report.loc["total", "bytes_compact"] / \
+        report.loc["total", "bytes"]
+    report.loc[report.index != "total", "saved"] = np.nan
+
+    return report
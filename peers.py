@@ -0,0 +1,262 @@
+'''
+Cross-sectional peer-group statistics
+
+Compares every firm with its industry peers in the same calendar quarter.
+Firms are mapped to an industry (a dict, a csv of ticker,industry or a column
+ such as sic), and for every ratio and (industry, quarter) group we find the
+ count, mean, standard deviation, median and percentiles. Each firm then gets
+ its peer-relative ratio: distance from the peer median, z-score and
+ percentile rank within the group.
+Each ratio takes one sort of the whole panel by (group, value). Group sizes and
+ sums come from np.bincount, percentiles are read straight off the sorted
+ array, and no Python loop runs over groups or firms. The peer-relative
+ columns sit on the panel like any other column, so scan_correlations
+ correlates them against price in its usual batched pass.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from periods import CAL_PERIOD, add_period_index
+from ratios import RATIOS, compute_ratios, ratio_columns
+from scan import scan_correlations
+
+INDUSTRY_COL = "industry"
+
+# Percentiles reported for every peer group
+PERCENTILES = (25, 50, 75)
+
+# Suffixes of the peer-relative columns added for each ratio
+RELATIVE_SUFFIX = "_peer_rel"
+ZSCORE_SUFFIX = "_peer_z"
+RANK_SUFFIX = "_peer_pct"
+
+
+def load_industries(path, ticker_col="tic", industry_col=INDUSTRY_COL):
+    '''
+    Function will read a firm to industry mapping
+
+    Function will take a csv file with a ticker and an industry column and
+    the names of those columns
+
+    Function will return a dict of ticker to industry
+    '''
+    mapping = pd.read_csv(path, dtype=str)
+
+    return dict(zip(mapping[ticker_col], mapping[industry_col]))
+
+
+def assign_industries(df, industries, ticker_col="tic",
+                      industry_col=INDUSTRY_COL):
+    '''
+    Function will add an industry column to a panel
+
+    Function will take a dataframe, the mapping (a dict or series of ticker to
+    industry, or the name of a column already holding it, e.g. sic) and the
+    ticker and industry column names
+
+    Function will return nothing and just add the industry column (NaN for
+    unmapped firms, which are left out of every peer group)
+    '''
+    if isinstance(industries, str):
+        df[industry_col] = df[industries]
+    else:
+        df[industry_col] = df[ticker_col].map(pd.Series(industries))
+
+
+def group_codes(df, industry_col=INDUSTRY_COL, period_col=CAL_PERIOD):
+    '''
+    Function will number the (industry, quarter) groups of a panel
+
+    Function will take a dataframe with industry and period columns
+
+    Function will return an int array of group numbers (-1 for rows with no
+    industry or quarter), the industry of each group and the quarter of each
+    group
+    '''
+    industry, names = pd.factorize(df[industry_col])
+    period = df[period_col].to_numpy(dtype=np.int64)
+    valid = (industry >= 0) & (period >= 0)
+
+    # One int64 key per (industry, quarter), then renumbered 0..groups-1
+    key = np.where(valid, industry.astype(np.int64) << 32 | period, -1)
+    groups, codes = np.unique(key[valid], return_inverse=True)
+    result = np.full(len(key), -1, dtype=np.int64)
+    result[valid] = codes
+
+    return result, names[groups >> 32], groups & 0xFFFFFFFF
+
+
+def group_stats(values, codes, n_groups, percentiles=PERCENTILES):
+    '''
+    Function will find cross-sectional statistics for one column with one
+    sort
+
+    Function will take the column values, the group number of each row (-1
+    to leave a row out), the number of groups and the percentiles wanted
+
+    Function will return a dict of per-group arrays (count, mean, std and
+    p<percentile> for each percentile) and per-row arrays (z and pct, the
+    percentile rank with ties averaged, 0 for the group minimum and 1 for the
+    maximum)
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(values) & (codes >= 0)
+    rows = np.flatnonzero(valid)
+    group = codes[rows]
+    x = values[rows]
+
+    count = np.bincount(group, minlength=n_groups)
+    total = np.bincount(group, weights=x, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        spread = np.bincount(group, weights=(x - mean[group]) ** 2,
+                             minlength=n_groups)
+        std = np.sqrt(spread / (count - 1))
+
+    # Sorted by group, then by value inside each group
+    order = np.lexsort((x, group))
+    x_sorted = x[order]
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+
+    stats = {"count": count, "mean": mean, "std": std}
+    for q in percentiles:
+        # Linear interpolation between the two closest ranks, like np.quantile
+        pos = start + (count - 1) * q / 100.0
+        low = np.floor(pos).astype(np.int64)
+        high = np.ceil(pos).astype(np.int64)
+        has = count > 0
+        value = np.full(n_groups, np.nan)
+        value[has] = x_sorted[low[has]] + (pos[has] - low[has]) * \
+            (x_sorted[high[has]] - x_sorted[low[has]])
+        stats["p" + str(q)] = value
+
+    # Average position of each run of tied values inside its group
+    position = np.arange(len(x_sorted))
+    new_run = np.ones(len(x_sorted), dtype=bool)
+    new_run[1:] = (x_sorted[1:] != x_sorted[:-1]) | \
+        (group[order][1:] != group[order][:-1])
+    run_end = np.ones(len(x_sorted), dtype=bool)
+    run_end[:-1] = new_run[1:]
+    first = np.maximum.accumulate(np.where(new_run, position, 0))
+    last = np.minimum.accumulate(
+        np.where(run_end, position, len(x_sorted))[::-1])[::-1]
+    rank = np.empty(len(x_sorted))
+    rank[order] = (first + last) / 2.0 - start[group[order]]
+
+    pct = np.full(len(values), np.nan)
+    z = np.full(len(values), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct[rows] = np.where(count[group] > 1, rank / (count[group] - 1), 0.5)
+        z[rows] = (x - mean[group]) / std[group]
+
+    stats["pct"] = pct
+    stats["z"] = z
+
+    return stats
+
+
+def peer_stats(df, ratios=None, industries=INDUSTRY_COL,
+               percentiles=PERCENTILES, firm_col="tic"):
+    '''
+    Function will add peer-relative ratios to a panel and summarise every
+    peer group
+
+    Function will take a dataframe holding many firms, the ratio (or any
+    numeric) columns (every registered ratio whose inputs are present if
+    None; missing ratios are computed), the industry mapping (see
+    assign_industries; a column name uses that column as is), the
+    percentiles and the ticker column
+
+    Function will return a dataframe with one row per (industry, quarter,
+    ratio) group, and add <ratio>_peer_rel (ratio minus peer median),
+    <ratio>_peer_z and <ratio>_peer_pct columns to df
+    '''
+    if ratios is None:
+        ratios = [name for name in RATIOS
+                  if name in df.columns or
+                  set(ratio_columns([name])) <= set(df.columns)]
+    ratios = list(ratios)
+    missing = [name for name in ratios
+               if name not in df.columns and name in RATIOS]
+    if missing:
+        compute_ratios(df, missing)
+
+    add_period_index(df)
+    if isinstance(industries, str) and industries == INDUSTRY_COL:
+        if INDUSTRY_COL not in df.columns:
+            raise ValueError("df has no " + INDUSTRY_COL + " column, pass a "
+                             "firm to industry mapping")
+    else:
+        assign_industries(df, industries, firm_col)
+
+    codes, group_industry, group_period = group_codes(df)
+    n_groups = len(group_industry)
+    # The median is always needed for the peer-relative ratio
+    wanted = sorted(set(percentiles) | {50})
+
+    tables = []
+    new_columns = {}
+    for ratio in ratios:
+        values = df[ratio].to_numpy(dtype=float, na_value=np.nan)
+        stats = group_stats(values, codes, n_groups, wanted)
+        center = stats["p50"]
+
+        relative = np.full(len(values), np.nan)
+        in_group = codes >= 0
+        relative[in_group] = values[in_group] - center[codes[in_group]]
+        relative[~np.isfinite(values)] = np.nan
+        new_columns[ratio + RELATIVE_SUFFIX] = relative
+        new_columns[ratio + ZSCORE_SUFFIX] = stats["z"]
+        new_columns[ratio + RANK_SUFFIX] = stats["pct"]
+
+        table = pd.DataFrame({
+            INDUSTRY_COL: group_industry, CAL_PERIOD: group_period,
+            "ratio": ratio,
+        })
+        for key in ["count", "mean", "std"] + \
+                ["p" + str(q) for q in percentiles]:
+            table[key] = stats[key]
+        tables.append(table)
+
+    for name, values in new_columns.items():
+        df[name] = values
+
+    if not tables:
+        return pd.DataFrame()
+    summary = pd.concat(tables, ignore_index=True)
+
+    return summary.sort_values([INDUSTRY_COL, "ratio", CAL_PERIOD],
+                               kind="stable").reset_index(drop=True)
+
+
+def peer_columns(ratios):
+    '''
+    Function will list the peer-relative columns of some ratios
+
+    Function will take the ratio names
+
+    Function will return a list of column names
+    '''
+    return [ratio + suffix for ratio in ratios
+            for suffix in (RELATIVE_SUFFIX, ZSCORE_SUFFIX, RANK_SUFFIX)]
+
+
+def peer_scan(df, ratios=None, industries=INDUSTRY_COL, target="stock_price",
+              firm_col="tic", top_k=None):
+    '''
+    Function will correlate peer-relative ratios with the stock price for
+    every ticker
+
+    Function will take a dataframe holding many firms sorted by firm and
+    date, the ratios, the industry mapping, the target and ticker columns and
+    how many variables to keep per ticker (all if None)
+
+    Function will return the scan_correlations table of the peer-relative
+    columns
+    '''
+    summary = peer_stats(df, ratios, industries, firm_col=firm_col)
+    ratios = summary["ratio"].unique() if len(summary) else []
+
+    return scan_correlations(df, columns=peer_columns(ratios), target=target,
+                             firm_col=firm_col, top_k=top_k)
@@ -0,0 +1,245 @@
+'''
+Integer fiscal-calendar period index
+
+Period logic used to be string scanning ('Q4' in datacqtr) and fixed row
+ counts. Here every row gets two integer keys, built once per panel:
+ cal_period from datacqtr and fisc_period from fyearq/fqtr, both
+ year * 4 + quarter - 1, so consecutive quarters differ by exactly 1.
+Filing-type tagging, "last N quarters" slicing, lining firms up on the same
+ calendar quarter and period-keyed price joins are then vectorized integer
+ work on those keys.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+CAL_PERIOD = "cal_period"
+FISC_PERIOD = "fisc_period"
+
+# Stored when a row's quarter can't be worked out
+MISSING_PERIOD = -1
+
+# The csv files write dates as 3/31/00 (price files, googl_ds.csv) or as
+# 03/31/2000 (apple_ds.csv), so no single strptime format fits; "mixed" reads
+# both without pandas' could-not-infer-format warning
+DATE_FORMAT = "mixed"
+
+
+def quarter_key(year, quarter):
+    '''
+    Function will combine a year and quarter into one integer key
+
+    Function will take arrays of years and quarters (1 to 4)
+
+    Function will return an int32 array of year * 4 + quarter - 1
+    '''
+    year = np.asarray(year, dtype=float)
+    quarter = np.asarray(quarter, dtype=float)
+    key = year * 4 + quarter - 1
+
+    return np.where(np.isfinite(key), key, MISSING_PERIOD).astype(np.int32)
+
+
+def period_label(period):
+    '''
+    Function will turn a period key back into a label like '2020Q4'
+
+    Function will take a period key
+
+    Function will return the label as a string
+    '''
+    return str(period // 4) + "Q" + str(period % 4 + 1)
+
+
+def parse_quarter_labels(labels):
+    '''
+    Function will turn labels like '2020Q4' into period keys
+
+    Function will take a series of labels (missing ones become
+    MISSING_PERIOD)
+
+    Function will return an int32 array
+    '''
+    labels = pd.Series(labels).astype("string")
+    year = pd.to_numeric(labels.str.slice(0, 4), errors="coerce")
+    quarter = pd.to_numeric(labels.str.slice(5, 6), errors="coerce")
+
+    return quarter_key(year.to_numpy(dtype=float, na_value=np.nan),
+                       quarter.to_numpy(dtype=float, na_value=np.nan))
+
+
+def date_periods(dates, format=DATE_FORMAT):
+    '''
+    Function will find the calendar quarter of some dates
+
+    Function will take a series of dates as strings or datetimes and the
+    format of the strings
+
+    Function will return an int32 array of period keys
+    '''
+    dates = pd.to_datetime(pd.Series(dates), format=format)
+
+    return quarter_key(dates.dt.year.to_numpy(dtype=float, na_value=np.nan),
+                       (dates.dt.month.to_numpy(dtype=float,
+                                                na_value=np.nan) - 1) // 3 + 1)
+
+
+def _needs_key(df, column):
+    '''
+    Function will check if a period key column has to be (re)built
+
+    Function will take a dataframe and the key column
+
+    Function will return a bool (True if the column is missing or has gaps,
+    e.g. after concatenating a panel that had keys with one that didn't)
+    '''
+    return column not in df.columns or df[column].isna().any()
+
+
+def add_period_index(df):
+    '''
+    Function will add integer calendar and fiscal period keys to a panel
+
+    Function will take a dataframe with datacqtr (or datadate) and
+    fyearq/fqtr (or datafqtr)
+
+    Function will return nothing and just add cal_period and fisc_period
+    columns (skipped if they are already there)
+    '''
+    if _needs_key(df, CAL_PERIOD):
+        if "datacqtr" in df.columns:
+            cal = parse_quarter_labels(df["datacqtr"])
+        else:
+            cal = np.full(df.shape[0], MISSING_PERIOD, dtype=np.int32)
+        # Compustat leaves datacqtr blank now and then, datadate fills it in
+        if "datadate" in df.columns and (cal == MISSING_PERIOD).any():
+            cal = np.where(cal == MISSING_PERIOD, date_periods(df["datadate"]),
+                           cal).astype(np.int32)
+        df[CAL_PERIOD] = cal
+
+    if _needs_key(df, FISC_PERIOD):
+        if "fyearq" in df.columns and "fqtr" in df.columns:
+            df[FISC_PERIOD] = quarter_key(df["fyearq"], df["fqtr"])
+        elif "datafqtr" in df.columns:
+            df[FISC_PERIOD] = parse_quarter_labels(df["datafqtr"])
+        else:
+            df[FISC_PERIOD] = np.full(df.shape[0], MISSING_PERIOD,
+                                      dtype=np.int32)
+
+
+def is_calendar_q4(df):
+    '''
+    Function will flag rows that fall in the 4th calendar quarter
+
+    Function will take a dataframe
+
+    Function will return a bool array
+    '''
+    add_period_index(df)
+    periods = df[CAL_PERIOD].to_numpy()
+
+    return (periods != MISSING_PERIOD) & (periods % 4 == 3)
+
+
+def tag_filings(df):
+    '''
+    Function will tag each row as coming from a 10-K or a 10-Q
+
+    Function will take a dataframe
+
+    Function will return nothing and just add a filing_type column (the
+    fiscal Q4 report is the 10-K)
+    '''
+    add_period_index(df)
+    periods = df[FISC_PERIOD].to_numpy()
+    df["filing_type"] = np.where(periods % 4 == 3, "10-K", "10-Q")
+    df.loc[periods == MISSING_PERIOD, "filing_type"] = None
+
+
+def last_quarters(df, quarters, firm_col="gvkey"):
+    '''
+    Function will flag the rows in each firm's last N calendar quarters
+
+    Function will take a dataframe, the number of quarters and the firm
+    column (the whole df is one firm if it is missing)
+
+    Function will return a bool array
+    '''
+    add_period_index(df)
+    periods = df[CAL_PERIOD]
+    if firm_col in df.columns:
+        latest = periods.groupby(df[firm_col].to_numpy()).transform("max")
+    else:
+        latest = pd.Series(periods.max(), index=df.index)
+
+    keep = periods.to_numpy() > latest.to_numpy() - quarters
+
+    return keep & (periods.to_numpy() != MISSING_PERIOD)
+
+
+def align_calendar(df, column, firm_col="tic"):
+    '''
+    Function will line firms up on the same calendar quarters
+
+    Function will take a dataframe with one or many firms, the column to line
+    up and the firm column
+
+    Function will return the list of period keys, the list of firms and a
+    (periods x firms) float array with NaN where a firm has no value
+    '''
+    add_period_index(df)
+    periods = df[CAL_PERIOD].to_numpy()
+    valid = periods != MISSING_PERIOD
+    periods = periods[valid]
+
+    codes, firms = pd.factorize(df.loc[valid, firm_col])
+    first = periods.min() if len(periods) else 0
+    span = periods.max() - first + 1 if len(periods) else 0
+
+    # Each row goes straight to its (quarter, firm) cell
+    matrix = np.full((span, len(firms)), np.nan)
+    matrix[periods - first, codes] = df.loc[valid, column].to_numpy(
+        dtype=float, na_value=np.nan)
+
+    return list(range(first, first + span)), list(firms), matrix
+
+
+def period_prices(df, price_df, ticker_col="tic", price_date_col="Date",
+                  price_col="Adj Close"):
+    '''
+    Function will look up the last price of each row's calendar quarter
+
+    Function will take the fundamentals dataframe, the price dataframe (with
+    a ticker column, or one firm's prices), the ticker column and the price
+    file's date and price columns
+
+    Function will return a float array lined up with the rows of df (NaN
+    where that quarter has no price)
+    '''
+    add_period_index(df)
+    price_periods = date_periods(price_df[price_date_col])
+    order = np.argsort(pd.to_datetime(price_df[price_date_col],
+                                      format=DATE_FORMAT).to_numpy(),
+                       kind="stable")
+
+    if ticker_col in price_df.columns and ticker_col in df.columns:
+        codes, firms = pd.factorize(price_df[ticker_col])
+        row_codes = pd.Index(firms).get_indexer(df[ticker_col])
+    else:
+        codes = np.zeros(price_df.shape[0], dtype=np.int64)
+        row_codes = np.zeros(df.shape[0], dtype=np.int64)
+
+    first = price_periods.min()
+    span = price_periods.max() - first + 1
+    # Dense (firm, quarter) table; writing in date order leaves the last
+    # price of each quarter in its cell
+    table = np.full((codes.max() + 1, span), np.nan)
+    table[codes[order], price_periods[order] - first] = \
+        price_df[price_col].to_numpy(dtype=float)[order]
+
+    rows = df[CAL_PERIOD].to_numpy() - first
+    found = (row_codes >= 0) & (rows >= 0) & (rows < span)
+    result = np.full(df.shape[0], np.nan)
+    result[found] = table[row_codes[found], rows[found]]
+
+    return result
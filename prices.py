@@ -0,0 +1,134 @@
+'''
+Date-keyed price alignment
+
+Matches every row of a fundamentals panel to a price by date instead of by row
+ position, for any number of tickers at once.
+Both sides are turned into one sorted int64 key (ticker code in the high bits,
+ day number in the low bits) so a single np.searchsorted does a sorted-merge
+ as-of join over the whole universe.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from periods import DATE_FORMAT, period_prices
+
+# "on_or_before": last price on or before the date (quarter end)
+# "after": first price strictly after the date (filing date)
+# "on_or_after": first price on or after the date
+MODES = ("on_or_before", "after", "on_or_after")
+
+# Not an as-of join: last price in the row's calendar quarter, looked up on
+# the integer period index from periods.py
+PERIOD_MODE = "same_quarter"
+
+# Day numbers fit comfortably in the low 32 bits of the join key
+_DAY_BITS = 32
+
+
+def to_days(dates, format=DATE_FORMAT):
+    '''
+    Function will turn dates into integer day numbers
+
+    Function will take a series of dates as strings or datetimes and the
+    format of the strings (see periods.DATE_FORMAT)
+
+    Function will return an int64 numpy array of days since 1970-01-01
+    '''
+    dates = pd.to_datetime(pd.Series(dates), format=format)
+    days = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+    return days
+
+
+def _join_keys(codes, days):
+    '''
+    Function will combine ticker codes and day numbers into one sortable key
+
+    Function will take an int array of ticker codes and an int array of days
+
+    Function will return an int64 numpy array
+    '''
+    offset = np.int64(1) << (_DAY_BITS - 1)
+
+    return (codes.astype(np.int64) << _DAY_BITS) + (days + offset)
+
+
+def asof_join(left_tickers, left_dates, right_tickers, right_dates,
+              right_values, mode="on_or_before", date_format=DATE_FORMAT):
+    '''
+    Function will look up, for every left row, the right value of the same
+    ticker closest in time in the direction given by mode
+
+    Function will take the tickers and dates of the rows we want prices for,
+    the tickers, dates and values of the price rows, one of MODES and the
+    format of any dates given as strings
+
+    Function will return a float numpy array lined up with the left rows, NaN
+    where no price qualifies
+    '''
+    if mode not in MODES:
+        raise ValueError("mode must be one of " + ", ".join(MODES))
+
+    # Gives both sides the same integer code for the same ticker
+    codes, _ = pd.factorize(np.concatenate([np.asarray(left_tickers),
+                                            np.asarray(right_tickers)]))
+    left_codes = codes[:len(left_tickers)]
+    right_codes = codes[len(left_tickers):]
+
+    left_keys = _join_keys(left_codes, to_days(left_dates, date_format))
+    right_keys = _join_keys(right_codes, to_days(right_dates, date_format))
+
+    # Sorts the price rows once so every lookup is a binary search
+    order = np.argsort(right_keys, kind="stable")
+    right_keys = right_keys[order]
+    right_codes = right_codes[order]
+    right_values = np.asarray(right_values, dtype=float)[order]
+
+    if mode == "on_or_before":
+        pos = np.searchsorted(right_keys, left_keys, side="right") - 1
+    elif mode == "after":
+        pos = np.searchsorted(right_keys, left_keys, side="right")
+    else:
+        pos = np.searchsorted(right_keys, left_keys, side="left")
+
+    # A match only counts if it stays inside the same ticker
+    found = (pos >= 0) & (pos < len(right_keys))
+    safe_pos = np.where(found, pos, 0)
+    found &= right_codes[safe_pos] == left_codes
+
+    result = np.full(len(left_keys), np.nan)
+    result[found] = right_values[safe_pos[found]]
+
+    return result
+
+
+def align_prices(df, price_df, date_col="datadate", mode="on_or_before",
+                 ticker_col="tic", price_date_col="Date",
+                 price_col="Adj Close", date_format=DATE_FORMAT):
+    '''
+    Function will find the stock price for every row of a fundamentals panel
+
+    Function will take the fundamentals dataframe, the price dataframe, the
+    fundamentals date column to join on, one of MODES (or PERIOD_MODE), the
+    ticker column, the price file's date and price columns and the format
+    of any dates given as strings. If the price
+    dataframe has no ticker column it is treated as the prices of every ticker
+    in df (one firm)
+
+    Function will return a float numpy array lined up with the rows of df
+    '''
+    if mode == PERIOD_MODE:
+        return period_prices(df, price_df, ticker_col, price_date_col,
+                             price_col)
+
+    if ticker_col in price_df.columns and ticker_col in df.columns:
+        left_tickers = df[ticker_col].to_numpy()
+        right_tickers = price_df[ticker_col].to_numpy()
+    else:
+        left_tickers = np.zeros(df.shape[0], dtype=np.int64)
+        right_tickers = np.zeros(price_df.shape[0], dtype=np.int64)
+
+    return asof_join(left_tickers, df[date_col], right_tickers,
+                     price_df[price_date_col], price_df[price_col], mode,
+                     date_format)
@@ -0,0 +1,242 @@
+'''
+Daily OHLCV price store resampled to fiscal quarter ends
+
+AAPL_Project.csv and GOOGL_Project.csv hold one hand-picked row per quarter.
+ Real price history is daily bars (Date,Open,High,Low,Close,Adj Close,Volume)
+ for thousands of tickers. This store reads those files, puts every bar in
+ its firm's fiscal quarter (quarters end in the month of fyr and every third
+ month from it) and, in one grouped pass over all tickers, works out each
+ quarter's:
+    Close / Adj Close   last bar of the quarter
+    vwap                volume-weighted (high + low + close) / 3
+    quarter_return      change in Adj Close from the previous quarter end
+    realized_vol        sqrt of the summed squared daily log returns
+    days                trading days seen
+The result is cached (cache.save_derived), and its tic/Date/Adj Close columns
+ are what align_prices and get_stock_price read, so consumers only ever touch
+ the small quarterly series.
+'''
+
+import json
+import os
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from cache import CACHE_DIR, load_derived, save_derived
+from periods import DATE_FORMAT
+
+DAILY_COLUMNS = ("Date", "Open", "High", "Low", "Close", "Adj Close", "Volume")
+
+# Fiscal year end month used for tickers we have no fyr for
+DEFAULT_FYR = 12
+
+
+def read_daily(path, ticker=None, ticker_col="tic"):
+    '''
+    Function will read a daily price file
+
+    Function will take the csv file, the ticker it belongs to (None if the
+    file has a ticker column) and the ticker column name
+
+    Function will return a dataframe with the ticker, Date as datetime and
+    float prices and volume
+    '''
+    usecols = list(DAILY_COLUMNS)
+    if ticker is None:
+        usecols.append(ticker_col)
+    dtypes = {name: "float64" for name in DAILY_COLUMNS if name != "Date"}
+
+    daily = pd.read_csv(path, usecols=usecols, dtype=dtypes)
+    daily["Date"] = pd.to_datetime(daily["Date"], format=DATE_FORMAT)
+    if ticker is not None:
+        daily[ticker_col] = ticker
+
+    return daily
+
+
+def fiscal_year_ends(df, ticker_col="tic"):
+    '''
+    Function will find each firm's fiscal year end month
+
+    Function will take a fundamentals dataframe with fyr and ticker columns
+
+    Function will return a dict of ticker to month (the latest fyr seen)
+    '''
+    known = df[[ticker_col, "fyr"]].dropna()
+
+    return dict(zip(known[ticker_col], known["fyr"].astype(int)))
+
+
+def quarter_end_month(months, fyr):
+    '''
+    Function will find the fiscal quarter each month falls in
+
+    Function will take months as a count since year 0 (year * 12 + month -
+    1) and the fiscal year end month (1 to 12) of each row
+
+    Function will return the month count of the quarter's last month
+    '''
+    months = np.asarray(months, dtype=np.int64)
+    fyr = np.asarray(fyr, dtype=np.int64)
+
+    # Quarter ends are the months congruent to fyr - 1 modulo 3
+    return months + (fyr - 1 - months) % 3
+
+
+def resample_quarters(daily, fyr=None, ticker_col="tic"):
+    '''
+    Function will turn daily bars into fiscal-quarter rows for every ticker
+    in one grouped pass
+
+    Function will take a dataframe of daily bars for one or many tickers, a
+    dict of ticker to fiscal year end month (DEFAULT_FYR for missing ones)
+    and the ticker column
+
+    Function will return a dataframe with one row per (ticker, quarter): tic,
+    Date (the quarter end), last_trade, Close, Adj Close, vwap,
+    quarter_return, realized_vol and days
+    '''
+    if fyr is None:
+        fyr = {}
+    if ticker_col not in daily.columns:
+        daily = daily.assign(**{ticker_col: "ALL"})
+
+    codes, tickers = pd.factorize(daily[ticker_col])
+    dates = pd.to_datetime(daily["Date"], format=DATE_FORMAT).to_numpy(
+        dtype="datetime64[D]")
+    firm_fyr = pd.Series(tickers).map(fyr).fillna(DEFAULT_FYR).to_numpy(
+        dtype=np.int64)
+
+    # Sorts every bar by ticker then date once
+    order = np.lexsort((dates, codes))
+    codes = codes[order]
+    dates = dates[order]
+    close = daily["Close"].to_numpy(dtype=float)[order]
+    adj = daily["Adj Close"].to_numpy(dtype=float)[order]
+    high = daily["High"].to_numpy(dtype=float)[order]
+    low = daily["Low"].to_numpy(dtype=float)[order]
+    volume = daily["Volume"].to_numpy(dtype=float)[order]
+
+    months = dates.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+    quarter = quarter_end_month(months, firm_fyr[codes])
+
+    # A new group starts where the ticker or the quarter changes
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = (codes[1:] != codes[:-1]) | (quarter[1:] != quarter[:-1])
+    group = np.cumsum(starts) - 1
+    n_groups = group[-1] + 1 if len(group) else 0
+    first = np.flatnonzero(starts)
+    last = np.concatenate([first[1:], [len(codes)]]) - 1
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        typical = (high + low + close) / 3
+        traded = np.isfinite(typical) & np.isfinite(volume)
+        dollar = np.bincount(group, weights=np.where(traded,
+                                                     typical * volume, 0),
+                             minlength=n_groups)
+        shares = np.bincount(group, weights=np.where(traded, volume, 0),
+                             minlength=n_groups)
+        vwap = dollar / shares
+
+        # Daily log returns inside a ticker, the first bar has none
+        step = np.full(len(adj), np.nan)
+        step[1:] = np.log(adj[1:] / adj[:-1])
+        step[np.flatnonzero(np.diff(codes) != 0) + 1] = np.nan
+        if len(step):
+            step[0] = np.nan
+        squares = np.where(np.isfinite(step), step ** 2, 0.0)
+        realized = np.sqrt(np.bincount(group, weights=squares,
+                                       minlength=n_groups))
+
+    days = np.bincount(group, minlength=n_groups)
+    group_code = codes[first]
+    group_quarter = quarter[first]
+    quarter_close = adj[last]
+
+    # Return over one quarter needs the previous quarter of the same ticker
+    ret = np.full(n_groups, np.nan)
+    if n_groups > 1:
+        follows = (group_code[1:] == group_code[:-1]) & \
+            (group_quarter[1:] - group_quarter[:-1] == 3)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            change = quarter_close[1:] / quarter_close[:-1] - 1
+        ret[1:] = np.where(follows, change, np.nan)
+
+    # Last calendar day of the quarter's final month
+    end_month = (group_quarter - 1970 * 12).astype("datetime64[M]")
+    quarter_end = (end_month + 1).astype("datetime64[D]") - 1
+
+    return pd.DataFrame({
+        ticker_col: np.asarray(tickers)[group_code],
+        "Date": pd.to_datetime(quarter_end),
+        "last_trade": pd.to_datetime(dates[last]),
+        "Close": close[last],
+        "Adj Close": quarter_close,
+        "vwap": vwap,
+        "quarter_return": ret,
+        "realized_vol": realized,
+        "days": days,
+    })
+
+
+def _cache_key(files, fyr, ticker_col):
+    '''
+    Function will name a quarterly result by its inputs and settings
+
+    Function will take the dict of ticker to file, the fyr dict and the
+    ticker column
+
+    Function will return a string
+    '''
+    settings = {
+        "files": sorted((str(ticker), os.path.abspath(path))
+                        for ticker, path in files.items()),
+        "fyr": sorted((str(ticker), int(month))
+                      for ticker, month in fyr.items()),
+        "ticker_col": ticker_col,
+    }
+
+    return "quarterly_prices:" + json.dumps(settings)
+
+
+def quarterly_prices(files, fyr=None, ticker_col="tic", cache=True,
+                     cache_dir=CACHE_DIR):
+    '''
+    Function will load fiscal-quarter prices for many tickers from daily
+    files, resampling only when the cached result is missing or stale
+
+    Function will take the daily files (a dict of ticker to file, or a list
+    of files that have a ticker column), the dict of ticker to fiscal year
+    end month, the ticker column, whether to use the cache and the cache
+    directory
+
+    Function will return the resample_quarters dataframe, ready to pass to
+    get_stock_price / align_prices as the price dataframe
+    '''
+    if not isinstance(files, dict):
+        files = {None: path for path in files} if len(files) == 1 else \
+            {i: path for i, path in enumerate(files)}
+        tickers = {key: None for key in files}
+    else:
+        tickers = {key: key for key in files}
+    if fyr is None:
+        fyr = {}
+
+    key = _cache_key(files, fyr, ticker_col)
+    if cache:
+        quarterly = load_derived(key, list(files.values()),
+                                 cache_dir=cache_dir)
+        if quarterly is not None:
+            quarterly["Date"] = pd.to_datetime(quarterly["Date"])
+            quarterly["last_trade"] = pd.to_datetime(quarterly["last_trade"])
+            return quarterly
+
+    daily = pd.concat([read_daily(path, tickers[name], ticker_col)
+                       for name, path in files.items()], ignore_index=True)
+    quarterly = resample_quarters(daily, fyr, ticker_col)
+
+    if cache:
+        save_derived(key, quarterly, list(files.values()), cache_dir)
+
+    return quarterly
@@ -0,0 +1,159 @@
+'''
+Ratio registry and vectorized ratio engine
+
+Every ratio we study is declared once in RATIOS as a numerator (one or more
+ Compustat columns that get summed), a denominator column and whether the
+ denominator is averaged with the previous quarter.
+The engine computes any set of registered ratios for a whole panel (one or
+ many firms stacked on top of each other, each firm sorted by date) with
+ NumPy array operations instead of per-row df.loc reads and writes.
+'''
+
+from collections import namedtuple
+
+import numpy as np  # useful library to handle array and computation
+
+from transforms import add_ytd_transforms, source_column
+
+# numerator is a tuple of columns that are added together
+# average means the denominator is averaged with the previous quarter
+Ratio = namedtuple("Ratio", ["numerator", "denominator", "average"])
+
+# Column used to tell firms apart when a panel holds more than one company
+FIRM_COL = "gvkey"
+
+RATIOS = {}
+
+
+def register_ratio(name, numerator, denominator, average=False):
+    '''
+    Function will add a ratio to the registry
+
+    Function will take the name of the ratio (also the name of the column it
+    is written to), the numerator as a column name or a list of column names
+    that are added together, the denominator column name and a bool for
+    averaging the denominator with the previous quarter
+
+    Function will return the registered Ratio
+    '''
+    if isinstance(numerator, str):
+        numerator = (numerator,)
+    ratio = Ratio(tuple(numerator), denominator, average)
+    RATIOS[name] = ratio
+
+    return ratio
+
+
+def ratio_columns(names=None):
+    '''
+    Function will find every Compustat column needed to compute some ratios
+
+    Function will take a list of ratio names (all registered ratios if None)
+
+    Function will return a sorted list of column names
+    '''
+    if names is None:
+        names = list(RATIOS)
+
+    columns = set()
+    for name in names:
+        ratio = RATIOS[name]
+        for col in ratio.numerator + (ratio.denominator,):
+            # Quarterly and TTM columns are derived from a year-to-date field
+            columns.add(source_column(col) or col)
+
+    return sorted(columns)
+
+
+def first_rows(df, firm_col=FIRM_COL):
+    '''
+    Function will flag the first quarter of every firm in a panel
+
+    Function will take a dataframe sorted by firm and date, and the column
+    that identifies the firm (the whole df is one firm if it is missing)
+
+    Function will return a bool array that is True on each firm's first row
+    '''
+    first = np.zeros(df.shape[0], dtype=bool)
+    if df.shape[0] == 0:
+        return first
+
+    first[0] = True
+    if firm_col in df.columns:
+        firms = df[firm_col].to_numpy()
+        first[1:] = firms[1:] != firms[:-1]
+
+    return first
+
+
+def compute_ratios(df, names=None, firm_col=FIRM_COL):
+    '''
+    Function will calculate registered ratios for every row of a panel in one
+    vectorized pass
+
+    Function will take a dataframe sorted by firm and date, a list of ratio
+    names (all registered ratios if None) and the firm column
+
+    Function will return nothing and just add a column to the dataframe for
+    each ratio
+    '''
+    if names is None:
+        names = list(RATIOS)
+
+    # Adds any quarterly/TTM cash flow columns these ratios read, once
+    derived = set()
+    for name in names:
+        ratio = RATIOS[name]
+        for col in ratio.numerator + (ratio.denominator,):
+            if col not in df.columns and source_column(col) is not None:
+                derived.add(source_column(col))
+    if derived:
+        add_ytd_transforms(df, sorted(derived), firm_col)
+
+    first = first_rows(df, firm_col)
+    results = {}
+
+    # Division by a zero denominator gives inf just like the scalar version
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name in names:
+            ratio = RATIOS[name]
+
+            numerator = df[ratio.numerator[0]].to_numpy(dtype=float)
+            for col in ratio.numerator[1:]:
+                numerator = numerator + df[col].to_numpy(dtype=float)
+
+            denominator = df[ratio.denominator].to_numpy(dtype=float)
+            if ratio.average:
+                # Our denominator is usually an average with the previous
+                # quarter, so for each firm's first quarter we are not
+                # taking an average
+                previous = np.empty_like(denominator)
+                previous[1:] = denominator[:-1]
+                previous[first] = np.nan
+                denominator = np.where(first, denominator,
+                                       (denominator + previous) / 2)
+
+            results[name] = numerator / denominator
+
+    for name, values in results.items():
+        df[name] = values
+
+
+# Current ratio (current assets / current liabilities)
+register_ratio("cur_ratio", "actq", "lctq")
+# Return on assets (net income / average total assets)
+register_ratio("roa_ratio", "niq", "atq", average=True)
+# Return on equity (net income / average shareholder equity)
+register_ratio("roe_ratio", "niq", "seqq", average=True)
+# Net profit margin (net income / net sales revenue)
+register_ratio("profit_margin", "niq", "saleq")
+# Inventory turnover (cost of goods sold / average inventory)
+register_ratio("inventory_turnover", "cogsq", "invtq", average=True)
+# Debt to equity (total liabilities / shareholder equity)
+register_ratio("debt_to_equity", "ltq", "seqq")
+# Cash flow to capital expenditures (total cash flow / capex)
+register_ratio("cf_capex", ["oancfy", "ivncfy", "fincfy"], "capxy")
+# Same ratio from de-cumulated quarterly and trailing twelve month cash flows
+register_ratio("cf_capex_q", ["oancfy_q", "ivncfy_q", "fincfy_q"], "capxy_q")
+register_ratio("cf_capex_ttm", ["oancfy_ttm", "ivncfy_ttm", "fincfy_ttm"],
+               "capxy_ttm")
@@ -0,0 +1,236 @@
+'''
+Batched closed-form least squares
+
+Every graph function used to call np.polyfit for its line of best fit and then
+ calc_corr for the correlation, one pair at a time. Here the slope, intercept,
+ R^2, standard errors and Pearson correlation for every (ticker, ratio) pair
+ come out of one set of shared moment sums, and multivariate fits (price on
+ several ratios together) are solved for every ticker with one batched
+ normal-equation solve. The charts then only draw precomputed numbers.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from scan import firm_positions, pairwise_moments, to_tensor
+
+
+def _centered(values):
+    '''
+    Function will center every column on its own mean, ignoring NaNs
+
+    Function will take an array shaped (..., n, p)
+
+    Function will return the centered array (inf becomes NaN) and the means
+    shaped (..., 1, p)
+    '''
+    values = np.asarray(values, dtype=float)
+    values = np.where(np.isfinite(values), values, np.nan)
+    with np.errstate(invalid="ignore"):
+        count = np.sum(~np.isnan(values), axis=-2, keepdims=True)
+        mean = np.nansum(values, axis=-2, keepdims=True) / \
+            np.maximum(count, 1)
+
+    return values - mean, mean
+
+
+def simple_fits(x, y):
+    '''
+    Function will fit y = slope * x + intercept for every pair of x and y
+    columns from one set of moment sums
+
+    Function will take arrays shaped (..., n, p) and (..., n, q) (NaN or inf
+    marks a missing value, each pair uses the quarters where both exist)
+
+    Function will return a dict of (..., p, q) arrays: slope, intercept, corr,
+    r2, slope_se, intercept_se and n
+    '''
+    # Centering first keeps the sums well conditioned; the means are added
+    # back when we work out the intercept
+    x_c, x_mean = _centered(x)
+    y_c, y_mean = _centered(y)
+    m = pairwise_moments(x_c, y_c)
+    n = m["n"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = m["sx"] / n
+        mean_y = m["sy"] / n
+        sxx = m["sxx"] - m["sx"] * mean_x
+        syy = m["syy"] - m["sy"] * mean_y
+        sxy = m["sxy"] - m["sx"] * mean_y
+
+        slope = sxy / sxx
+        # Shifts the pairwise means back to the original units
+        mean_x = mean_x + np.swapaxes(x_mean, -1, -2)
+        mean_y = mean_y + y_mean
+        intercept = mean_y - slope * mean_x
+
+        corr = sxy / np.sqrt(sxx * syy)
+        r2 = corr ** 2
+        resid_var = np.maximum(syy - slope * sxy, 0) / (n - 2)
+        slope_se = np.sqrt(resid_var / sxx)
+        intercept_se = np.sqrt(resid_var * (1 / n + mean_x ** 2 / sxx))
+
+    bad = (n < 2) | ~(sxx > 0)
+    for values in (slope, intercept, corr, r2):
+        values[bad] = np.nan
+    slope_se[bad | (n < 3)] = np.nan
+    intercept_se[bad | (n < 3)] = np.nan
+
+    return {"slope": slope, "intercept": intercept, "corr": corr, "r2": r2,
+            "slope_se": slope_se, "intercept_se": intercept_se, "n": n}
+
+
+def fit_line(x, y):
+    '''
+    Function will fit a line of best fit through two columns
+
+    Function will take the x values (for example stock price) and y values
+    (for example a ratio)
+
+    Function will return a dict of floats: slope, intercept, corr, r2,
+    slope_se, intercept_se and n
+    '''
+    fits = simple_fits(np.asarray(x, dtype=float)[:, None],
+                       np.asarray(y, dtype=float)[:, None])
+
+    return {name: float(values[0, 0]) for name, values in fits.items()}
+
+
+def fit_panel(df, columns, target="stock_price", firm_col="tic"):
+    '''
+    Function will fit every column against the stock price for every ticker,
+    the way the graph functions draw it (ratio = slope * price + intercept)
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the columns to fit, the price column and the firm column
+
+    Function will return a dataframe with one row per (ticker, variable)
+    '''
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    columns = list(columns)
+
+    firms, codes, position = firm_positions(df, firm_col)
+    price = to_tensor(df[[target]].to_numpy(dtype=float, na_value=np.nan),
+                      codes, position, len(firms))
+    values = to_tensor(df[columns].to_numpy(dtype=float, na_value=np.nan),
+                       codes, position, len(firms))
+
+    fits = simple_fits(price, values)
+
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), len(firms)),
+    })
+    for name, array in fits.items():
+        table[name] = array[:, 0, :].ravel()
+    table["n"] = table["n"].astype(int)
+
+    return table
+
+
+def multi_fits(x, y):
+    '''
+    Function will fit y on several x columns together for a whole batch with
+    one batched normal-equation solve
+
+    Function will take x shaped (..., n, k) and y shaped (..., n); quarters
+    where y or any x is missing are left out of that batch entry's fit
+
+    Function will return a dict: coef (..., k + 1) with the intercept first,
+    se (..., k + 1), r2 (...) and n (...)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(y) & np.all(np.isfinite(x), axis=-1)
+    weight = keep.astype(float)
+
+    # Standardized columns keep X'X well conditioned across very different
+    # scales (ratios near 1, dollar amounts in the millions)
+    x0 = np.where(keep[..., None], x, 0.0)
+    n = weight.sum(axis=-1)
+    safe_n = np.maximum(n, 1)[..., None]
+    x_mean = x0.sum(axis=-2) / safe_n
+    x_std = np.sqrt((((x0 - x_mean[..., None, :]) * weight[..., None]) ** 2)
+                    .sum(axis=-2) / safe_n)
+    x_std = np.where(x_std > 0, x_std, 1.0)
+    z = (x0 - x_mean[..., None, :]) / x_std[..., None, :] * weight[..., None]
+
+    design = np.concatenate([weight[..., None], z], axis=-1)
+    y0 = np.where(keep, y, 0.0)
+
+    xtx = np.swapaxes(design, -1, -2) @ design
+    xty = (np.swapaxes(design, -1, -2) @ y0[..., None])[..., 0]
+    # pinv keeps one rank-deficient firm from failing the whole batch
+    xtx_inv = np.linalg.pinv(xtx)
+    beta = (xtx_inv @ xty[..., None])[..., 0]
+
+    fitted = (design @ beta[..., None])[..., 0]
+    resid = (y0 - fitted) * weight
+    k = x.shape[-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sse = (resid ** 2).sum(axis=-1)
+        y_mean = y0.sum(axis=-1) / np.maximum(n, 1)
+        sst = (((y0 - y_mean[..., None]) * weight) ** 2).sum(axis=-1)
+        r2 = 1 - sse / sst
+        resid_var = sse / (n - k - 1)
+        se_z = np.sqrt(np.diagonal(xtx_inv, axis1=-2, axis2=-1) *
+                       resid_var[..., None])
+
+    # Undoes the standardization so coefficients are in the original units
+    slopes = beta[..., 1:] / x_std
+    intercept = beta[..., 0] - (slopes * x_mean).sum(axis=-1)
+    slope_se = se_z[..., 1:] / x_std
+    # Intercept variance in original units from the full covariance matrix
+    shift = np.concatenate([np.ones(x_mean.shape[:-1] + (1,)),
+                            -x_mean / x_std], axis=-1)
+    with np.errstate(invalid="ignore"):
+        intercept_se = np.sqrt(np.einsum("...i,...ij,...j->...", shift,
+                                         xtx_inv, shift) * resid_var)
+
+    coef = np.concatenate([intercept[..., None], slopes], axis=-1)
+    se = np.concatenate([intercept_se[..., None], slope_se], axis=-1)
+    too_few = n <= k + 1
+    coef[too_few] = np.nan
+    se[too_few] = np.nan
+    r2 = np.where(too_few, np.nan, r2)
+
+    return {"coef": coef, "se": se, "r2": r2, "n": n}
+
+
+def fit_multi_panel(df, columns, target="stock_price", firm_col="tic"):
+    '''
+    Function will fit the stock price on several columns together for every
+    ticker (price = intercept + sum of coefficient * column)
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the columns to use together, the price column and the firm
+    column
+
+    Function will return a dataframe with one row per (ticker, term), where
+    the intercept's term is "intercept"
+    '''
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    columns = list(columns)
+
+    firms, codes, position = firm_positions(df, firm_col)
+    x = to_tensor(df[columns].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+    y = to_tensor(df[[target]].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))[..., 0]
+
+    fits = multi_fits(x, y)
+
+    terms = ["intercept"] + columns
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(terms)),
+        "term": np.tile(np.asarray(terms, dtype=object), len(firms)),
+        "coef": fits["coef"].ravel(),
+        "se": fits["se"].ravel(),
+        "r2": np.repeat(fits["r2"], len(terms)),
+        "n": np.repeat(fits["n"], len(terms)).astype(int),
+    })
+
+    return table
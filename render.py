@@ -0,0 +1,233 @@
+'''
+Headless, parallel chart rendering
+
+Draws the same "Share Price vs. <ratio>" charts as the graph_*_to_stock
+ functions, but without pyplot: every worker process builds one Agg figure,
+ reuses it for every chart it is given and never calls show.
+Jobs are (ticker, ratio) pairs; only the two columns a chart needs are sent to
+ a worker and only a few jobs are in flight at once, so a whole universe
+ renders across every core with bounded memory.
+'''
+
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np  # useful library to handle array and computation
+
+from regression import fit_line, simple_fits
+
+# title and ylabel are what the chart shows, file_suffix goes in the png name
+# and label is what gets printed next to the correlation
+Chart = namedtuple("Chart", ["title", "ylabel", "file_suffix", "label"])
+
+CHARTS = {
+    "cur_ratio": Chart("Current Ratio", "Current Ratio", "CurrentRatio",
+                       "Current Ratio Correlation: "),
+    "roa_ratio": Chart("Return on Assets", "Return on Assets",
+                       "ReturnOnAssets", "ROA Correlation: "),
+    "roe_ratio": Chart("Return on Equity", "Return on Equity",
+                       "ReturnOnEquity", "ROE Correlation: "),
+    "profit_margin": Chart("Net Profit Margin", "Net Profit Margin",
+                           "NetProfitMargin",
+                           "Profit Margin Stock Correlation: "),
+    "inventory_turnover": Chart("Inventory Turnover Ratio",
+                                "Inventory Turnover", "InventoryTurnover",
+                                "Inventory Turnover Stock Correlation: "),
+    "debt_to_equity": Chart("Debt to Equity Ratio", "Debt to Equity Ratio",
+                            "DebtToEquity",
+                            "Debt to Equity Stock Correlation: "),
+    "cf_capex": Chart("Cash Flow to Capital Expenditures",
+                      "Cash Flow to Capital Expenditures", "CFCapEX",
+                      "CF to CapEX Stock Correlation: "),
+    "xrdq": Chart("Research and Development Expense",
+                  "Research and Development Expense", "RND",
+                  "R&D Stock Correlation: "),
+}
+
+# Size of every chart, same as the graph_* functions
+FIGSIZE = (16, 12)
+
+# Figure and axes owned by this worker process, made on first use
+_FIGURE = None
+_AXES = None
+
+
+def chart_spec(ratio):
+    '''
+    Function will find how a ratio should be labeled
+
+    Function will take the name of a ratio or column
+
+    Function will return a Chart (made up from the name if it is not in
+    CHARTS)
+    '''
+    if ratio in CHARTS:
+        return CHARTS[ratio]
+
+    return Chart(ratio, ratio, ratio, ratio + " Stock Correlation: ")
+
+
+def fig_name(company, ratio):
+    '''
+    Function will build the png name for a chart
+
+    Function will take the company as a string and the ratio name
+
+    Function will return the file name as a string
+    '''
+    return company + "_SharePrice_to_" + chart_spec(ratio).file_suffix + \
+        ".png"
+
+
+def draw_chart(ax, price, values, company, ratio, fit=None, corr=None):
+    '''
+    Function will draw a share price vs. ratio chart on an axes
+
+    Function will take the axes, the price and ratio values, the company as a
+    string, the ratio name, and optionally a precomputed (slope, intercept)
+    and correlation (both are fit here if either is missing)
+
+    Function will return the correlation that was shown on the chart
+    '''
+    spec = chart_spec(ratio)
+    price = np.asarray(price, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    # Plots the points as a scatter plot
+    ax.scatter(price, values)
+
+    # Fits the line and correlation here only if they weren't precomputed
+    if fit is None or corr is None:
+        line = fit_line(price, values)
+        fit = (line["slope"], line["intercept"])
+        corr = line["corr"]
+    m, b = fit
+
+    # Plots the line of best fit
+    ax.plot(price, m*price + b, "--", color = "Red",
+            label = "Line-of-Best-Fit")
+
+    ax.set_title(company + " Share Price vs. " + spec.title)
+    ax.set_xlabel("Share Price \n Correlation: " + str(round(corr, 5)))
+    ax.set_ylabel(spec.ylabel)
+    ax.legend()
+
+    return corr
+
+
+def _worker_axes():
+    '''
+    Function will give back this process's reusable figure and axes
+
+    Function will take nothing
+
+    Function will return the figure and a cleared axes
+    '''
+    global _FIGURE, _AXES
+
+    if _FIGURE is None:
+        # Agg canvas directly, so no interactive backend is ever started
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        _FIGURE = Figure(figsize=FIGSIZE)
+        FigureCanvasAgg(_FIGURE)
+        _AXES = _FIGURE.add_subplot()
+    else:
+        _AXES.clear()
+
+    return _FIGURE, _AXES
+
+
+def render_chart(job):
+    '''
+    Function will render one chart to a png without showing it
+
+    Function will take a tuple of (ticker, company, ratio, price values,
+    ratio values, (slope, intercept), correlation, output directory)
+
+    Function will return a tuple of (ticker, ratio, png path, correlation)
+    '''
+    ticker, company, ratio, price, values, fit, corr, outdir = job
+
+    fig, ax = _worker_axes()
+    corr = draw_chart(ax, price, values, company, ratio, fit, corr)
+
+    path = os.path.join(outdir, fig_name(company, ratio))
+    fig.savefig(path)
+
+    return ticker, ratio, path, float(corr)
+
+
+def _chart_jobs(panels, jobs, outdir, names):
+    '''
+    Function will turn (ticker, ratio) pairs into jobs a worker can run
+
+    Function will take a dict of ticker to dataframe, the (ticker, ratio)
+    pairs, the output directory and a dict of ticker to company name
+
+    Function will return a generator of render_chart jobs
+    '''
+    # Fits every ratio of a ticker in one batched pass, so the workers only
+    # draw precomputed lines
+    wanted = {}
+    for ticker, ratio in jobs:
+        wanted.setdefault(ticker, []).append(ratio)
+    fits = {}
+    for ticker, ratios in wanted.items():
+        df = panels[ticker]
+        ratios = list(dict.fromkeys(ratios))
+        batch = simple_fits(df[["stock_price"]].to_numpy(dtype=float),
+                            df[ratios].to_numpy(dtype=float))
+        for i, ratio in enumerate(ratios):
+            fits[ticker, ratio] = ((batch["slope"][0, i],
+                                    batch["intercept"][0, i]),
+                                   batch["corr"][0, i])
+
+    for ticker, ratio in jobs:
+        df = panels[ticker]
+        fit, corr = fits[ticker, ratio]
+        # Only the two columns the chart needs are sent to the worker
+        yield (ticker, names.get(ticker, ticker), ratio,
+               df["stock_price"].to_numpy(dtype=float),
+               df[ratio].to_numpy(dtype=float), fit, corr, outdir)
+
+
+def render_charts(panels, jobs, outdir=".", workers=None, names=None,
+                  max_pending=None):
+    '''
+    Function will render many charts in parallel with a non-interactive
+    backend
+
+    Function will take a dict of ticker to dataframe (with stock_price and
+    the ratio columns), a list of (ticker, ratio) pairs, the output
+    directory, the number of worker processes (all cores if None), a dict of
+    ticker to company name for titles and file names, and how many jobs may
+    wait on the workers at once (2 per worker if None)
+
+    Function will return a list of (ticker, ratio, png path, correlation) in
+    the order the charts finished
+    '''
+    if names is None:
+        names = {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+    os.makedirs(outdir, exist_ok=True)
+
+    results = []
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for job in _chart_jobs(panels, jobs, outdir, names):
+            # Waits for a slot so only a few jobs are held in memory
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            pending.add(pool.submit(render_chart, job))
+
+        done, _ = wait(pending)
+        results.extend(future.result() for future in done)
+
+    return results
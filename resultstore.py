@@ -0,0 +1,350 @@
+'''
+Indexed SQLite store for correlation and regression results
+
+Results used to be printed ("ROA Correlation: ...") or written into chart
+ labels, so nothing could be queried later or compared between runs. This
+ store keeps every run's correlation/fit tables in one local SQLite file
+ (Python's built-in sqlite3, nothing to install):
+    runs      one row per run (id, time, label, settings as json)
+    results   one row per (run, ticker, variable, window, method[, as_of])
+    firms     ticker -> industry, for peer-group queries
+results is indexed on (ticker, variable, window, method, run_id) for lookups
+ and diffs, and on (run_id, window, method, abs_corr) so "top 50 variables by
+ |r|" reads the index in order instead of sorting the table.
+window names the span of quarters a result covers and is always stored
+ through window_label ("all", "20q", ...), so a rolling_scan window of 20
+ and window="20q" land under the same name; method is the measure
+ ("pearson", "spearman", "fit", ...). Rolling results keep one row per
+ as_of date, and top-N queries read only each pair's latest one.
+'''
+
+import json
+import sqlite3
+import time
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+RESULTS_DB = "results.sqlite"
+
+# Changes in r no bigger than this are rounding noise between two runs
+DIFF_TOLERANCE = 1e-12
+
+ALL_QUARTERS = "all"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    label TEXT,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    ticker TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    window TEXT NOT NULL,
+    method TEXT NOT NULL,
+    as_of TEXT NOT NULL DEFAULT '',
+    corr REAL,
+    abs_corr REAL,
+    n INTEGER,
+    slope REAL,
+    intercept REAL,
+    r2 REAL,
+    p_value REAL,
+    q_value REAL
+);
+CREATE INDEX IF NOT EXISTS results_key
+    ON results (ticker, variable, window, method, run_id, as_of);
+CREATE INDEX IF NOT EXISTS results_top
+    ON results (run_id, window, method, abs_corr);
+CREATE TABLE IF NOT EXISTS firms (
+    ticker TEXT PRIMARY KEY,
+    industry TEXT
+);
+CREATE INDEX IF NOT EXISTS firms_industry ON firms (industry, ticker);
+"""
+
+# Optional result columns copied straight from an input table
+VALUE_COLUMNS = ("n", "slope", "intercept", "r2", "p_value", "q_value")
+
+
+def connect(path=RESULTS_DB):
+    '''
+    Function will open (and create if needed) a results store
+
+    Function will take the database file (":memory:" for a throwaway one)
+
+    Function will return a sqlite3 connection
+    '''
+    conn = sqlite3.connect(path)
+    if path != ":memory:":
+        # Readers don't block the writer and commits don't wait on fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+
+    return conn
+
+
+def window_label(quarters=None):
+    '''
+    Function will name the span of quarters a result covers
+
+    Function will take the number of trailing quarters (None or "all" for
+    all of them; a label like "20q" or a number as text is accepted too)
+
+    Function will return a label like "20q" or "all"
+    '''
+    if quarters is None or (isinstance(quarters, float) and
+                            np.isnan(quarters)):
+        return ALL_QUARTERS
+    if isinstance(quarters, str):
+        text = quarters.strip().lower()
+        if text == ALL_QUARTERS:
+            return ALL_QUARTERS
+        quarters = text[:-1] if text.endswith("q") else text
+
+    return str(int(float(quarters))) + "q"
+
+
+def start_run(conn, label=None, params=None):
+    '''
+    Function will record a new run
+
+    Function will take the connection, a label and a dict of settings
+
+    Function will return the new run id
+    '''
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO runs (created, label, params) VALUES (?, ?, ?)",
+            (time.strftime("%Y-%m-%dT%H:%M:%S"), label,
+             json.dumps(params, default=str) if params is not None else None))
+
+    return cursor.lastrowid
+
+
+def latest_run(conn):
+    '''
+    Function will find the most recent run
+
+    Function will take the connection
+
+    Function will return the run id, or None if the store is empty
+    '''
+    return conn.execute("SELECT MAX(run_id) FROM runs").fetchone()[0]
+
+
+def _column(table, name, default=None):
+    '''
+    Function will read a column as a list of plain Python values
+
+    Function will take a dataframe, the column name and the value used when
+    the column is missing
+
+    Function will return a list with None for missing values
+    '''
+    if name not in table.columns:
+        return [default] * len(table)
+    values = table[name].astype(object)
+
+    return values.where(values.notna(), None).tolist()
+
+
+def _corr_column(table, method):
+    '''
+    Function will find the column holding the correlations of a results
+    table
+
+    Function will take the dataframe and the method its rows are filed under
+
+    Function will return the column name: corr, else the column named after
+    the method (robust_scan has one per measure), else best_corr (lead/lag)
+    '''
+    for name in ("corr", method, "best_corr"):
+        if name in table.columns:
+            return name
+
+    raise ValueError("no correlation column in the table, pass corr_col "
+                     "(columns: " + ", ".join(map(str, table.columns)) + ")")
+
+
+def insert_results(conn, run_id, table, window=ALL_QUARTERS, method="pearson",
+                   ticker_col="tic", corr_col=None):
+    '''
+    Function will bulk insert a results table
+
+    Function will take the connection, the run id, a dataframe with a ticker
+    column, a variable column and the correlations (e.g. from
+    scan_correlations, fit_panel, robust_scan, significance_scan,
+    rolling_scan or cli.run), the window and method to file them under (a
+    window or method column in the table wins; windows are named by
+    window_label, so rolling_scan's 20 is stored as "20q"), the ticker column
+    and the correlation column (found by _corr_column if None)
+
+    Function will return the number of rows inserted
+    '''
+    variables = "variable" if "variable" in table.columns else "ratio"
+    if corr_col is None:
+        corr_col = _corr_column(table, method)
+    corr = pd.to_numeric(table[corr_col], errors="coerce").to_numpy(
+        dtype=float)
+    corr = np.where(np.isfinite(corr), corr, np.nan)
+
+    if "as_of" in table.columns:
+        as_of = table["as_of"].astype(str).tolist()
+    elif "datadate" in table.columns:
+        as_of = pd.to_datetime(table["datadate"]).dt.strftime(
+            "%Y-%m-%d").tolist()
+    else:
+        as_of = [""] * len(table)
+
+    if "n" in table.columns:
+        n = pd.to_numeric(table["n"], errors="coerce")
+        n = n.astype(object).where(n.notna(), None)
+        n = [None if value is None else int(value) for value in n]
+    else:
+        n = [None] * len(table)
+
+    corr_list = pd.Series(corr).astype(object).where(~np.isnan(corr),
+                                                     None).tolist()
+    abs_list = pd.Series(np.abs(corr)).astype(object).where(
+        ~np.isnan(corr), None).tolist()
+
+    rows = zip(
+        [run_id] * len(table),
+        table[ticker_col].astype(str).tolist(),
+        table[variables].astype(str).tolist(),
+        [window_label(value) for value in _column(table, "window", window)],
+        [str(value) for value in _column(table, "method", method)],
+        as_of, corr_list, abs_list, n,
+        *[_column(table, name) for name in VALUE_COLUMNS[1:]])
+
+    with conn:
+        cursor = conn.executemany(
+            "INSERT INTO results (run_id, ticker, variable, window, method, "
+            "as_of, corr, abs_corr, n, slope, intercept, r2, p_value, "
+            "q_value) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows)
+
+    return cursor.rowcount
+
+
+def set_industries(conn, industries):
+    '''
+    Function will record which industry each ticker belongs to
+
+    Function will take the connection and a dict of ticker to industry
+
+    Function will return nothing
+    '''
+    with conn:
+        conn.executemany(
+            "INSERT INTO firms (ticker, industry) VALUES (?, ?) "
+            "ON CONFLICT(ticker) DO UPDATE SET industry = excluded.industry",
+            [(str(ticker), str(industry))
+             for ticker, industry in industries.items()])
+
+
+def top_variables(conn, run_id=None, window=ALL_QUARTERS, method="pearson",
+                  industry=None, tickers=None, min_n=None, limit=50):
+    '''
+    Function will find the strongest correlations of a run
+
+    Function will take the connection, the run id (the latest if None), the
+    window (anything window_label takes) and method, an industry or a list
+    of tickers to keep to, the fewest quarters a result may use and how many
+    rows to return
+
+    Function will return a dataframe sorted by |r|, strongest first, with
+    only the latest as_of of every (ticker, variable) pair
+    '''
+    if run_id is None:
+        run_id = latest_run(conn)
+
+    query = ("SELECT r.ticker, r.variable, r.corr, r.n, r.as_of, r.slope, "
+             "r.intercept, r.p_value, r.q_value FROM results r")
+    args = []
+    if industry is not None:
+        query += " JOIN firms f ON f.ticker = r.ticker AND f.industry = ?"
+        args.append(industry)
+    query += " WHERE r.run_id = ? AND r.window = ? AND r.method = ? " \
+             "AND r.abs_corr IS NOT NULL"
+    # Rolling results hold one row per quarter; only the current one counts.
+    # The results_key index ends in as_of, so MAX is a single index probe
+    query += " AND r.as_of = (SELECT MAX(l.as_of) FROM results l " \
+             "WHERE l.ticker = r.ticker AND l.variable = r.variable AND " \
+             "l.window = r.window AND l.method = r.method AND " \
+             "l.run_id = r.run_id)"
+    args += [run_id, window_label(window), method]
+    if tickers is not None:
+        tickers = [str(ticker) for ticker in tickers]
+        query += " AND r.ticker IN (" + ", ".join("?" * len(tickers)) + ")"
+        args += tickers
+    if min_n is not None:
+        query += " AND r.n >= ?"
+        args.append(int(min_n))
+    query += " ORDER BY r.abs_corr DESC LIMIT ?"
+    args.append(int(limit))
+
+    return pd.read_sql_query(query, conn, params=args)
+
+
+def diff_runs(conn, old_run, new_run, window=None, method=None,
+              min_change=DIFF_TOLERANCE):
+    '''
+    Function will compare the results of two runs
+
+    Function will take the connection, the two run ids, the window and method
+    to compare (every one if None) and the change in r that is still too
+    small to report (by default only rounding noise)
+
+    Function will return a dataframe with one row per (ticker, variable,
+    window, method, as_of) in either run: both correlations, the change and a
+    status of added, removed or changed, biggest change first
+    '''
+    where = "a.run_id = ?"
+    filters = []
+    if window is not None:
+        where += " AND a.window = ?"
+        filters.append(window_label(window))
+    if method is not None:
+        where += " AND a.method = ?"
+        filters.append(method)
+
+    # Each row of one run finds its partner through the results_key index
+    match = ("b.ticker = a.ticker AND b.variable = a.variable AND "
+             "b.window = a.window AND b.method = a.method AND "
+             "b.as_of = a.as_of AND b.run_id = ?")
+    # SQLite has no FULL OUTER JOIN, so both LEFT JOINs are unioned
+    query = (
+        "SELECT a.ticker, a.variable, a.window, a.method, a.as_of, "
+        "a.corr AS corr_old, b.corr AS corr_new, 1 AS in_old, "
+        "b.run_id IS NOT NULL AS in_new FROM results a "
+        "LEFT JOIN results b ON " + match + " WHERE " + where +
+        " UNION ALL "
+        "SELECT a.ticker, a.variable, a.window, a.method, a.as_of, "
+        "NULL, a.corr, 0, 1 FROM results a LEFT JOIN results b ON " + match +
+        " WHERE " + where + " AND b.run_id IS NULL")
+    table = pd.read_sql_query(
+        query, conn, params=[new_run, old_run] + filters +
+        [old_run, new_run] + filters)
+
+    table["corr_old"] = table["corr_old"].astype(float)
+    table["corr_new"] = table["corr_new"].astype(float)
+    table["change"] = table["corr_new"] - table["corr_old"]
+    in_old = table.pop("in_old").astype(bool)
+    in_new = table.pop("in_new").astype(bool)
+    table["status"] = np.where(in_old & in_new, "changed",
+                               np.where(in_new, "added", "removed"))
+    # Pairs that both lost their correlation count as unchanged
+    keep = (table["status"] != "changed") | \
+        (table["change"].abs() > min_change) | \
+        (table["corr_old"].isna() != table["corr_new"].isna())
+    table = table[keep].copy()
+    table["abs_change"] = table["change"].abs().fillna(np.inf)
+    table = table.sort_values("abs_change", ascending=False, kind="stable")
+
+    return table.drop(columns="abs_change").reset_index(drop=True)
@@ -0,0 +1,294 @@
+'''
+Rank-based and robust correlations in batch
+
+Pearson is dominated by outliers in these series: Apple's pre-2005 share
+ price near $1, or ratios that blow up when invtq or seqq gets close to 0.
+This module adds Spearman, Kendall's tau-b, the biweight midcorrelation and
+ a winsorized Pearson for every (ticker, variable) pair at once.
+Each pair only uses the quarters where both series exist, so the x and y
+ columns are broadcast to one (..., n, p, q) block with the other side's gaps
+ blanked out. Ranks (with ties given their average rank) come from one sort
+ along the quarter axis of that block, never from a loop over pairs.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from scan import MIN_PERIODS, nan_corr, firm_positions, numeric_columns
+from scan import to_tensor
+
+METHODS = ("pearson", "spearman", "kendall", "biweight", "winsorized")
+
+# Biweight weights drop to 0 this many MADs from the median
+BIWEIGHT_C = 9.0
+
+# Share cut from each tail by the winsorized correlation
+WINSOR_LIMIT = 0.05
+
+# Most values one Kendall batch may hold (it compares every pair of quarters)
+MAX_BATCH_VALUES = 4000000
+
+
+def paired_block(x, y):
+    '''
+    Function will line every column of x up with every column of y, keeping
+    only the quarters where both exist
+
+    Function will take arrays shaped (..., n, p) and (..., n, q) (NaN or inf
+    marks a missing value)
+
+    Function will return two arrays shaped (..., n, p, q), NaN wherever
+    either side is missing
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x = np.where(np.isfinite(x), x, np.nan)[..., :, :, None]
+    y = np.where(np.isfinite(y), y, np.nan)[..., :, None, :]
+    both = ~np.isnan(x) & ~np.isnan(y)
+
+    return np.where(both, x, np.nan), np.where(both, y, np.nan)
+
+
+def average_ranks(values, axis=-3):
+    '''
+    Function will rank values along an axis, giving ties their average rank
+
+    Function will take an array (NaN is not ranked) and the axis to rank
+    along
+
+    Function will return a float array of ranks starting at 1, NaN where the
+    value was NaN
+    '''
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, -1)
+    n = values.shape[-1]
+    order = np.argsort(values, axis=-1, kind="stable")
+    ordered = np.take_along_axis(values, order, axis=-1)
+
+    # A tie group starts where the sorted value changes (NaN never ties)
+    position = np.broadcast_to(np.arange(n), values.shape)
+    starts = np.ones(values.shape, dtype=bool)
+    starts[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    ends = np.ones(values.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+
+    first = np.maximum.accumulate(np.where(starts, position, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(
+        np.flip(np.where(ends, position, n), axis=-1), axis=-1), axis=-1)
+
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=-1)
+    ranks[np.isnan(values)] = np.nan
+
+    return np.moveaxis(ranks, -1, axis)
+
+
+def _paired_corr(a, b, min_periods=MIN_PERIODS):
+    '''
+    Function will correlate two blocks from paired_block element by element
+
+    Function will take two (..., n, p, q) arrays with NaN in the same places
+    and the minimum number of quarters
+
+    Function will return the (..., p, q) correlations and counts
+    '''
+    n = np.sum(~np.isnan(a), axis=-3)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        a = a - np.nanmean(a, axis=-3, keepdims=True)
+        b = b - np.nanmean(b, axis=-3, keepdims=True)
+        saa = np.nansum(a * a, axis=-3)
+        sbb = np.nansum(b * b, axis=-3)
+        r = np.nansum(a * b, axis=-3) / np.sqrt(saa * sbb)
+
+    # Tiny variances are rounding noise on a constant column
+    r[(n < min_periods) | (saa <= 1e-12 * n) | (sbb <= 1e-12 * n)] = np.nan
+
+    return np.clip(r, -1.0, 1.0), n
+
+
+def spearman_corr(x, y, min_periods=MIN_PERIODS):
+    '''
+    Function will calculate the pairwise-complete Spearman correlation
+    between every column of x and every column of y
+
+    Function will take arrays shaped (..., n, p) and (..., n, q) and the
+    minimum number of overlapping quarters
+
+    Function will return the (..., p, q) correlations and counts
+    '''
+    a, b = paired_block(x, y)
+
+    # Pearson on the ranks of the shared quarters
+    return _paired_corr(average_ranks(a), average_ranks(b), min_periods)
+
+
+def kendall_corr(x, y, min_periods=MIN_PERIODS):
+    '''
+    Function will calculate the pairwise-complete Kendall tau-b between every
+    column of x and every column of y
+
+    Function will take arrays shaped (..., n, p) and (..., n, q) and the
+    minimum number of overlapping quarters
+
+    Function will return the (..., p, q) correlations and counts
+    '''
+    a, b = paired_block(x, y)
+    n_quarters = a.shape[-3]
+    lead = a.shape[:-3]
+    p, q = a.shape[-2:]
+    a = a.reshape(lead + (n_quarters, p * q))
+    b = b.reshape(lead + (n_quarters, p * q))
+
+    tau = np.empty(lead + (p * q,))
+    step = max(1, MAX_BATCH_VALUES //
+               max(n_quarters * n_quarters * int(np.prod(lead)), 1))
+    for start in range(0, p * q, step):
+        cols = slice(start, start + step)
+        # Sign of every difference between two quarters; NaN pairs give 0
+        # and are left out of every count
+        da = np.sign(a[..., :, None, cols] - a[..., None, :, cols])
+        db = np.sign(b[..., :, None, cols] - b[..., None, :, cols])
+        valid = ~np.isnan(da)
+        da = np.where(valid, da, 0)
+        db = np.where(valid, db, 0)
+
+        # Every unordered pair is counted twice, which cancels out
+        concordant = np.sum(da * db, axis=(-3, -2))
+        untied_a = np.sum(da != 0, axis=(-3, -2))
+        untied_b = np.sum(db != 0, axis=(-3, -2))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tau[..., cols] = concordant / np.sqrt(untied_a * untied_b)
+
+    n = np.sum(~np.isnan(a), axis=-2).reshape(lead + (p, q))
+    tau = tau.reshape(lead + (p, q))
+    tau[n < min_periods] = np.nan
+
+    return np.clip(tau, -1.0, 1.0), n
+
+
+def biweight_corr(x, y, min_periods=MIN_PERIODS, c=BIWEIGHT_C):
+    '''
+    Function will calculate the pairwise-complete biweight midcorrelation
+    between every column of x and every column of y
+
+    Function will take arrays shaped (..., n, p) and (..., n, q), the
+    minimum number of overlapping quarters and how many MADs from the median
+    a value may be before it gets no weight
+
+    Function will return the (..., p, q) correlations (NaN where a series has
+    a MAD of 0) and counts
+    '''
+    def weighted(values):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            median = np.nanmedian(values, axis=-3, keepdims=True)
+            mad = np.nanmedian(np.abs(values - median), axis=-3, keepdims=True)
+            u = (values - median) / (c * mad)
+            weight = np.where(np.abs(u) < 1, (1 - u ** 2) ** 2, 0.0)
+        return (values - median) * weight, mad[..., 0, :, :]
+
+    a, b = paired_block(x, y)
+    n = np.sum(~np.isnan(a), axis=-3)
+    if a.shape[-3] == 0:
+        return np.full(n.shape, np.nan), n
+
+    wa, mad_a = weighted(a)
+    wb, mad_b = weighted(b)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.nansum(wa * wb, axis=-3) / \
+            np.sqrt(np.nansum(wa * wa, axis=-3) * np.nansum(wb * wb, axis=-3))
+
+    r[(n < min_periods) | ~(mad_a > 0) | ~(mad_b > 0)] = np.nan
+
+    return np.clip(r, -1.0, 1.0), n
+
+
+def winsorized_corr(x, y, min_periods=MIN_PERIODS, limit=WINSOR_LIMIT):
+    '''
+    Function will calculate the pairwise-complete Pearson correlation after
+    clipping each series' tails
+
+    Function will take arrays shaped (..., n, p) and (..., n, q), the
+    minimum number of overlapping quarters and the share clipped from each
+    tail
+
+    Function will return the (..., p, q) correlations and counts
+    '''
+    a, b = paired_block(x, y)
+    if a.shape[-3] == 0:
+        return _paired_corr(a, b, min_periods)
+
+    with np.errstate(invalid="ignore"):
+        bounds_a = np.nanquantile(a, [limit, 1 - limit], axis=-3,
+                                  keepdims=True)
+        bounds_b = np.nanquantile(b, [limit, 1 - limit], axis=-3,
+                                  keepdims=True)
+
+    return _paired_corr(np.clip(a, bounds_a[0], bounds_a[1]),
+                        np.clip(b, bounds_b[0], bounds_b[1]), min_periods)
+
+
+CORR_FUNCTIONS = {
+    "pearson": nan_corr,
+    "spearman": spearman_corr,
+    "kendall": kendall_corr,
+    "biweight": biweight_corr,
+    "winsorized": winsorized_corr,
+}
+
+
+def robust_scan(df, columns=None, target="stock_price", firm_col="tic",
+                methods=METHODS, min_periods=MIN_PERIODS, batch_size=64):
+    '''
+    Function will correlate every column with the stock price for every
+    ticker with several correlation measures
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the columns (every numeric column if None), the target column,
+    the firm column, the measures (names from METHODS), the minimum
+    overlapping quarters and how many firms to handle per batch
+
+    Function will return a dataframe with one row per (ticker, variable), a
+    column per measure and the quarters used, sorted by the absolute Spearman
+    correlation (or the first measure) within each ticker
+    '''
+    unknown = [method for method in methods if method not in CORR_FUNCTIONS]
+    if unknown:
+        raise ValueError("unknown methods: " + ", ".join(unknown))
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    if columns is None:
+        columns = numeric_columns(df, target)
+    columns = list(columns)
+
+    firms, codes, position = firm_positions(df, firm_col)
+    x = to_tensor(df[columns].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+    y = to_tensor(df[[target]].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+
+    results = {method: np.empty((len(firms), len(columns)))
+               for method in methods}
+    n = np.empty((len(firms), len(columns)))
+    # Batches over firms keep the paired blocks a bounded size
+    for start in range(0, len(firms), batch_size):
+        stop = start + batch_size
+        for method in methods:
+            r, count = CORR_FUNCTIONS[method](x[start:stop], y[start:stop],
+                                              min_periods)
+            results[method][start:stop] = r[..., 0]
+            n[start:stop] = count[..., 0]
+
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), len(firms)),
+    })
+    for method in methods:
+        table[method] = results[method].ravel()
+    table["n"] = n.ravel().astype(int)
+
+    key = "spearman" if "spearman" in methods else methods[0]
+    table = table.dropna(subset=list(methods), how="all")
+    table["abs_corr"] = table[key].abs()
+    table = table.sort_values([firm_col, "abs_corr"],
+                              ascending=[True, False], kind="stable")
+
+    return table.drop(columns="abs_corr").reset_index(drop=True)
@@ -0,0 +1,121 @@
+'''
+Incremental rolling-window correlations
+
+Instead of slicing out the last N quarters and recomputing calc_corr for every
+ window, we keep running sums (count, sum x, sum y, sum xy, sum x^2, sum y^2)
+ for every ratio/price pair and, as the window slides one quarter, add the
+ new quarter and subtract the one that fell out. Each step is O(1) per pair
+ and is done for every pair and every ticker at once with NumPy.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from scan import MIN_PERIODS, standardized_parts, corr_from_moments
+from scan import firm_positions, numeric_columns, to_tensor
+
+# Window lengths the README asks about, in quarters
+WINDOWS = {"5y": 20, "10y": 40}
+
+
+def _step(sums, x0, x_mask, y0, y_mask, sign):
+    '''
+    Function will add (or remove) one quarter to the running sums
+
+    Function will take the dict of running sums, that quarter's zero-filled
+    x (..., p) and y (..., q) values and masks, and +1 to add or -1 to remove
+
+    Function will return nothing, the sums are updated in place
+    '''
+    xm = x_mask[..., :, None]
+    ym = y_mask[..., None, :]
+    xv = x0[..., :, None]
+    yv = y0[..., None, :]
+
+    sums["n"] += sign * (xm * ym)
+    sums["sx"] += sign * (xv * ym)
+    sums["sy"] += sign * (xm * yv)
+    sums["sxx"] += sign * (xv * xv * ym)
+    sums["syy"] += sign * (xm * yv * yv)
+    sums["sxy"] += sign * (xv * yv)
+
+
+def rolling_corr(x, y, window, min_periods=MIN_PERIODS):
+    '''
+    Function will calculate the correlation over a sliding window of quarters
+    for every pair of x and y columns
+
+    Function will take arrays shaped (..., T, p) and (..., T, q) where T runs
+    over quarters (NaN marks a missing value), the window length in quarters
+    and the minimum quarters a window needs
+
+    Function will return an array shaped (..., T, p, q) where entry t is the
+    correlation over the window ending at quarter t (NaN until enough
+    quarters are in the window)
+    '''
+    # Standardizing over the full history keeps the running sums from
+    # cancelling badly when we subtract old quarters
+    x0, x_mask = standardized_parts(np.asarray(x, dtype=float))
+    y0, y_mask = standardized_parts(np.asarray(y, dtype=float))
+
+    lead = x0.shape[:-2]
+    n_quarters = x0.shape[-2]
+    pair_shape = lead + (x0.shape[-1], y0.shape[-1])
+    sums = {name: np.zeros(pair_shape)
+            for name in ("n", "sx", "sy", "sxx", "syy", "sxy")}
+
+    result = np.full(lead + (n_quarters,) + pair_shape[-2:], np.nan)
+    for t in range(n_quarters):
+        _step(sums, x0[..., t, :], x_mask[..., t, :],
+              y0[..., t, :], y_mask[..., t, :], 1)
+        if t >= window:
+            old = t - window
+            _step(sums, x0[..., old, :], x_mask[..., old, :],
+                  y0[..., old, :], y_mask[..., old, :], -1)
+        result[..., t, :, :] = corr_from_moments(sums,
+                                                 min(min_periods, window))
+
+    return result
+
+
+def rolling_scan(df, window, columns=None, target="stock_price",
+                 firm_col="tic", date_col="datadate",
+                 min_periods=MIN_PERIODS):
+    '''
+    Function will calculate rolling correlations against the stock price for
+    every column and every ticker in a panel
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the window length in quarters, the columns (every numeric
+    column if None), the target column, the firm column, the date column and
+    the minimum quarters a window needs
+
+    Function will return a dataframe with one row per (ticker, quarter,
+    variable) giving the correlation over the window ending that quarter
+    '''
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    if columns is None:
+        columns = numeric_columns(df, target)
+    columns = list(columns)
+
+    firms, codes, position = firm_positions(df, firm_col)
+    x = to_tensor(df[columns].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+    y = to_tensor(df[[target]].to_numpy(dtype=float, na_value=np.nan),
+                  codes, position, len(firms))
+
+    r = rolling_corr(x, y, window, min_periods)[..., 0]
+
+    # Reads each row's own windows back out of the padded array
+    table = pd.DataFrame({
+        firm_col: np.repeat(df[firm_col].to_numpy(), len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), df.shape[0]),
+        "window": window,
+        "corr": r[codes, position].ravel(),
+    })
+    if date_col in df.columns:
+        table.insert(1, date_col, np.repeat(df[date_col].to_numpy(),
+                                            len(columns)))
+
+    return table
@@ -0,0 +1,316 @@
+'''
+Universe-wide correlation scan
+
+Correlates every numeric Compustat column (and every registered ratio) against
+ the stock price for every ticker in a panel.
+The panel is laid out as a firms x quarters x variables array, every column is
+ standardized once and the NaN-aware pairwise moments for all pairs come out
+ of a handful of batched matrix products instead of one Series.corr per pair.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from ratios import FIRM_COL, RATIOS, compute_ratios, ratio_columns
+
+# Numeric columns that identify a row rather than measure anything
+ID_COLUMNS = ("gvkey", "fyearq", "fqtr", "fyr", "index", "cal_period",
+              "fisc_period")
+
+# Pairs with fewer overlapping quarters than this get no correlation
+MIN_PERIODS = 8
+
+# Correlations equal to this many decimals rank as tied, broken by variable
+# name, so rounding differences between backends never reorder the table
+RANK_DECIMALS = 12
+
+
+def standardized_parts(values, axis=-2):
+    '''
+    Function will standardize every column and split out its missing values
+
+    Function will take a numpy array and the axis that runs over observations
+
+    Function will return the standardized values with missing entries set to
+    0, and a float mask that is 1 where a value exists
+    '''
+    mask = np.isfinite(values)
+    count = np.maximum(mask.sum(axis=axis, keepdims=True), 1)
+    filled = np.where(mask, values, 0.0)
+    mean = filled.sum(axis=axis, keepdims=True) / count
+    centered = np.where(mask, filled - mean, 0.0)
+    std = np.sqrt((centered ** 2).sum(axis=axis, keepdims=True) / count)
+    centered /= np.where(std > 0, std, 1.0)
+
+    return centered, mask.astype(float)
+
+
+def standardize(values, axis=-2):
+    '''
+    Function will center and scale every column, ignoring NaNs
+
+    Function will take a numpy array and the axis that runs over observations
+
+    Function will return a new array with mean 0 and std 1 along that axis
+    (columns with no spread become all zeros, NaN and inf become NaN)
+    '''
+    values = np.asarray(values, dtype=float)
+    standardized, mask = standardized_parts(values, axis)
+
+    return np.where(mask > 0, standardized, np.nan)
+
+
+def _moments_from_parts(x0, x_mask, y0, y_mask):
+    '''
+    Function will run the batched matrix products behind pairwise_moments
+
+    Function will take zero-filled x and y arrays and their float masks
+
+    Function will return the same dict as pairwise_moments
+    '''
+    x0_t = np.swapaxes(x0, -1, -2)
+    x_mask_t = np.swapaxes(x_mask, -1, -2)
+
+    moments = {
+        "n": x_mask_t @ y_mask,
+        "sx": x0_t @ y_mask,
+        "sy": x_mask_t @ y0,
+        "sxx": np.swapaxes(x0 ** 2, -1, -2) @ y_mask,
+        "syy": x_mask_t @ (y0 ** 2),
+        "sxy": x0_t @ y0,
+    }
+
+    return moments
+
+
+def pairwise_moments(x, y):
+    '''
+    Function will compute the pairwise-complete moment sums between every
+    column of x and every column of y
+
+    Function will take two arrays shaped (..., n, p) and (..., n, q) where n
+    runs over quarters and NaN marks a missing value
+
+    Function will return a dict of (..., p, q) arrays: n, sx, sy, sxx, syy and
+    sxy, each summed only over quarters where both values exist
+    '''
+    x_mask = ~np.isnan(x)
+    y_mask = ~np.isnan(y)
+
+    return _moments_from_parts(np.where(x_mask, x, 0.0),
+                               x_mask.astype(float),
+                               np.where(y_mask, y, 0.0),
+                               y_mask.astype(float))
+
+
+def corr_from_moments(moments, min_periods=MIN_PERIODS):
+    '''
+    Function will turn pairwise moment sums into Pearson correlations
+
+    Function will take the dict from pairwise_moments and the minimum number
+    of overlapping quarters
+
+    Function will return an array of correlations (NaN where undefined)
+    '''
+    n = moments["n"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = moments["sxy"] - moments["sx"] * moments["sy"] / n
+        var_x = moments["sxx"] - moments["sx"] ** 2 / n
+        var_y = moments["syy"] - moments["sy"] ** 2 / n
+        r = cov / np.sqrt(var_x * var_y)
+
+    # Tiny variances are rounding noise on a constant column
+    r[(n < min_periods) | (var_x <= 1e-12 * n) | (var_y <= 1e-12 * n)] = np.nan
+
+    return np.clip(r, -1.0, 1.0)
+
+
+def nan_corr(x, y, min_periods=MIN_PERIODS):
+    '''
+    Function will calculate the pairwise-complete Pearson correlation between
+    every column of x and every column of y in one batched pass
+
+    Function will take two arrays shaped (..., n, p) and (..., n, q) (NaN or
+    inf marks a missing value) and the minimum number of overlapping quarters
+
+    Function will return the (..., p, q) correlations and the (..., p, q)
+    number of quarters each one used
+    '''
+    # Standardizing once keeps the moment sums well conditioned
+    x0, x_mask = standardized_parts(np.asarray(x, dtype=float))
+    y0, y_mask = standardized_parts(np.asarray(y, dtype=float))
+    moments = _moments_from_parts(x0, x_mask, y0, y_mask)
+
+    return corr_from_moments(moments, min_periods), moments["n"]
+
+
+def numeric_columns(df, target="stock_price"):
+    '''
+    Function will list every column we can correlate against price
+
+    Function will take a dataframe and the target column
+
+    Function will return a list of numeric column names without identifiers
+    or the target itself
+    '''
+    columns = []
+    for col in df.columns:
+        if col == target or col in ID_COLUMNS:
+            continue
+        if pd.api.types.is_numeric_dtype(df[col]) and \
+                not pd.api.types.is_bool_dtype(df[col]):
+            columns.append(col)
+
+    return columns
+
+
+def firm_positions(df, firm_col="tic"):
+    '''
+    Function will number the firms of a stacked panel and the quarters inside
+    each firm
+
+    Function will take a dataframe sorted by firm and date and the firm column
+
+    Function will return the list of firms, an int array with each row's firm
+    number and an int array with each row's position inside its firm
+    '''
+    codes, firms = pd.factorize(df[firm_col], sort=False)
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+
+    return list(firms), codes, position
+
+
+def to_tensor(values, codes, position, n_firms):
+    '''
+    Function will scatter stacked rows into a firms x quarters x columns array
+
+    Function will take a (rows, columns) array, the firm number and position
+    of every row and the number of firms
+
+    Function will return a float array padded with NaN for firms with fewer
+    quarters
+    '''
+    n_quarters = position.max() + 1 if len(position) else 0
+    tensor = np.full((n_firms, n_quarters, values.shape[1]), np.nan)
+    tensor[codes, position] = values
+
+    return tensor
+
+
+def panel_tensor(df, columns, firm_col="tic"):
+    '''
+    Function will lay out a stacked panel as a firms x quarters x columns
+    array
+
+    Function will take a dataframe sorted by firm and date, the columns to
+    use and the firm column
+
+    Function will return the list of firms and a float array padded with NaN
+    for firms with fewer quarters
+    '''
+    firms, codes, position = firm_positions(df, firm_col)
+    values = df[list(columns)].to_numpy(dtype=float, na_value=np.nan)
+
+    return firms, to_tensor(values, codes, position, len(firms))
+
+
+def scan_inputs(df, columns=None, target="stock_price", firm_col="tic"):
+    '''
+    Function will gather the stacked values a correlation scan needs
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date (with the target column already joined), the columns to scan
+    (every numeric column if None), the target column and the firm column
+
+    Function will return the list of firms, the list of columns, each row's
+    firm number and position inside its firm, the (rows, columns) values and
+    the (rows, 1) target values
+    '''
+    if firm_col not in df.columns:
+        df = df.assign(**{firm_col: "ALL"})
+    if columns is None:
+        # Every ratio whose inputs were loaded is scanned too
+        columns = numeric_columns(df, target) + \
+            [name for name in RATIOS if name not in df.columns and
+             set(ratio_columns([name])) <= set(df.columns)]
+
+    # Registered ratios nobody computed yet are worked out on a small frame
+    # of just their inputs instead of copying the whole panel
+    missing = [col for col in columns
+               if col not in df.columns and col in RATIOS]
+    present = [col for col in columns if col not in missing]
+    needed = [col for col in ratio_columns(missing) +
+              [FIRM_COL, "fyearq", "fqtr"] if col in df.columns]
+    extra = df[needed].copy()
+    compute_ratios(extra, missing)
+
+    values = np.hstack([
+        df[present].to_numpy(dtype=float, na_value=np.nan),
+        extra[missing].to_numpy(dtype=float, na_value=np.nan),
+    ])
+    firms, codes, position = firm_positions(df, firm_col)
+
+    return (firms, present + missing, codes, position, values,
+            df[[target]].to_numpy(dtype=float, na_value=np.nan))
+
+
+def rank_correlations(firms, columns, r, n, firm_col="tic", top_k=20):
+    '''
+    Function will turn a firms x columns grid of correlations into a ranked
+    table
+
+    Function will take the list of firms, the list of columns, the (firms,
+    columns) correlations and overlapping quarters, the firm column and how
+    many variables to keep per ticker (all if None)
+
+    Function will return a dataframe with one row per (ticker, variable)
+    ranked by absolute correlation within each ticker, ties (up to
+    RANK_DECIMALS) by variable name
+    '''
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), len(firms)),
+        "corr": r.ravel(),
+        "n": n.ravel().astype(int),
+    })
+    table = table.dropna(subset=["corr"])
+    table["abs_corr"] = table["corr"].abs().round(RANK_DECIMALS)
+    table = table.sort_values([firm_col, "abs_corr", "variable"],
+                              ascending=[True, False, True], kind="stable")
+    table["rank"] = table.groupby(firm_col).cumcount() + 1
+    if top_k is not None:
+        table = table[table["rank"] <= top_k]
+
+    return table.drop(columns="abs_corr").reset_index(drop=True)
+
+
+def scan_correlations(df, columns=None, target="stock_price", firm_col="tic",
+                      top_k=20, min_periods=MIN_PERIODS, batch_size=256):
+    '''
+    Function will correlate every numeric column and every registered ratio
+    against the stock price for every ticker
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date (with the target column already joined), the columns to scan
+    (every numeric column if None), the target column, the firm column, how
+    many variables to keep per ticker, the minimum overlapping quarters and
+    how many firms to put in each batched matrix product
+
+    Function will return a dataframe with one row per (ticker, variable)
+    ranked by absolute correlation within each ticker
+    '''
+    firms, columns, codes, position, values, price = scan_inputs(
+        df, columns, target, firm_col)
+    x = to_tensor(values, codes, position, len(firms))
+    y = to_tensor(price, codes, position, len(firms))
+
+    r = np.empty((len(firms), len(columns)))
+    n = np.empty((len(firms), len(columns)))
+    # Batches over firms keep the temporary arrays a bounded size
+    for start in range(0, len(firms), batch_size):
+        stop = start + batch_size
+        batch_r, batch_n = nan_corr(x[start:stop], y[start:stop], min_periods)
+        r[start:stop] = batch_r[..., 0]
+        n[start:stop] = batch_n[..., 0]
+
+    return rank_correlations(firms, columns, r, n, firm_col, top_k)
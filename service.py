@@ -0,0 +1,448 @@
+'''
+Local HTTP/JSON query service with resident panels
+
+Every question used to mean re-running the script: re-reading the csv files,
+ re-parsing dates, re-joining prices and recomputing every ratio. This
+ service loads the companies of a manifest (see cli.py) once, keeps the panel
+ and every registered ratio in memory, and answers JSON queries over HTTP:
+
+    GET /health                               rows, tickers, cache stats
+    GET /tickers
+    GET /variables
+    GET /corr?tickers=AAPL,GOOGL&method=spearman&quarters=20&top=20
+    GET /fit?tickers=AAPL&variables=roa_ratio,cur_ratio
+    GET /rolling?tickers=AAPL&variables=roa_ratio&window=20
+    GET /leadlag?tickers=GOOGL&max_lag=8&top=10
+
+Common parameters: tickers and variables (comma separated, all if left
+ out), quarters (only each firm's last N calendar quarters) and
+ min_periods.
+Answers are kept in a bounded LRU cache keyed by the normalised query.
+ Requests are served concurrently by ThreadingHTTPServer; the resident panel
+ is never modified after loading, so handlers only read it.
+It only uses the standard library's http.server and binds to 127.0.0.1.
+
+    python service.py manifest.csv --port 8765
+'''
+
+import argparse
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from cli import load_manifest
+from leadlag import lead_lag_scan
+from loader import load_csv
+from periods import add_period_index, last_quarters
+from prices import DATE_FORMAT, align_prices
+from ratios import RATIOS, compute_ratios, ratio_columns
+from regression import fit_panel
+from robust import METHODS, robust_scan
+from rolling import rolling_scan
+from scan import MIN_PERIODS, numeric_columns, scan_correlations
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Most answers kept in the result cache
+CACHE_ENTRIES = 256
+
+# Most rows any one answer returns
+MAX_ROWS = 10000
+
+
+class EndpointNotFound(LookupError):
+    '''
+    Raised for a request path the service has no answer for
+    '''
+
+
+class ResultCache:
+    '''
+    Thread-safe least recently used cache of query answers
+    '''
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Function will look up a cached answer
+
+        Function will take the query key
+
+        Function will return the answer, or None if it isn't cached
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        return None
+
+    def put(self, key, value):
+        '''
+        Function will store an answer, dropping the least recently used one
+        when the cache is full
+
+        Function will take the query key and the answer
+
+        Function will return nothing
+        '''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        Function will report how the cache is doing
+
+        Function will take nothing
+
+        Function will return a dict of entries, capacity, hits and misses
+        '''
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def load_panel(manifest, cache=True):
+    '''
+    Function will load every company of a manifest into one panel with
+    prices and every registered ratio
+
+    Function will take a manifest (file name or list of entries) and whether
+    to load through the columnar cache
+
+    Function will return the panel sorted by ticker and date
+    '''
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+
+    frames = []
+    for entry in manifest:
+        df = load_csv(entry["fundamentals"], cache=cache)
+        # The cache maps numeric columns copy-on-write; the panel owns its data
+        df = df.copy()
+        df["tic"] = entry["ticker"]
+        df["datadate"] = pd.to_datetime(df["datadate"], format=DATE_FORMAT)
+        df["stock_price"] = align_prices(
+            df, load_csv(entry["prices"], cache=cache), mode=entry["mode"])
+        frames.append(df)
+
+    panel = pd.concat(frames, ignore_index=True)
+    panel = panel.sort_values(["tic", "datadate"], kind="stable")
+    panel = panel.reset_index(drop=True)
+
+    ratios = [name for name in RATIOS
+              if set(ratio_columns([name])) <= set(panel.columns)]
+    compute_ratios(panel, ratios, firm_col="tic")
+    add_period_index(panel)
+
+    # One defragmented block, built before any request thread can see it
+    return panel.copy()
+
+
+def _split(values):
+    '''
+    Function will read a comma separated query parameter
+
+    Function will take the list parse_qs gives for a parameter (or None)
+
+    Function will return a sorted list of names, or None if it was empty
+    '''
+    if not values:
+        return None
+    names = sorted({name.strip() for value in values
+                    for name in value.split(",") if name.strip()})
+
+    return names or None
+
+
+def _number(params, name, default, smallest=None):
+    '''
+    Function will read a whole-number query parameter
+
+    Function will take the parsed query parameters, the parameter name, the
+    value used when it is left out and the smallest value allowed (no limit
+    if None)
+
+    Function will return the number, raising ValueError if it is too small
+    or not a whole number
+    '''
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise ValueError(name + " must be a whole number")
+    if smallest is not None and value < smallest:
+        raise ValueError(name + " must be at least " + str(smallest))
+
+    return value
+
+
+def to_records(table, limit=MAX_ROWS):
+    '''
+    Function will turn a dataframe into JSON-ready rows
+
+    Function will take the dataframe and the most rows to return
+
+    Function will return a list of dicts with NaN/inf as None and dates as
+    ISO text
+    '''
+    table = table.head(limit)
+    records = []
+    for row in table.to_dict("records"):
+        for key, value in row.items():
+            if isinstance(value, (float, np.floating)):
+                row[key] = float(value) if np.isfinite(value) else None
+            elif isinstance(value, (np.integer,)):
+                row[key] = int(value)
+            elif isinstance(value, (np.bool_,)):
+                row[key] = bool(value)
+            elif isinstance(value, pd.Timestamp):
+                row[key] = value.date().isoformat()
+            elif value is pd.NaT or value is None:
+                row[key] = None
+        records.append(row)
+
+    return records
+
+
+class QueryService:
+    '''
+    Answers correlation, regression and window queries on a resident panel
+    '''
+
+    def __init__(self, panel, cache_entries=CACHE_ENTRIES):
+        self.panel = panel
+        self.cache = ResultCache(cache_entries)
+        self.tickers = sorted(panel["tic"].unique())
+        self.variables = numeric_columns(panel, "stock_price")
+        self.started = time.time()
+
+    def select(self, params):
+        '''
+        Function will pick the rows and columns a query is about
+
+        Function will take the parsed query parameters
+
+        Function will return the sub-panel and the variables to use
+        '''
+        tickers = _split(params.get("tickers"))
+        variables = _split(params.get("variables")) or self.variables
+        unknown = [name for name in variables if name not in self.variables]
+        if unknown:
+            raise ValueError("unknown variables: " + ", ".join(unknown))
+
+        keep = np.ones(len(self.panel), dtype=bool)
+        if tickers is not None:
+            keep &= self.panel["tic"].isin(tickers).to_numpy()
+        quarters = _number(params, "quarters", None, 1)
+        if quarters is not None:
+            keep &= last_quarters(self.panel, quarters, firm_col="tic")
+
+        return self.panel[keep], variables
+
+    def answer(self, path, params):
+        '''
+        Function will answer one query, from the cache when possible
+
+        Function will take the request path and the parsed query parameters
+
+        Function will return a JSON-ready dict
+        '''
+        key = path + "?" + json.dumps(
+            {name: _split(values) for name, values in sorted(params.items())})
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        result = self.compute(path, params)
+        result["seconds"] = time.perf_counter() - start
+        self.cache.put(key, result)
+
+        return result
+
+    def compute(self, path, params):
+        '''
+        Function will run the analysis behind a query
+
+        Function will take the request path and the parsed query parameters
+
+        Function will return a JSON-ready dict
+        '''
+        min_periods = _number(params, "min_periods", MIN_PERIODS, 1)
+        top = _number(params, "top", None, 1)
+
+        if path == "/tickers":
+            return {"tickers": self.tickers}
+        if path == "/variables":
+            return {"variables": self.variables}
+
+        df, variables = self.select(params)
+        if path == "/corr":
+            method = (params.get("method") or ["pearson"])[0]
+            if method == "pearson":
+                table = scan_correlations(df, columns=variables, top_k=top,
+                                          min_periods=min_periods)
+            elif method in METHODS:
+                table = robust_scan(df, columns=variables, methods=(method,),
+                                    min_periods=min_periods)
+                table = table.rename(columns={method: "corr"})
+                table = table.assign(abs_corr=table["corr"].abs()).sort_values(
+                    ["tic", "abs_corr"], ascending=[True, False],
+                    kind="stable").drop(columns="abs_corr")
+                if top is not None:
+                    table = table.groupby("tic", sort=False).head(top)
+            else:
+                raise ValueError("method must be one of " + ", ".join(METHODS))
+        elif path == "/fit":
+            table = fit_panel(df, variables)
+        elif path == "/rolling":
+            # A one-quarter window has no correlation to compute
+            table = rolling_scan(df, _number(params, "window", 20, 2),
+                                 columns=variables, min_periods=min_periods)
+        elif path == "/leadlag":
+            min_lag = _number(params, "min_lag", 0, 0)
+            max_lag = _number(params, "max_lag", 8, 0)
+            if max_lag < min_lag:
+                raise ValueError("max_lag must be at least min_lag")
+            table = lead_lag_scan(df, columns=variables, max_lag=max_lag,
+                                  min_lag=min_lag, min_periods=min_periods)
+            if top is not None:
+                table = table.groupby("tic", sort=False).head(top)
+        else:
+            raise EndpointNotFound("no such endpoint: " + path)
+
+        return {"rows": len(table), "results": to_records(table)}
+
+    def health(self):
+        '''
+        Function will describe the service's state
+
+        Function will take nothing
+
+        Function will return a JSON-ready dict
+        '''
+        return {"status": "ok", "rows": len(self.panel),
+                "tickers": len(self.tickers),
+                "variables": len(self.variables),
+                "uptime": time.time() - self.started,
+                "cache": self.cache.stats()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Turns GET requests into QueryService calls and JSON responses
+    '''
+
+    service = None
+    quiet = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            if url.path == "/health":
+                body, status = self.service.health(), 200
+            else:
+                body, status = self.service.answer(url.path, params), 200
+        except EndpointNotFound as error:
+            body, status = {"error": str(error)}, 404
+        except ValueError as error:
+            body, status = {"error": str(error)}, 400
+        except Exception as error:
+            # A bug (KeyError included) is a 500, never a 404 or a dropped
+            # connection
+            traceback.print_exc()
+            body = {"error": "internal error: " + type(error).__name__}
+            status = 500
+
+        data = json.dumps(body, allow_nan=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(service, host=HOST, port=PORT, quiet=True):
+    '''
+    Function will build the HTTP server for a query service
+
+    Function will take the QueryService, the host and port (port 0 picks a
+    free one) and whether to skip logging each request
+
+    Function will return a ThreadingHTTPServer, not yet serving
+    '''
+    handler = type("BoundHandler", (Handler,),
+                   {"service": service, "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    # Worker threads don't keep the process alive on shutdown
+    server.daemon_threads = True
+
+    return server
+
+
+def main(argv=None):
+    '''
+    Function will load the panels and serve queries until interrupted
+
+    Function will take the argument list (sys.argv if None)
+
+    Function will return nothing
+    '''
+    parser = argparse.ArgumentParser(
+        description="Serve correlation queries on resident panels")
+    parser.add_argument("manifest", help="csv or json list of companies")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--cache-entries", type=int, default=CACHE_ENTRIES)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the csv files instead of using the "
+                             "columnar cache")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log every request")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    panel = load_panel(args.manifest, cache=not args.no_cache)
+    service = QueryService(panel, args.cache_entries)
+    server = make_server(service, HOST, args.port, quiet=not args.verbose)
+    print("Loaded %d rows for %d tickers in %.2fs, serving on http://%s:%d"
+          % (len(panel), len(service.tickers), time.perf_counter() - start,
+             HOST, server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+'''
+Shared-memory worker pool for universe-wide scans
+
+Handing each worker its company's DataFrame means pickling hundreds of
+ columns into every process, which costs more than the correlations. This
+ backend lays the numeric panel out once as a firms x quarters x variables
+ array and the aligned prices as a firms x quarters x 1 array, both directly
+ in multiprocessing.shared_memory segments, together with the output grids
+ of correlations and overlapping quarters.
+Workers attach to the segments in the pool initializer (no copy, only the
+ segment names and shapes are pickled), and each task is a block of the
+ (ticker, variable) grid: the worker runs nan_corr on views of its block and
+ writes the answer straight into the shared output, so nothing but the
+ block bounds crosses a pipe. Columns are standardized per firm, so any
+ block gives the same numbers as scan.scan_correlations up to floating-point
+ rounding, and the same ranking (scan.rank_correlations treats
+ correlations equal to RANK_DECIMALS decimals as tied and orders them by
+ name).
+SharedPanel owns the segments: use it as a context manager (or call close())
+ and they are unlinked once the pool has shut down, even on errors.
+
+    with SharedPanel.from_frame(df) as panel:
+        table = panel.scan(workers=8)
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np  # useful library to handle array and computation
+
+from scan import (MIN_PERIODS, nan_corr, rank_correlations, scan_inputs)
+
+# Firms and variables in one worker task
+BLOCK_FIRMS = 64
+BLOCK_COLUMNS = 256
+
+# Arrays a worker attached to in the pool initializer, by name
+_ATTACHED = {}
+
+
+class SharedPanel:
+    '''
+    Numeric panel, aligned prices and result grids held in shared memory
+    '''
+
+    def __init__(self, firms, columns, n_quarters, firm_col="tic"):
+        self.firms = list(firms)
+        self.columns = list(columns)
+        self.firm_col = firm_col
+        # Forked workers inherit this object but must never unlink
+        self.owner = os.getpid()
+        self.segments = {}
+        self.arrays = {}
+        self.specs = {}
+
+        n_firms = len(self.firms)
+        try:
+            self._create("x", (n_firms, n_quarters, len(self.columns)))
+            self._create("y", (n_firms, n_quarters, 1))
+            self._create("r", (n_firms, len(self.columns)))
+            self._create("n", (n_firms, len(self.columns)))
+        except BaseException:
+            self.close()
+            raise
+
+    def _create(self, name, shape):
+        '''
+        Function will allocate one NaN-filled float array in shared memory
+
+        Function will take the array's name and shape
+
+        Function will return nothing and just keep the segment and its view
+        '''
+        size = max(1, int(np.prod(shape)) * np.dtype(float).itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        self.segments[name] = segment
+        array = np.ndarray(shape, dtype=float, buffer=segment.buf)
+        array.fill(np.nan)
+        self.arrays[name] = array
+        self.specs[name] = (segment.name, shape)
+
+    @classmethod
+    def from_frame(cls, df, columns=None, target="stock_price",
+                   firm_col="tic"):
+        '''
+        Function will copy a stacked panel into shared memory
+
+        Function will take a dataframe holding many firms sorted by firm and
+        date (with the target column already joined), the columns to scan
+        (every numeric column and computable ratio if None), the target
+        column and the firm column
+
+        Function will return a SharedPanel
+        '''
+        firms, columns, codes, position, values, price = scan_inputs(
+            df, columns, target, firm_col)
+        n_quarters = position.max() + 1 if len(position) else 0
+
+        panel = cls(firms, columns, n_quarters, firm_col)
+        # Scattered straight into the segments, no private tensor in between
+        panel.arrays["x"][codes, position] = values
+        panel.arrays["y"][codes, position] = price
+
+        return panel
+
+    def blocks(self, block_firms=BLOCK_FIRMS, block_columns=BLOCK_COLUMNS):
+        '''
+        Function will split the (ticker, variable) grid into worker tasks
+
+        Function will take the firms and variables per task
+
+        Function will return a list of (firm start, firm stop, column start,
+        column stop) tuples
+        '''
+        return [(f, min(f + block_firms, len(self.firms)),
+                 c, min(c + block_columns, len(self.columns)))
+                for f in range(0, len(self.firms), block_firms)
+                for c in range(0, len(self.columns), block_columns)]
+
+    def scan(self, workers=None, top_k=20, min_periods=MIN_PERIODS,
+             block_firms=BLOCK_FIRMS, block_columns=BLOCK_COLUMNS):
+        '''
+        Function will correlate every variable with the price for every
+        ticker in a pool of workers attached to the shared panel
+
+        Function will take the number of worker processes (all cores if
+        None, 1 runs in this process), how many variables to keep per ticker
+        (all if None), the minimum overlapping quarters and the firms and
+        variables per task
+
+        Function will return the scan.scan_correlations table
+        '''
+        if workers is None:
+            workers = os.cpu_count() or 1
+        tasks = [block + (min_periods,)
+                 for block in self.blocks(block_firms, block_columns)]
+
+        if workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                scan_block(task, self.arrays)
+        else:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                       initializer=attach,
+                                       initargs=(self.specs,))
+            # Leaving the with block waits for every worker to detach
+            with pool:
+                for _ in pool.map(scan_block, tasks,
+                                  chunksize=max(1, len(tasks) //
+                                                (4 * workers))):
+                    pass
+
+        # Copied out so the table outlives the segments
+        return rank_correlations(self.firms, self.columns,
+                                 self.arrays["r"].copy(),
+                                 self.arrays["n"].copy(), self.firm_col, top_k)
+
+    def close(self):
+        '''
+        Function will release the shared memory
+
+        Function will take nothing
+
+        Function will return nothing; the segments are unlinked and the
+        arrays can no longer be used
+        '''
+        self.arrays = {}
+        for segment in self.segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # A caller still holds a view, the mapping goes with it
+                pass
+            if os.getpid() != self.owner:
+                continue
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # Only a fallback for panels that were never closed
+        if getattr(self, "segments", None):
+            self.close()
+
+
+def attach(specs):
+    '''
+    Function will map a SharedPanel's segments into a worker process
+
+    Function will take the dict of array name to (segment name, shape)
+
+    Function will return nothing and just fill the worker's attached arrays
+    '''
+    segments = []
+    for name, (segment_name, shape) in specs.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        segments.append(segment)
+        _ATTACHED[name] = np.ndarray(shape, dtype=float, buffer=segment.buf)
+    # Keeps the mappings open for as long as the worker lives
+    _ATTACHED["segments"] = segments
+
+
+def scan_block(task, arrays=None):
+    '''
+    Function will correlate one block of the (ticker, variable) grid
+
+    Function will take a (firm start, firm stop, column start, column stop,
+    min periods) tuple and the arrays to use (the worker's attached ones if
+    None)
+
+    Function will return nothing and just write the block's correlations and
+    overlapping quarters into the r and n arrays
+    '''
+    if arrays is None:
+        arrays = _ATTACHED
+    f0, f1, c0, c1, min_periods = task
+
+    r, n = nan_corr(arrays["x"][f0:f1, :, c0:c1], arrays["y"][f0:f1],
+                    min_periods)
+    arrays["r"][f0:f1, c0:c1] = r[..., 0]
+    arrays["n"][f0:f1, c0:c1] = n[..., 0]
+
+
+def shared_scan(df, columns=None, target="stock_price", firm_col="tic",
+                top_k=20, min_periods=MIN_PERIODS, workers=None,
+                block_firms=BLOCK_FIRMS, block_columns=BLOCK_COLUMNS):
+    '''
+    Function will run scan_correlations on a pool of workers sharing one
+    copy of the panel
+
+    Function will take the scan_correlations arguments, the number of worker
+    processes (all cores if None) and the firms and variables per task
+
+    Function will return the scan_correlations table
+    '''
+    with SharedPanel.from_frame(df, columns, target, firm_col) as panel:
+        return panel.scan(workers, top_k, min_periods, block_firms,
+                          block_columns)
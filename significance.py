@@ -0,0 +1,267 @@
+'''
+Permutation and block-bootstrap significance for correlations
+
+With 20 to 84 quarterly points and hundreds of candidate variables most
+ correlations we see are noise. For every (ticker, variable) pair we compare
+ the observed correlation with thousands of correlations on shuffled prices
+ (p-value) and on block-resampled quarters (confidence interval), then
+ correct the p-values for the whole scan with Benjamini-Hochberg.
+Firms are resampled together in batches of similar length. Permutations
+ are a (firms, resamples, quarters) index tensor shuffling each firm's own
+ priced quarters; every shuffled price series becomes one column, so a batch
+ of permutations is a single scan.pairwise_moments product. Block-bootstrap
+ resamples are the same kind of index tensor, turned into counts of how often
+ each quarter is drawn, so their moment sums are one product of those counts
+ with the per-quarter terms. Neither ever loops over resamples in Python.
+'''
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from scan import (MIN_PERIODS, corr_from_moments, nan_corr, pairwise_moments,
+                  scan_inputs, standardize, to_tensor)
+
+N_RESAMPLES = 2000
+
+# Quarters per bootstrap block, so a year of autocorrelation stays together
+BLOCK = 4
+
+# Most values one batch of resamples may hold in a single array
+MAX_BATCH_VALUES = 4000000
+
+
+def _batch_size(n_values):
+    '''
+    Function will work out how many resamples fit in one batch
+
+    Function will take how many values one resample needs
+
+    Function will return a batch size of at least 1
+    '''
+    return max(1, MAX_BATCH_VALUES // max(n_values, 1))
+
+
+def fdr_bh(pvalues):
+    '''
+    Function will correct p-values for testing many variables at once with
+    the Benjamini-Hochberg false discovery rate procedure
+
+    Function will take an array of p-values (NaN ones are ignored)
+
+    Function will return an array of q-values in the same order
+    '''
+    pvalues = np.asarray(pvalues, dtype=float)
+    qvalues = np.full(pvalues.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(pvalues))
+    if len(valid) == 0:
+        return qvalues
+
+    order = valid[np.argsort(pvalues[valid], kind="stable")]
+    ranked = pvalues[order] * len(valid) / np.arange(1, len(valid) + 1)
+    # Running minimum from the largest p-value down keeps q monotone
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    qvalues[order] = np.minimum(ranked, 1.0)
+
+    return qvalues
+
+
+def _firm_permutations(lengths, n_quarters, n_resamples, rng):
+    '''
+    Function will make random permutations of every firm's own quarters
+
+    Function will take each firm's number of quarters, the padded number of
+    quarters, the number of permutations and a numpy random generator
+
+    Function will return an int array shaped (firms, n_resamples, quarters);
+    the padding slots past a firm's length stay at the end
+    '''
+    keys = rng.random((len(lengths), n_resamples, n_quarters))
+    keys = np.where(np.arange(n_quarters) >= lengths[:, None, None], np.inf,
+                    keys)
+
+    return np.argsort(keys, axis=-1)
+
+
+def _firm_blocks(lengths, n_quarters, n_resamples, rng, block=BLOCK):
+    '''
+    Function will make moving-block bootstrap resamples of every firm's own
+    quarters
+
+    Function will take each firm's number of quarters, the padded number of
+    quarters, the number of resamples, a numpy random generator and the block
+    length in quarters
+
+    Function will return an int array shaped (firms, n_resamples, quarters);
+    slots past a firm's length point at n_quarters, an all-NaN padding row
+    '''
+    blocks = np.maximum(1, np.minimum(block, lengths))
+    n_blocks = max(1, int(np.max(-(-lengths // blocks), initial=1)))
+    starts = np.floor(rng.random((len(lengths), n_resamples, n_blocks)) *
+                      (lengths - blocks + 1)[:, None, None]).astype(np.int64)
+
+    slot = np.arange(n_quarters)
+    # Padding slots past a short firm's last block are overwritten below
+    which = np.minimum(slot // blocks[:, None], n_blocks - 1)
+    offset = slot % blocks[:, None]
+    idx = np.take_along_axis(
+        starts, np.broadcast_to(which[:, None, :],
+                                (len(lengths), n_resamples, n_quarters)),
+        axis=-1) + offset[:, None, :]
+
+    return np.where(slot < lengths[:, None, None], idx, n_quarters)
+
+
+def _resample_counts(idx, n_quarters):
+    '''
+    Function will count how often each quarter is drawn in every resample
+
+    Function will take the (firms, resamples, quarters) index array from
+    _firm_blocks and the padded number of quarters
+
+    Function will return a float array shaped (firms, resamples, quarters)
+    '''
+    n_firms, n_resamples = idx.shape[:2]
+    flat = idx.reshape(n_firms * n_resamples, -1) + \
+        (n_quarters + 1) * np.arange(n_firms * n_resamples)[:, None]
+    counts = np.bincount(flat.ravel(),
+                         minlength=n_firms * n_resamples * (n_quarters + 1))
+
+    # The last slot of every resample is the padding row, dropped here
+    return counts.reshape(n_firms, n_resamples, n_quarters + 1)[
+        ..., :n_quarters].astype(float)
+
+
+def _count_parts(x, y):
+    '''
+    Function will lay out the per-quarter terms of the pairwise moment sums
+
+    Function will take x shaped (firms, quarters, p) and y shaped (firms,
+    quarters, 1), NaN marking a missing value
+
+    Function will return an array shaped (firms, quarters, 6 * p) holding,
+    for quarters where both values exist, 1, x, y, x ** 2, y ** 2 and x * y
+    '''
+    pair = np.isfinite(x) & np.isfinite(y)
+    x0 = np.where(pair, x, 0.0)
+    y0 = np.where(pair, y, 0.0)
+
+    return np.concatenate([pair.astype(float), x0, y0, x0 ** 2, y0 ** 2,
+                           x0 * y0], axis=-1)
+
+
+def significance_scan(df, columns=None, target="stock_price", firm_col="tic",
+                      n_permutations=N_RESAMPLES, n_bootstrap=N_RESAMPLES,
+                      block=BLOCK, alpha=0.05, seed=None,
+                      min_periods=MIN_PERIODS, batch_size=64):
+    '''
+    Function will attach p-values, confidence intervals and FDR-corrected
+    q-values to the correlation of every column with the stock price for
+    every ticker
+
+    Function will take a dataframe holding one or many firms sorted by firm
+    and date, the columns to test (every numeric column and computable
+    registered ratio if None), the target column, the firm column, the
+    number of permutations and bootstrap resamples, the bootstrap block
+    length, the significance level, a random seed, the minimum overlapping
+    quarters and how many firms to resample together
+
+    Function will return a dataframe with one row per (ticker, variable)
+    sorted by q-value
+    '''
+    firms, columns, codes, position, values, price = scan_inputs(
+        df, columns, target, firm_col)
+    rng = np.random.default_rng(seed)
+
+    # Quarters without a price can't take part in any resample, so every
+    # firm's priced quarters are packed to the front of its row
+    has_price = ~np.isnan(price[:, 0])
+    codes = codes[has_price]
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    x = to_tensor(values[has_price], codes, position, len(firms))
+    y = to_tensor(price[has_price], codes, position, len(firms))[..., 0]
+    lengths = np.bincount(codes, minlength=len(firms))
+    # Firms of similar length share a batch, so little padding is resampled
+    order = np.argsort(lengths, kind="stable")
+
+    corr = np.full((len(firms), len(columns)), np.nan)
+    count = np.zeros((len(firms), len(columns)))
+    pvalues = np.full((len(firms), len(columns)), np.nan)
+    low = np.full((len(firms), len(columns)), np.nan)
+    high = np.full((len(firms), len(columns)), np.nan)
+
+    for f0 in range(0, len(firms), batch_size):
+        batch = order[f0:f0 + batch_size]
+        firm_len = lengths[batch]
+        n_quarters = max(int(firm_len.max()), 1)
+        firm_x = x[batch, :n_quarters]
+        firm_y = y[batch, :n_quarters]
+        rows = np.arange(len(batch))[:, None, None]
+
+        observed, n = nan_corr(firm_x, firm_y[..., None], min_periods)
+        observed = observed[..., 0]
+        corr[batch] = observed
+        count[batch] = n[..., 0]
+
+        # Standardized once; correlations don't change under rescaling, and
+        # the moment sums stay well conditioned in every resample
+        std_x = standardize(firm_x)
+        std_y = standardize(firm_y[..., None])[..., 0]
+
+        exceed = np.zeros(observed.shape)
+        # Each permutation adds a column of prices and a row of results
+        step = _batch_size(len(batch) * (n_quarters + len(columns)))
+        for start in range(0, n_permutations, step):
+            idx = _firm_permutations(firm_len, n_quarters,
+                                     min(step, n_permutations - start), rng)
+            # Every shuffled price series is one column, so a whole batch of
+            # permutations for a batch of firms is one batched product
+            shuffled = corr_from_moments(
+                pairwise_moments(std_x, np.swapaxes(std_y[rows, idx], 1, 2)),
+                min_periods)
+            exceed += np.sum(np.abs(shuffled) >= np.abs(observed)[..., None] -
+                             1e-12, axis=-1)
+        firm_p = (exceed + 1) / (n_permutations + 1)
+        firm_p[np.isnan(observed)] = np.nan
+        pvalues[batch] = firm_p
+
+        # A resample is how often it draws each quarter, so its moment sums
+        # are those counts times the per-quarter terms: one batched product
+        # instead of gathering a copy of the panel per resample
+        parts = _count_parts(std_x, std_y[..., None])
+        p = len(columns)
+        draws = np.empty((len(batch), n_bootstrap, p))
+        # Each resample adds a row of counts and a row of moment sums
+        step = _batch_size(len(batch) * (n_quarters + parts.shape[-1]))
+        for start in range(0, n_bootstrap, step):
+            stop = min(start + step, n_bootstrap)
+            idx = _firm_blocks(firm_len, n_quarters, stop - start, rng, block)
+            sums = _resample_counts(idx, n_quarters) @ parts
+            moments = {name: sums[..., i * p:(i + 1) * p] for i, name in
+                       enumerate(("n", "sx", "sy", "sxx", "syy", "sxy"))}
+            draws[:, start:stop] = corr_from_moments(moments, min_periods)
+
+        with np.errstate(invalid="ignore"):
+            valid = np.isfinite(draws).any(axis=1)
+            if valid.any():
+                bounds = np.nanquantile(np.moveaxis(draws, 1, 0)[:, valid],
+                                        [alpha / 2, 1 - alpha / 2], axis=0)
+                batch_low = np.full(valid.shape, np.nan)
+                batch_high = np.full(valid.shape, np.nan)
+                batch_low[valid] = bounds[0]
+                batch_high[valid] = bounds[1]
+                low[batch] = batch_low
+                high[batch] = batch_high
+
+    table = pd.DataFrame({
+        firm_col: np.repeat(firms, len(columns)),
+        "variable": np.tile(np.asarray(columns, dtype=object), len(firms)),
+        "corr": corr.ravel(), "n": count.ravel().astype(int),
+        "p_value": pvalues.ravel(), "ci_low": low.ravel(),
+        "ci_high": high.ravel(),
+    })
+    table = table.dropna(subset=["corr"]).reset_index(drop=True)
+    # One correction across every ticker and variable in the scan
+    table["q_value"] = fdr_bh(table["p_value"].to_numpy())
+    table["significant"] = table["q_value"] <= alpha
+
+    return table.sort_values("q_value", kind="stable").reset_index(drop=True)
@@ -0,0 +1,447 @@
+'''
+Streaming price updates with running correlations and fits
+
+Correlations used to come from one static price file, so any new price meant
+ a full re-run. This mode loads the panels of a manifest once (see
+ service.load_panel), seeds running moments for every (ticker, variable)
+ pair from the history, and then consumes price ticks from a local feed: a
+ replayed price file or a TCP socket taking "TICKER,DATE,PRICE" lines.
+Prices are matched to quarters the way prices.PERIOD_MODE does it: a tick
+ becomes its calendar quarter's price (the last tick seen wins) and is paired
+ with the latest fundamentals filed in or before that quarter. A tick for a
+ quarter already counted takes the old pair out and puts the new one in,
+ a tick for a new quarter adds a pair, so the count, means, sums of squares
+ and co-moment of every pair are kept with Welford's updates in O(1) per
+ pair, one vectorized step over all of a ticker's variables per tick.
+Correlations and fits (variable = slope * price + intercept, like
+ regression.fit_panel) are worked out from the moments only when a snapshot
+ is asked for, either by StreamState.snapshot() or by sending "snapshot
+ [TICKER ...]" to the socket, which answers with one line of JSON.
+
+    python stream.py manifest.csv --replay AAPL_Project.csv --ticker AAPL
+    python stream.py manifest.csv --listen 8766
+'''
+
+import argparse
+import asyncio
+import json
+import time
+
+import pandas as pd  # useful library to handle dataframe
+import numpy as np  # useful library to handle array and computation
+
+from periods import CAL_PERIOD, MISSING_PERIOD, add_period_index, quarter_key
+from scan import MIN_PERIODS, numeric_columns
+from service import HOST, load_panel, to_records
+
+PORT = 8766
+
+# Ticks waiting to be applied before the feed is made to wait
+QUEUE_SIZE = 10000
+
+
+class RunningMoments:
+    '''
+    Welford running moments of price against many variables of one ticker
+    '''
+
+    def __init__(self, n_columns):
+        self.n = np.zeros(n_columns)
+        self.mean_price = np.zeros(n_columns)
+        self.mean_value = np.zeros(n_columns)
+        self.m2_price = np.zeros(n_columns)
+        self.m2_value = np.zeros(n_columns)
+        self.comoment = np.zeros(n_columns)
+
+    def update(self, price, values, sign=1):
+        '''
+        Function will add (sign 1) or take out (sign -1) one quarter's pairs
+
+        Function will take the quarter's price, the array of its variable
+        values and the sign (pairs with a missing value are left alone)
+
+        Function will return nothing and just update the moments
+        '''
+        if not np.isfinite(price):
+            return
+        valid = np.isfinite(values)
+        values = np.where(valid, values, 0.0)
+        step = sign * valid
+
+        n = self.n + step
+        with np.errstate(invalid="ignore", divide="ignore"):
+            d_price = np.where(valid, price - self.mean_price, 0.0)
+            d_value = np.where(valid, values - self.mean_value, 0.0)
+            mean_price = np.where(n > 0, self.mean_price + step * d_price / n,
+                                  0.0)
+            mean_value = np.where(n > 0, self.mean_value + step * d_value / n,
+                                  0.0)
+
+        # The same update undoes itself: for a removal (x - old mean) *
+        # (y - new mean) equals (x - new mean) * (y - old mean)
+        self.m2_price += step * d_price * (price - mean_price)
+        self.m2_value += step * d_value * (values - mean_value)
+        self.comoment += step * d_price * (values - mean_value)
+        self.n = n
+        self.mean_price = mean_price
+        self.mean_value = mean_value
+
+        # An emptied pair starts again from exact zeros
+        empty = n <= 0
+        if empty.any():
+            for moment in (self.m2_price, self.m2_value, self.comoment):
+                moment[empty] = 0.0
+
+    def fits(self, min_periods=MIN_PERIODS):
+        '''
+        Function will turn the moments into correlations and lines of best
+        fit
+
+        Function will take the minimum number of quarters for a correlation
+
+        Function will return a dict of arrays: corr, slope, intercept, r2
+        and n
+        '''
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = self.comoment / self.m2_price
+            intercept = self.mean_value - slope * self.mean_price
+            corr = self.comoment / np.sqrt(self.m2_price * self.m2_value)
+
+        # Tiny variances are rounding noise on a constant column
+        bad = (self.n < 2) | ~(self.m2_price > 1e-12 * self.n)
+        slope[bad] = np.nan
+        intercept[bad] = np.nan
+        corr[bad | (self.n < min_periods) |
+             ~(self.m2_value > 1e-12 * self.n)] = np.nan
+        corr = np.clip(corr, -1.0, 1.0)
+
+        return {"corr": corr, "slope": slope, "intercept": intercept,
+                "r2": corr ** 2, "n": self.n.astype(int)}
+
+
+class StreamState:
+    '''
+    Running moments of every (ticker, variable) pair, updated tick by tick
+    '''
+
+    def __init__(self, panel, columns=None, target="stock_price",
+                 firm_col="tic"):
+        add_period_index(panel)
+        self.columns = list(columns) if columns is not None else \
+            numeric_columns(panel, target)
+        self.firm_col = firm_col
+        self.firms = {}
+        self.ticks = 0
+        self.skipped = 0
+
+        for firm, rows in panel.groupby(firm_col, sort=True):
+            rows = rows[rows[CAL_PERIOD] != MISSING_PERIOD]
+            rows = rows.sort_values(CAL_PERIOD, kind="stable")
+            state = {
+                "periods": rows[CAL_PERIOD].to_numpy(dtype=np.int64),
+                "values": rows[self.columns].to_numpy(dtype=float,
+                                                      na_value=np.nan),
+                "moments": RunningMoments(len(self.columns)),
+                # Quarter -> (fundamentals row, price) of every pair counted
+                "quarters": {},
+                "last_price": np.nan,
+                "last_date": None,
+            }
+            self.firms[firm] = state
+            prices = rows[target].to_numpy(dtype=float, na_value=np.nan)
+            for row, (period, price) in enumerate(zip(state["periods"],
+                                                      prices)):
+                if np.isfinite(price):
+                    self._apply(state, int(period), row, price)
+
+    def _apply(self, state, period, row, price):
+        '''
+        Function will make a price the one counted for a quarter
+
+        Function will take the ticker's state, the quarter's period key, the
+        fundamentals row to pair it with and the price
+
+        Function will return nothing and just update the moments
+        '''
+        values = state["values"][row]
+        old = state["quarters"].get(period)
+        if old is not None:
+            state["moments"].update(old[1], state["values"][old[0]], -1)
+        state["moments"].update(price, values, 1)
+        state["quarters"][period] = (row, price)
+
+    def update(self, ticker, date, price):
+        '''
+        Function will apply one price tick
+
+        Function will take the ticker, the tick's date (text or datetime)
+        and the price
+
+        Function will return True if the tick was applied, False if it was
+        skipped (unknown ticker, bad price or no fundamentals filed yet)
+        '''
+        state = self.firms.get(ticker)
+        price = float(price)
+        if state is None or not np.isfinite(price):
+            self.skipped += 1
+            return False
+
+        date = pd.Timestamp(date)
+        period = int(quarter_key(date.year, (date.month - 1) // 3 + 1))
+        # Latest fundamentals filed in or before the tick's quarter
+        row = np.searchsorted(state["periods"], period, side="right") - 1
+        if row < 0:
+            self.skipped += 1
+            return False
+
+        self._apply(state, period, row, price)
+        state["last_price"] = price
+        state["last_date"] = date
+        self.ticks += 1
+
+        return True
+
+    def snapshot(self, tickers=None, top_k=None, min_periods=MIN_PERIODS):
+        '''
+        Function will publish the current correlations and fits
+
+        Function will take the tickers to report (all if None), how many
+        variables to keep per ticker by absolute correlation (all if None)
+        and the minimum number of quarters for a correlation
+
+        Function will return a dataframe with one row per (ticker, variable):
+        corr, slope, intercept, r2, n and the ticker's last tick
+        '''
+        if tickers is None:
+            tickers = list(self.firms)
+        tables = []
+        for ticker in tickers:
+            state = self.firms.get(ticker)
+            if state is None:
+                continue
+            table = pd.DataFrame(state["moments"].fits(min_periods))
+            table.insert(0, "variable", self.columns)
+            table.insert(0, self.firm_col, ticker)
+            table["price"] = state["last_price"]
+            table["as_of"] = state["last_date"]
+            table = table.dropna(subset=["corr"])
+            table = table.iloc[np.argsort(-table["corr"].abs().to_numpy(),
+                                          kind="stable")]
+            if top_k is not None:
+                table = table.head(top_k)
+            tables.append(table)
+
+        if not tables:
+            return pd.DataFrame()
+
+        return pd.concat(tables, ignore_index=True)
+
+    def stats(self):
+        '''
+        Function will count what the stream has done
+
+        Function will take nothing
+
+        Function will return a dict of tickers, ticks applied and skipped
+        '''
+        return {"tickers": len(self.firms), "ticks": self.ticks,
+                "skipped": self.skipped}
+
+
+def parse_tick(line):
+    '''
+    Function will read one "TICKER,DATE,PRICE" feed line
+
+    Function will take the line
+
+    Function will return a (ticker, date, price) tuple
+    '''
+    ticker, date, price = [part.strip() for part in line.split(",")]
+
+    return ticker, date, float(price)
+
+
+async def replay(path, queue, ticker=None, price_col="Adj Close",
+                 date_col="Date", ticker_col="tic", interval=0.0):
+    '''
+    Function will feed a price file into the stream as ticks
+
+    Function will take the csv file (laid out like AAPL_Project.csv), the
+    queue to put ticks on, the ticker (None if the file has a ticker
+    column), the price, date and ticker columns and the seconds to wait
+    between ticks
+
+    Function will return the number of ticks sent
+    '''
+    prices = pd.read_csv(path)
+    tickers = prices[ticker_col] if ticker is None else \
+        [ticker] * len(prices)
+
+    sent = 0
+    for tic, date, price in zip(tickers, prices[date_col], prices[price_col]):
+        await queue.put((tic, date, price))
+        sent += 1
+        # Always yields, so snapshots can be answered mid-replay
+        await asyncio.sleep(interval)
+
+    return sent
+
+
+async def consume(state, queue):
+    '''
+    Function will apply ticks from the feed as they arrive
+
+    Function will take the StreamState and the queue of ticks (a None tick
+    stops it, a future is a marker that is set once every tick queued
+    before it has been applied)
+
+    Function will return nothing
+    '''
+    while True:
+        tick = await queue.get()
+        try:
+            if tick is None:
+                return
+            if isinstance(tick, asyncio.Future):
+                if not tick.done():
+                    tick.set_result(None)
+                continue
+            state.update(*tick)
+        except (ValueError, TypeError):
+            state.skipped += 1
+        finally:
+            queue.task_done()
+
+
+async def feed_socket(state, queue, host=HOST, port=PORT):
+    '''
+    Function will accept ticks and snapshot requests on a local TCP socket
+
+    Function will take the StreamState, the queue of ticks and the host and
+    port (port 0 picks a free one)
+
+    Function will return the asyncio server; every connection sends lines of
+    "TICKER,DATE,PRICE", or "snapshot [TICKER ...]" to get the current
+    values back as one line of JSON
+    '''
+    async def handle(reader, writer):
+        try:
+            async for raw in reader:
+                try:
+                    line = raw.decode("utf-8").strip()
+                except UnicodeDecodeError:
+                    state.skipped += 1
+                    continue
+                if not line:
+                    continue
+                words = line.split()
+                if words[0].lower() == "snapshot":
+                    # Ticks queued before the request are applied first; a
+                    # marker waits for those only, not for whatever other
+                    # connections keep sending meanwhile
+                    applied = asyncio.get_running_loop().create_future()
+                    await queue.put(applied)
+                    await applied
+                    table = state.snapshot(words[1:] or None)
+                    reply = {"stats": state.stats(),
+                             "results": to_records(table)}
+                    writer.write((json.dumps(reply, allow_nan=False) +
+                                  "\n").encode("utf-8"))
+                    await writer.drain()
+                    continue
+                try:
+                    await queue.put(parse_tick(line))
+                except ValueError:
+                    state.skipped += 1
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def run(state, replays=(), listen=None, interval=0.0):
+    '''
+    Function will run the feeds until the replays are done (or forever when
+    listening on a socket)
+
+    Function will take the StreamState, a list of (file, ticker) to replay,
+    the port to listen on (no socket if None) and the seconds between
+    replayed ticks
+
+    Function will return nothing
+    '''
+    queue = asyncio.Queue(QUEUE_SIZE)
+    consumer = asyncio.create_task(consume(state, queue))
+
+    server = None
+    if listen is not None:
+        server = await feed_socket(state, queue, HOST, listen)
+        print("Streaming on %s:%d" % (HOST, server.sockets[0].getsockname()[1]))
+
+    try:
+        await asyncio.gather(*[replay(path, queue, ticker, interval=interval)
+                               for path, ticker in replays])
+        if server is not None:
+            await server.serve_forever()
+        await queue.put(None)
+        await consumer
+    finally:
+        consumer.cancel()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+def main(argv=None):
+    '''
+    Function will load the panels and stream price updates into them
+
+    Function will take the argument list (sys.argv if None)
+
+    Function will return nothing
+    '''
+    parser = argparse.ArgumentParser(
+        description="Keep correlations current as price ticks arrive")
+    parser.add_argument("manifest", help="csv or json list of companies")
+    parser.add_argument("--replay", nargs="+", default=[],
+                        help="price files to replay as ticks")
+    parser.add_argument("--ticker", nargs="+", default=None,
+                        help="ticker of each replayed file (files need a tic "
+                             "column if left out)")
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="seconds between replayed ticks")
+    parser.add_argument("--listen", type=int, default=None,
+                        help="port to take ticks and snapshot requests on")
+    parser.add_argument("--columns", nargs="+", default=None,
+                        help="variables to track (every numeric column if "
+                             "left out)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="variables per ticker in the final snapshot")
+    args = parser.parse_args(argv)
+
+    tickers = args.ticker or [None] * len(args.replay)
+    if len(tickers) != len(args.replay):
+        parser.error("give one --ticker per --replay file")
+
+    start = time.perf_counter()
+    state = StreamState(load_panel(args.manifest), args.columns)
+    print("Seeded %d tickers x %d variables in %.2fs"
+          % (len(state.firms), len(state.columns),
+             time.perf_counter() - start))
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(run(state, list(zip(args.replay, tickers)), args.listen,
+                        args.interval))
+    except KeyboardInterrupt:
+        pass
+
+    elapsed = time.perf_counter() - start
+    stats = state.stats()
+    print("Applied %d ticks (%d skipped) in %.2fs"
+          % (stats["ticks"], stats["skipped"], elapsed))
+    print(state.snapshot(top_k=args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
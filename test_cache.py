@@ -0,0 +1,120 @@
+'''
+Tests for the entry invalidation and concurrency handling in cache.py
+'''
+
+import os
+
+import cache
+
+
+def write_csv(path, rows):
+    with open(path, "w") as outfile:
+        outfile.write("tic,value\n")
+        for tic, value in rows:
+            outfile.write("%s,%s\n" % (tic, value))
+
+
+def load(path, cache_dir):
+    df = cache.load_cached(str(path), cache_dir=str(cache_dir))
+    manifest = cache._read_manifest(cache.entry_dir(str(path), str(cache_dir)))
+
+    return df, manifest
+
+
+def test_size_change_rebuilds(tmp_path):
+    path = tmp_path / "data.csv"
+    write_csv(path, [("AAPL", 1.0)])
+    _, first = load(path, tmp_path / "cache")
+
+    write_csv(path, [("AAPL", 1.0), ("GOOGL", 2.0)])
+    df, second = load(path, tmp_path / "cache")
+
+    assert list(df["tic"]) == ["AAPL", "GOOGL"]
+    assert second["size"] != first["size"]
+    assert second["hash"] != first["hash"]
+
+
+def test_mtime_change_same_content_keeps_entry(tmp_path):
+    path = tmp_path / "data.csv"
+    write_csv(path, [("AAPL", 1.0)])
+    _, first = load(path, tmp_path / "cache")
+    entry = cache.entry_dir(str(path), str(tmp_path / "cache"))
+    column = os.path.join(entry, first["columns"][0]["file"])
+    built = os.stat(column).st_ino
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    df, second = load(path, tmp_path / "cache")
+
+    assert list(df["value"]) == [1.0]
+    assert second["hash"] == first["hash"]
+    assert second["mtime_ns"] == os.stat(path).st_mtime_ns
+    # Same column files, only the manifest was refreshed
+    assert os.stat(column).st_ino == built
+
+
+def test_content_change_same_size_rebuilds(tmp_path):
+    path = tmp_path / "data.csv"
+    write_csv(path, [("AAPL", 1.0)])
+    _, first = load(path, tmp_path / "cache")
+
+    stat = os.stat(path)
+    write_csv(path, [("AAPL", 3.0)])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    df, second = load(path, tmp_path / "cache")
+
+    assert list(df["value"]) == [3.0]
+    assert second["size"] == first["size"]
+    assert second["hash"] != first["hash"]
+
+
+def test_unchanged_load_leaves_manifest(tmp_path):
+    path = tmp_path / "data.csv"
+    write_csv(path, [("AAPL", 1.0)])
+    load(path, tmp_path / "cache")
+    manifest = os.path.join(cache.entry_dir(str(path), str(tmp_path / "cache")),
+                            cache.MANIFEST)
+    written = os.stat(manifest).st_mtime_ns
+
+    load(path, tmp_path / "cache")
+
+    assert os.stat(manifest).st_mtime_ns == written
+    assert not [name for name in os.listdir(os.path.dirname(manifest))
+                if name.endswith(".tmp")]
+
+
+def test_lost_publish_race_uses_existing_entry(tmp_path, monkeypatch):
+    path = tmp_path / "data.csv"
+    write_csv(path, [("AAPL", 1.0)])
+    cache_dir = tmp_path / "cache"
+    winner = cache.build_entry(str(path), str(cache_dir))
+    entry = cache.entry_dir(str(path), str(cache_dir))
+
+    # A build dir that cannot replace the entry, as if another process
+    # published between our rmtree and rename
+    loser = cache_dir / ".build-loser"
+    loser.mkdir()
+    (loser / "c00000.npy").write_bytes(b"")
+    real_rmtree = cache.shutil.rmtree
+    monkeypatch.setattr(
+        cache.shutil, "rmtree", lambda target, ignore_errors=False:
+        None if target == entry else real_rmtree(target, ignore_errors))
+    manifest = cache._publish(str(loser), entry, {"hash": "loser"})
+    monkeypatch.undo()
+
+    assert manifest["hash"] == winner["hash"]
+    assert not loser.exists()
+
+
+def test_evict_removes_stale_build_dirs(tmp_path):
+    stale = tmp_path / ".build-stale"
+    fresh = tmp_path / ".build-fresh"
+    stale.mkdir()
+    fresh.mkdir()
+    old = os.stat(stale).st_mtime - 2 * cache.STALE_BUILD_SECONDS
+    os.utime(stale, (old, old))
+
+    removed = cache.evict(str(tmp_path))
+
+    assert removed == [str(stale)]
+    assert fresh.exists()
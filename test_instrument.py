@@ -0,0 +1,77 @@
+'''
+Tests for the span memory accounting in instrument.py
+'''
+
+import threading
+import tracemalloc
+
+import numpy as np  # useful library to handle array and computation
+
+import instrument
+
+MB = 1024 * 1024
+
+
+def test_parent_peak_survives_nested_span():
+    instrument.enable(memory=True)
+    try:
+        with instrument.span("parent"):
+            block = np.ones(50 * MB // 8)
+            del block
+            with instrument.span("child"):
+                small = np.ones(1000)
+                del small
+    finally:
+        tracer = instrument.disable()
+
+    peaks = {event["name"]: event["args"]["peak_bytes"]
+             for event in tracer.events}
+    assert peaks["parent"] >= 50 * MB
+    assert peaks["child"] < MB
+
+
+def test_child_peak_reaches_parent():
+    instrument.enable(memory=True)
+    try:
+        with instrument.span("parent"):
+            with instrument.span("child"):
+                block = np.ones(20 * MB // 8)
+                del block
+    finally:
+        tracer = instrument.disable()
+
+    peaks = {event["name"]: event["args"]["peak_bytes"]
+             for event in tracer.events}
+    assert peaks["child"] >= 20 * MB
+    assert peaks["parent"] >= 20 * MB
+
+
+def test_disable_leaves_callers_tracemalloc_running():
+    tracemalloc.start()
+    try:
+        instrument.enable(memory=True)
+        instrument.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_other_thread_span_keeps_main_peak():
+    def work():
+        with instrument.span("worker"):
+            pass
+
+    instrument.enable(memory=True)
+    try:
+        with instrument.span("main"):
+            block = np.ones(30 * MB // 8)
+            del block
+            worker = threading.Thread(target=work)
+            worker.start()
+            worker.join()
+    finally:
+        tracer = instrument.disable()
+
+    args = {event["name"]: event["args"] for event in tracer.events}
+    assert args["main"]["peak_bytes"] >= 30 * MB
+    assert "peak_bytes" not in args["worker"]
@@ -0,0 +1,108 @@
+'''
+Year-to-date de-cumulation and trailing-twelve-month sums
+
+Compustat's *y fields (oancfy, ivncfy, fincfy, capxy, ...) are year-to-date:
+ the Q4 value is the whole fiscal year, so it is about four times Q1. This
+ stage turns them into discrete quarterly values (<field>_q) by subtracting
+ the previous fiscal quarter of the same fiscal year, and into trailing
+ twelve month sums (<field>_ttm) over the last four consecutive quarters.
+It runs over a whole multi-firm panel with shifted NumPy arrays (no groupby
+ loop) and writes the columns onto the dataframe once, so every ratio built
+ on them reads the stored columns instead of recomputing.
+'''
+
+import numpy as np  # useful library to handle array and computation
+
+# Year-to-date cash flow fields used by cf_capex
+CASH_FLOW_FIELDS = ("oancfy", "ivncfy", "fincfy", "capxy")
+
+QUARTERLY_SUFFIX = "_q"
+TTM_SUFFIX = "_ttm"
+
+FIRM_COL = "gvkey"
+
+
+def source_column(name):
+    '''
+    Function will find the year-to-date field a derived column comes from
+
+    Function will take a column name
+
+    Function will return the source field for a <field>_q or <field>_ttm
+    column, or None for any other column
+    '''
+    for suffix in (QUARTERLY_SUFFIX, TTM_SUFFIX):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+
+    return None
+
+
+def _shifted(values, lag):
+    '''
+    Function will shift an array down by some rows, padding the top
+
+    Function will take a numpy array and how many rows to shift
+
+    Function will return a float array the same length
+    '''
+    out = np.full(len(values), np.nan)
+    if lag < len(values):
+        out[lag:] = values[:len(values) - lag]
+
+    return out
+
+
+def add_ytd_transforms(df, fields=CASH_FLOW_FIELDS, firm_col=FIRM_COL):
+    '''
+    Function will add quarterly and trailing twelve month versions of
+    year-to-date fields to a panel
+
+    Function will take a dataframe sorted by firm and date (with fyearq and
+    fqtr), the year-to-date fields and the firm column
+
+    Function will return nothing and just add <field>_q and <field>_ttm
+    columns to the dataframe (fields that already have both are skipped)
+    '''
+    fields = [field for field in fields
+              if field + QUARTERLY_SUFFIX not in df.columns or
+              field + TTM_SUFFIX not in df.columns]
+    if not fields or df.shape[0] == 0:
+        return
+
+    year = df["fyearq"].to_numpy(dtype=float)
+    quarter = df["fqtr"].to_numpy(dtype=float)
+    if firm_col in df.columns:
+        firm = df[firm_col].to_numpy()
+    else:
+        firm = np.zeros(df.shape[0])
+
+    # Fiscal period number, so consecutive quarters differ by exactly 1
+    period = year * 4 + quarter - 1
+    same_firm = np.zeros(df.shape[0], dtype=bool)
+    same_firm[1:] = firm[1:] == firm[:-1]
+
+    # Row i - 1 is the previous fiscal quarter of the same fiscal year
+    follows = same_firm & (period - _shifted(period, 1) == 1)
+    first_quarter = quarter == 1
+
+    # Rows i - 3 .. i are four consecutive quarters of the same firm
+    run = np.zeros(df.shape[0], dtype=bool)
+    if df.shape[0] > 3:
+        same_firm_4 = np.zeros(df.shape[0], dtype=bool)
+        same_firm_4[3:] = firm[3:] == firm[:-3]
+        run = same_firm_4 & (period - _shifted(period, 3) == 3)
+
+    new_columns = {}
+    for field in fields:
+        ytd = df[field].to_numpy(dtype=float)
+        quarterly = np.where(first_quarter, ytd,
+                             np.where(follows, ytd - _shifted(ytd, 1),
+                                      np.nan))
+        ttm = quarterly + _shifted(quarterly, 1) + _shifted(quarterly, 2) + \
+            _shifted(quarterly, 3)
+        new_columns[field + QUARTERLY_SUFFIX] = quarterly
+        new_columns[field + TTM_SUFFIX] = np.where(run, ttm, np.nan)
+
+    for name, values in new_columns.items():
+        df[name] = values